@@ -0,0 +1,178 @@
+"""Control de admision de los servidores. Reemplaza el limite fijo de 5 usuarios por valores que
+se configuran al arrancar (variables de entorno o argumentos de server_tcp/server_udp):
+
+- CHAT_MAX_USUARIOS: usuarios registrados a la vez
+- CHAT_MAX_CONEXIONES: sockets TCP abiertos a la vez (registrados o esperando el nombre)
+- CHAT_ACEPTACIONES_POR_SEGUNDO: ritmo maximo de conexiones/registros nuevos, 0 es sin limite
+- CHAT_MENSAJES_POR_SEGUNDO y CHAT_RAFAGA_MENSAJES: ritmo de mensajes de cada usuario y cuantos
+  puede mandar seguidos despues de estar un rato callado (0 es sin limite)
+- CHAT_MENSAJES_POR_SEGUNDO_IP y CHAT_RAFAGA_MENSAJES_IP: lo mismo sumando todos los clientes de
+  una misma IP (por defecto sin limite: detras de un NAT puede haber mucha gente)
+
+Un mensaje de mas se descarta antes de decodificarlo, asi un usuario que inunda el chat no le
+cuesta a los demas un broadcast por cada mensaje (ver LimiteMensajes).
+
+Los numeros conviene sacarlos de medir con benchmarks/carga.py."""
+import os
+import threading
+import time
+
+MAX_USUARIOS = int(os.environ.get("CHAT_MAX_USUARIOS", "5"))
+MAX_CONEXIONES = int(os.environ.get("CHAT_MAX_CONEXIONES", "1024"))
+ACEPTACIONES_POR_SEGUNDO = float(os.environ.get("CHAT_ACEPTACIONES_POR_SEGUNDO", "0"))
+MENSAJES_POR_SEGUNDO = float(os.environ.get("CHAT_MENSAJES_POR_SEGUNDO", "20"))
+RAFAGA_MENSAJES = float(os.environ.get("CHAT_RAFAGA_MENSAJES", "40"))
+MENSAJES_POR_SEGUNDO_IP = float(os.environ.get("CHAT_MENSAJES_POR_SEGUNDO_IP", "0"))
+RAFAGA_MENSAJES_IP = float(os.environ.get("CHAT_RAFAGA_MENSAJES_IP", "200"))
+
+"""Cantidad de cubetas por IP a partir de la cual se borran las que no se usan"""
+LIMPIEZA_CUBETAS = 1024
+
+
+def mensaje_lleno(max_usuarios):
+    return f"Servidor lleno. Maximo {max_usuarios} usuarios."
+
+
+class CubetaTokens:
+    """Cubeta de tokens: se llena a `tasa` tokens por segundo hasta `capacidad` y cada
+    operacion gasta uno. Con tasa 0 no limita nada"""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = tasa
+        self.capacidad = capacidad if capacidad is not None else max(1.0, tasa)
+        self.tokens = self.capacidad
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _rellenar(self, ahora):
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+
+    def tomar(self, cantidad=1):
+        """Gasta tokens si hay, devuelve False si la operacion debe rechazarse"""
+        if not self.tasa:
+            return True
+        with self.lock:
+            self._rellenar(time.monotonic())
+            if self.tokens >= cantidad:
+                self.tokens -= cantidad
+                return True
+            return False
+
+    def espera(self, gastar=True):
+        """Segundos que faltan para tener un token (0 si ya hay uno, que se gasta salvo con
+        gastar=False)"""
+        if not self.tasa:
+            return 0.0
+        with self.lock:
+            self._rellenar(time.monotonic())
+            if self.tokens >= 1:
+                if gastar:
+                    self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.tasa
+
+
+class CubetasPorClave:
+    """Una CubetaTokens por clave (la IP del cliente), creada con el primer mensaje. Cuando hay
+    demasiadas se borran las que se volvieron a llenar (nadie de esa IP mando nada en un rato),
+    asi no queda una por cada direccion que paso alguna vez por el servidor"""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.cubetas = {}
+        self.limpieza = LIMPIEZA_CUBETAS
+        self.lock = threading.Lock()
+
+    def tomar(self, clave):
+        if not self.tasa:
+            return True
+        with self.lock:
+            cubeta = self.cubetas.get(clave)
+            if cubeta is None:
+                if len(self.cubetas) >= self.limpieza:
+                    self._limpiar()
+                cubeta = self.cubetas[clave] = CubetaTokens(self.tasa, self.capacidad)
+        return cubeta.tomar()
+
+    def _limpiar(self):
+        ahora = time.monotonic()
+        for clave, cubeta in list(self.cubetas.items()):
+            with cubeta.lock:
+                cubeta._rellenar(ahora)
+                llena = cubeta.tokens >= cubeta.capacidad
+            if llena:
+                del self.cubetas[clave]
+        """si casi todas estan en uso se espera a que se dupliquen antes de volver a recorrerlas"""
+        self.limpieza = max(LIMPIEZA_CUBETAS, 2 * len(self.cubetas))
+
+
+class LimiteMensajes:
+    """Ritmo de mensajes de un cliente registrado: su propia cubeta y la de su IP, que comparte
+    con las demas conexiones de la misma direccion. El transporte llama a tomar() con cada
+    mensaje antes de decodificarlo. limitado queda en True desde el primer mensaje descartado
+    hasta el siguiente que pasa, para avisarle una sola vez por racha (ver nucleo.limitar)"""
+
+    def __init__(self, por_ip, ip):
+        self.cubeta = CubetaTokens(MENSAJES_POR_SEGUNDO, RAFAGA_MENSAJES or None)
+        self.por_ip = por_ip
+        self.ip = ip
+        self.limitado = False
+
+    def tomar(self):
+        """None si el mensaje pasa; si no, el limite que supero: "usuario" o "ip" """
+        if not self.cubeta.tomar():
+            return "usuario"
+        if self.ip is not None and not self.por_ip.tomar(self.ip):
+            return "ip"
+        self.limitado = False
+        return None
+
+
+class ControlAdmision:
+    """Lleva la cuenta de conexiones abiertas, el ritmo de aceptacion y las cubetas por IP del
+    ritmo de mensajes de un servidor"""
+
+    def __init__(self, max_usuarios=None, max_conexiones=None, por_segundo=None):
+        self.max_usuarios = max_usuarios or MAX_USUARIOS
+        self.max_conexiones = max_conexiones or MAX_CONEXIONES
+        self.cubeta = CubetaTokens(ACEPTACIONES_POR_SEGUNDO if por_segundo is None else por_segundo)
+        self.por_ip = CubetasPorClave(MENSAJES_POR_SEGUNDO_IP, RAFAGA_MENSAJES_IP or None)
+        self.conexiones = 0
+        self.rechazadas = 0
+        self.lock = threading.Lock()
+
+    def espera_aceptacion(self, gastar=True):
+        """El bucle de accept duerme este tiempo antes de aceptar, asi los clientes de mas
+        esperan en la cola de listen() en vez de entrar todos de golpe. Con gastar=False solo
+        mira: el token se gasta cuando accept() devolvio una conexion"""
+        return self.cubeta.espera(gastar)
+
+    def entrar(self):
+        """Reserva un lugar para una conexion nueva. False si se llego a max_conexiones"""
+        with self.lock:
+            if self.conexiones >= self.max_conexiones:
+                self.rechazadas += 1
+                return False
+            self.conexiones += 1
+            return True
+
+    def salir(self):
+        with self.lock:
+            self.conexiones -= 1
+
+    def lleno(self, usuarios):
+        """True si con `usuarios` registrados ya no entra nadie mas"""
+        if usuarios >= self.max_usuarios:
+            with self.lock:
+                self.rechazadas += 1
+            return True
+        return False
+
+    def mensaje_lleno(self):
+        return mensaje_lleno(self.max_usuarios)
+
+    def limite_mensajes(self, ip):
+        """Limite de ritmo para un cliente nuevo; con ip None solo se aplica el de usuario"""
+        return LimiteMensajes(self.por_ip, ip)
@@ -1,10 +1,22 @@
 import streamlit as st
-import time
+import collections
+import io
+import itertools
+import os
+import queue
 import threading
 import datetime
+import archivos
+import binario
+import cliente_tcp
+import pasarela
 from cliente_tcp import ClienteTCP
 from cliente_udp import ClienteUDP
 
+# Con CHAT_GUI_PASARELA=1 las sesiones TCP de todas las pestanas comparten una sola conexion
+# con el servidor (ver pasarela.py) en lugar de abrir un socket y un hilo cada una
+USAR_PASARELA = os.environ.get("CHAT_GUI_PASARELA", "0") == "1"
+
 # --- CONFIGURACIÓN VISUAL ---
 st.set_page_config(
     page_title="Chat TCP/UDP", 
@@ -12,22 +24,94 @@ st.set_page_config(
     layout="wide"
 )
 
+# --- HISTORIAL ACOTADO ---
+# Se guardan como mucho MAX_MENSAJES (los mas viejos se descartan) y se dibujan de a
+# TAMANO_VENTANA, con un boton para ir mostrando los anteriores
+MAX_MENSAJES = 1000
+TAMANO_VENTANA = 100
+
+# Tipos de mensaje, cada uno se dibuja con un widget distinto
+PRIVADO, PROPIO, AVISO, ERROR, NORMAL = range(5)
+
+# Las conexiones directas y las sesiones de la pasarela piden el formato compacto (ver binario.py):
+# cada mensaje llega con su tipo y no hace falta buscar cadenas. Tambien se reconectan solas si se
+# corta la conexion (ver reanudacion.py): llega un aviso y los mensajes siguen llegando a la misma
+# cola cuando el cliente vuelve a conectarse
+TIPO_REGISTRO = {
+    binario.PRIVADO: PRIVADO,
+    binario.PRIVADO_ENVIADO: PRIVADO,
+    binario.AVISO: AVISO,
+    binario.ERROR: ERROR,
+}
+
+
+class Mensaje:
+    """Mensaje ya clasificado: el tipo se calcula una sola vez cuando llega y no en cada redibujo.
+    archivo es (id, tamano, nombre) si el mensaje avisa un archivo recibido (ver archivos.py)"""
+    __slots__ = ("tipo", "texto", "archivo")
+
+    def __init__(self, texto, tipo=None, archivo=None):
+        self.texto = texto
+        self.tipo = clasificar(texto) if tipo is None else tipo
+        self.archivo = archivo
+
+
+def desde_registro(registro):
+    """Mensaje para mostrar a partir de un registro compacto. Los avisos de archivo llegan como
+    privados con "/archivo id tamano nombre"; se muestran con el nombre y un boton para bajarlo"""
+    archivo = None
+    if registro.tipo in (binario.PRIVADO, binario.PRIVADO_ENVIADO):
+        archivo = archivos.leer_aviso(registro.contenido)
+        if archivo is not None:
+            registro.contenido = f"📎 {archivo[2]} ({archivo[1]} bytes)"
+    return Mensaje(registro.texto(), TIPO_REGISTRO.get(registro.tipo, NORMAL), archivo)
+
+
+def clasificar(msj):
+    if "[PRIVADO" in msj:
+        return PRIVADO
+    if "[Yo]" in msj:
+        return PROPIO
+    if "***" in msj:
+        return AVISO
+    if "[ERROR]" in msj:
+        return ERROR
+    return NORMAL
+
+
+def historial_vacio():
+    return collections.deque(maxlen=MAX_MENSAJES)
+
 # --- INICIALIZACIÓN DE VARIABLES DE SESIÓN ---
 if 'cliente_obj' not in st.session_state:
     st.session_state.cliente_obj = None
 if 'historial' not in st.session_state:
-    st.session_state.historial = []
+    st.session_state.historial = historial_vacio()
+if 'ventana' not in st.session_state:
+    # Cuantos de los ultimos mensajes se dibujan
+    st.session_state.ventana = TAMANO_VENTANA
+if 'entrantes' not in st.session_state:
+    # Cola segura entre hilos: el hilo de escucha deja aca lo que llega y el fragmento del chat
+    # lo pasa a historial cuando se redibuja
+    st.session_state.entrantes = queue.SimpleQueue()
 if 'conectado' not in st.session_state:
     st.session_state.conectado = False
 if 'tipo_conexion' not in st.session_state:
     st.session_state.tipo_conexion = ""
 if 'nombre_usuario' not in st.session_state:
     st.session_state.nombre_usuario = ""
+if 'descargas' not in st.session_state:
+    # Archivos ya bajados del servidor (id -> bytes), listos para el boton de guardar
+    st.session_state.descargas = {}
+
+# Cada cuanto se mira si llegaron mensajes. Lo hace un fragmento que no dibuja nada; el area de
+# mensajes solo se vuelve a dibujar cuando la cola trajo algo
+INTERVALO_REFRESCO = 0.25
 
 # --- HILO DE ESCUCHA (MODIFICADO) ---
 # NOTA: Quitamos todas las referencias a 'st.session_state' de aquí dentro.
 # Recibimos las referencias como argumentos explícitos.
-def hilo_escucha(cliente_instancia, lista_mensajes_referencia):
+def hilo_escucha(cliente_instancia, cola_entrantes):
     """
     Escucha mensajes entrantes. 
     NO usa st.session_state directamente para evitar errores de contexto.
@@ -36,20 +120,64 @@ def hilo_escucha(cliente_instancia, lista_mensajes_referencia):
     while cliente_instancia.conectado:
         try:
             # Bloqueante hasta recibir algo
-            mensaje = cliente_instancia.recibir_mensaje()
+            registro = cliente_instancia.recibir_registro()
             
-            if mensaje:
-                print(f"[DEBUG Hilo] Recibido: {mensaje}")
-                # Al ser una lista mutable, podemos hacer append y Streamlit lo verá
-                lista_mensajes_referencia.append(mensaje)
+            if registro:
+                print(f"[DEBUG Hilo] Recibido: {registro}")
+                # La cola es segura entre hilos; el fragmento del chat la vacia en su proximo ciclo.
+                # El tipo viene en el registro, no hay que clasificar el texto
+                cola_entrantes.put(desde_registro(registro))
             else:
                 # Si retorna None, el servidor cerró o hubo error
                 break
         except Exception as e:
             print(f"[ERROR Hilo]: {e}")
             break
-        
-        time.sleep(0.1)
+
+# --- PASARELA COMPARTIDA ---
+# cache_resource la comparte entre todas las sesiones del proceso de Streamlit
+@st.cache_resource
+def pasarela_compartida():
+    return pasarela.PasarelaCompartida(cliente_tcp.SERVER_IP, cliente_tcp.SERVER_PORT)
+
+
+# Si el servidor corta la pasarela apenas se presenta (el motor asyncio no la atiende), las
+# sesiones TCP de este proceso usan conexiones directas desde ahi en adelante
+@st.cache_resource
+def estado_pasarela():
+    return {"rechazada": False}
+
+
+def obtener_pasarela():
+    """Devuelve la pasarela del proceso, si se corto la conexion crea una nueva"""
+    return pasarela_compartida().actual()
+
+
+def sesion_pasarela(cola_entrantes):
+    """Sesion TCP dentro de la pasarela. El hilo lector de la pasarela deja los mensajes directo
+    en la cola de esta pestana, asi que no hace falta un hilo de escucha propio. Si se corta la
+    pasarela la sesion se retoma sola por otra con su token (ver pasarela.SesionPasarela)"""
+    def entregar(registro):
+        if registro is not None:
+            cola_entrantes.put(desde_registro(registro))
+    return obtener_pasarela().abrir(entregar, binario=True, reconectar=True)
+
+
+def conectar_pasarela(nombre, cola_entrantes):
+    """(cliente, exito, info) de una sesion en la pasarela, o None si el servidor no acepta
+    pasarelas y hay que conectarse directo"""
+    try:
+        cliente = sesion_pasarela(cola_entrantes)
+    except OSError as e:
+        if isinstance(e, ConnectionResetError):
+            estado_pasarela()["rechazada"] = True
+            return None
+        return None, False, f"Error de conexión: {e}"
+    exito, info = cliente.conectar(nombre)
+    if not exito and not cliente.pasarela.activa:
+        estado_pasarela()["rechazada"] = True
+        return None
+    return cliente, exito, info
 
 # --- BARRA LATERAL (LOGIN Y CONFIGURACIÓN) ---
 with st.sidebar:
@@ -63,16 +191,24 @@ with st.sidebar:
             if nombre_input:
                 st.session_state.nombre_usuario = nombre_input
                 
-                # Instanciamos la clase correcta
-                if protocolo == "TCP":
-                    cliente = ClienteTCP()
+                # Instanciamos la clase correcta (la pasarela ya conecta; si el servidor no la
+                # acepta se sigue con una conexion directa)
+                con_pasarela = protocolo == "TCP" and USAR_PASARELA and not estado_pasarela()["rechazada"]
+                resultado = conectar_pasarela(nombre_input, st.session_state.entrantes) if con_pasarela else None
+                if resultado is not None:
+                    cliente, exito, info = resultado
+                    st.session_state.tipo_conexion = "TCP"
+                elif protocolo == "TCP":
+                    con_pasarela = False
+                    cliente = ClienteTCP(modo="binario", reconectar=True, comprimir=cliente_tcp.COMPRESION)
                     st.session_state.tipo_conexion = "TCP"
                 else:
-                    cliente = ClienteUDP()
+                    cliente = ClienteUDP(compacto=True, reconectar=True, comprimir=cliente_tcp.COMPRESION)
                     st.session_state.tipo_conexion = "UDP"
 
                 # Conectamos
-                exito, info = cliente.conectar(nombre_input)
+                if not con_pasarela:
+                    exito, info = cliente.conectar(nombre_input)
                 
                 if exito:
                     st.session_state.cliente_obj = cliente
@@ -82,14 +218,14 @@ with st.sidebar:
                     # --- CORRECCIÓN CRÍTICA AQUÍ ---
                     # Pasamos los objetos EXPLICITAMENTE al hilo.
                     # Así el hilo no tiene que buscar 'st.session_state'
-                    t = threading.Thread(
-                        target=hilo_escucha, 
-                        args=(st.session_state.cliente_obj, st.session_state.historial), 
-                        daemon=True
-                    )
-                    t.start()
+                    if not con_pasarela:
+                        t = threading.Thread(
+                            target=hilo_escucha, 
+                            args=(st.session_state.cliente_obj, st.session_state.entrantes), 
+                            daemon=True
+                        )
+                        t.start()
                     
-                    time.sleep(0.5)
                     st.rerun()
                 else:
                     st.error(f"Error: {info}")
@@ -104,37 +240,134 @@ with st.sidebar:
         
         st.markdown("---")
         st.caption("Comandos especiales:")
-        st.code("/priv usuario mensaje")
+        st.code("/priv usuario mensaje\n/join sala\n/leave [sala]\n/rooms\n/history [pagina]")
         st.markdown("---")
+
+        # Los archivos van por su propio canal (ver archivos.py), el chat sigue andando mientras
+        # se suben. Las sesiones de la pasarela suben por una conexion directa con su token
+        if hasattr(st.session_state.cliente_obj, "enviar_archivo"):
+            with st.expander("📎 Enviar archivo"):
+                destino = st.text_input("Para (usuario)", key="archivo_destino")
+                subido = st.file_uploader("Archivo", key="archivo_subido")
+                if st.button("Enviar archivo") and subido is not None and destino:
+                    with st.spinner("Enviando..."):
+                        exito, info = st.session_state.cliente_obj.enviar_archivo(destino, subido, subido.name)
+                    if exito:
+                        st.success(info)
+                    else:
+                        st.error(info)
+            st.markdown("---")
         
         if st.button("Desconectar", type="primary"):
             if st.session_state.cliente_obj:
                 st.session_state.cliente_obj.cerrar()
             st.session_state.conectado = False
             st.session_state.cliente_obj = None
-            st.session_state.historial = []
+            st.session_state.historial = historial_vacio()
+            st.session_state.ventana = TAMANO_VENTANA
+            st.session_state.entrantes = queue.SimpleQueue()
+            st.session_state.descargas = {}
             st.rerun()
 
 # --- ÁREA PRINCIPAL DE CHAT ---
 st.title(f"Sala de Chat {st.session_state.tipo_conexion}")
 
-contenedor_mensajes = st.container(height=500)
+def drenar_entrantes():
+    """Pasa al historial todo lo que el hilo de escucha dejo en la cola. Devuelve cuantos"""
+    nuevos = 0
+    while True:
+        try:
+            st.session_state.historial.append(st.session_state.entrantes.get_nowait())
+        except queue.Empty:
+            return nuevos
+        nuevos += 1
 
-with contenedor_mensajes:
-    if len(st.session_state.historial) == 0:
-        st.info("Esperando mensajes... ¡Saluda!")
-    
-    for msj in st.session_state.historial:
-        if "[PRIVADO" in msj:
-            st.warning(msj, icon="🔒")
-        elif "[Yo]" in msj:
-            st.markdown(f"**{msj}**")
-        elif "***" in msj:
-             st.caption(msj)
-        elif "[ERROR]" in msj:
-            st.error(msj)
-        else:
-            st.text(msj)
+
+def mostrar_archivo(msj):
+    """Aviso de archivo: primero se baja del servidor y despues se ofrece para guardar"""
+    id_archivo, _, nombre = msj.archivo
+    st.warning(msj.texto, icon="📎")
+    datos = st.session_state.descargas.get(id_archivo)
+    if datos is not None:
+        st.download_button(f"Guardar {nombre}", datos, file_name=nombre, key=f"guardar_{id_archivo}")
+    elif st.button(f"Descargar {nombre}", key=f"bajar_{id_archivo}"):
+        buffer = io.BytesIO()
+        try:
+            archivos.bajar(cliente_tcp.SERVER_IP, cliente_tcp.SERVER_PORT, id_archivo, buffer)
+        except (OSError, archivos.ErrorTransferencia) as e:
+            st.error(f"No se pudo bajar el archivo: {e}")
+            return
+        st.session_state.descargas[id_archivo] = buffer.getvalue()
+        st.rerun(scope="fragment")
+
+
+def mostrar_mensaje(msj):
+    if msj.archivo is not None:
+        mostrar_archivo(msj)
+    elif msj.tipo == PRIVADO:
+        st.warning(msj.texto, icon="🔒")
+    elif msj.tipo == PROPIO:
+        st.markdown(f"**{msj.texto}**")
+    elif msj.tipo == AVISO:
+         st.caption(msj.texto)
+    elif msj.tipo == ERROR:
+        st.error(msj.texto)
+    else:
+        st.text(msj.texto)
+
+
+def ultimos(historial, cantidad):
+    """Los ultimos `cantidad` mensajes en orden, recorriendo el deque desde el final para no
+    pasar por los que no se muestran"""
+    return reversed(list(itertools.islice(reversed(historial), cantidad)))
+
+
+# Mientras hay conexion este fragmento vacio se ejecuta solo cada INTERVALO_REFRESCO segundos y
+# pasa la cola al historial. Si no llego nada termina sin dibujar, asi un chat quieto no se
+# vuelve a dibujar. Si llego algo hay que volver a correr el area de mensajes, y Streamlit solo
+# deja volver a correr el fragmento propio o el script entero: se pide una ejecucion del script,
+# que dibuja el area una sola vez con todo lo nuevo. Lo mismo si el cliente se desconecto del
+# todo, para que la barra lateral vuelva a pedir el nombre. Sin conexion no se refresca
+@st.fragment(run_every=INTERVALO_REFRESCO if st.session_state.conectado else None)
+def vigilar_entrantes():
+    cliente = st.session_state.cliente_obj
+    if st.session_state.conectado and cliente is not None and not cliente.conectado:
+        drenar_entrantes()
+        st.session_state.conectado = False
+        st.session_state.cliente_obj = None
+        st.rerun()
+    if drenar_entrantes():
+        st.rerun()
+
+
+# El area de mensajes es un fragmento sin refresco propio: se dibuja con cada ejecucion del
+# script (al llegar mensajes o al mandar uno) y con sus propios botones, sin correr lo demas.
+# Solo se dibujan los ultimos st.session_state.ventana mensajes, asi el costo de cada redibujo
+# no crece con la duracion de la sesion
+@st.fragment
+def area_mensajes():
+    drenar_entrantes()
+    historial = st.session_state.historial
+    contenedor_mensajes = st.container(height=500)
+    with contenedor_mensajes:
+        if len(historial) == 0:
+            st.info("Esperando mensajes... ¡Saluda!")
+
+        if len(historial) > st.session_state.ventana and st.button("Cargar anteriores", key="cargar_anteriores"):
+            st.session_state.ventana += TAMANO_VENTANA
+
+        for msj in ultimos(historial, st.session_state.ventana):
+            mostrar_mensaje(msj)
+
+        # Despues de cargar anteriores la ventana vuelve a su tamano al volver a los ultimos
+        # (con este boton o al mandar un mensaje); si no, cada redibujo seguiria siendo grande
+        if st.session_state.ventana > TAMANO_VENTANA and st.button("Volver a los ultimos", key="volver_ultimos"):
+            st.session_state.ventana = TAMANO_VENTANA
+            st.rerun(scope="fragment")
+
+
+vigilar_entrantes()
+area_mensajes()
 
 # --- INPUT DE MENSAJES ---
 if st.session_state.conectado:
@@ -147,14 +380,10 @@ if st.session_state.conectado:
         # ECO LOCAL
         hora_actual = datetime.datetime.now().strftime("%H:%M:%S")
         mi_mensaje_formateado = f"[Yo] [{hora_actual}] {prompt}"
-        st.session_state.historial.append(mi_mensaje_formateado)
-        
-        st.rerun()
-
-    # --- AUTO REFRESCO ---
-    # Esto mantiene la UI actualizada con lo que el hilo recibe
-    time.sleep(1)
-    st.rerun()
+        # Va por la misma cola que lo recibido para que quede en orden con lo que llega
+        st.session_state.entrantes.put(Mensaje(mi_mensaje_formateado, PROPIO))
+        # Quien escribe esta mirando los ultimos mensajes
+        st.session_state.ventana = TAMANO_VENTANA
 
 else:
     st.write("👈 Por favor, inicia sesión en el menú de la izquierda.")
\ No newline at end of file
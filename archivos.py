@@ -0,0 +1,265 @@
+"""Transferencia de archivos por un canal aparte del chat. Un archivo no viaja por la conexion del
+chat (que lee de a un mensaje y tendria ocupado al hilo del cliente mientras dura): el cliente abre
+otra conexion TCP al mismo puerto del servidor y en lugar del nombre manda MAGIA. Desde ahi:
+
+    cliente -> servidor: [largo: u32][cabecera JSON]   (protocolo.enmarcar)
+    servidor -> cliente: [largo: u32][respuesta JSON]
+    y despues los bytes del archivo, en crudo, en el sentido que corresponda
+
+- subir: {"op": "subir", "nombre", "token", "destino", "archivo", "tamano"}. El token es el de
+  reanudar la sesion (ver reanudacion.py) y prueba que quien sube es ese usuario. El servidor
+  contesta {"ok": true} o {"error": ...} antes de que se mande un solo byte del archivo, y
+  {"ok": true, "id": ...} cuando lo termino de guardar. Al destinatario le llega un privado con
+  aviso(): "/archivo <id> <tamano> <nombre>", que pasa por el historial, el buzon y el bus entre
+  workers como cualquier privado
+- bajar: {"op": "bajar", "id"}. El id es aleatorio y solo lo conocen el remitente y el
+  destinatario. El servidor contesta {"ok": true, "tamano": n} y manda el archivo
+
+En el servidor el archivo se guarda en disco mientras llega (de a TROZO bytes, con recv_into sobre
+un memoryview, sin armar el archivo en memoria) y se manda con socket.sendfile, que copia del
+disco al socket sin pasar por Python. Cada transferencia tiene su conexion, asi el control de flujo
+de TCP frena al que manda mas rapido de lo que se escribe o se lee, y el chat no espera a nadie.
+Como mucho MAX_TRANSFERENCIAS a la vez; las demas reciben un error.
+
+Los clientes lo usan con enviar_archivo() (en las terminales, "/file usuario ruta") y bajar()
+("/download id ruta", o python archivos.py <id> <archivo destino>). Subir necesita el token, que
+solo reciben las sesiones binarias (la GUI, y las terminales con CHAT_TERMINAL_BINARIO=1).
+
+Configuracion por variables de entorno: CHAT_ARCHIVOS_DIR (por defecto "archivos" dentro del
+directorio del historial), CHAT_ARCHIVO_MAXIMO (bytes), CHAT_ARCHIVOS_HORAS (cuanto se guardan) y
+CHAT_MAX_TRANSFERENCIAS."""
+import argparse
+import json
+import os
+import secrets
+import socket
+import struct
+import threading
+import time
+
+import historial
+import metricas
+import protocolo
+
+DIRECTORIO = os.environ.get("CHAT_ARCHIVOS_DIR", os.path.join(historial.DIRECTORIO, "archivos"))
+TAMANO_MAXIMO = int(os.environ.get("CHAT_ARCHIVO_MAXIMO", str(100 * 1024 * 1024)))
+EDAD_MAXIMA = float(os.environ.get("CHAT_ARCHIVOS_HORAS", "24")) * 3600
+MAX_TRANSFERENCIAS = int(os.environ.get("CHAT_MAX_TRANSFERENCIAS", "8"))
+
+MAGIA = b"\x00FILE"
+LARGO = struct.Struct("!I")
+TROZO = 64 * 1024
+LARGO_CABECERA = 4096
+
+"""Contenido del privado que avisa que llego un archivo"""
+COMANDO = "/archivo"
+
+transferencias = metricas.Contador("chat_transferencias_total", "Transferencias de archivos por operacion y resultado",
+                                   ("op", "resultado"))
+bytes_archivos = metricas.Contador("chat_archivos_bytes_total", "Bytes de archivos subidos y bajados", ("op",))
+
+
+class ErrorTransferencia(Exception):
+    """La transferencia no se puede hacer; el texto es lo que se le contesta al cliente"""
+
+
+def aviso(id_archivo, tamano, nombre):
+    return f"{COMANDO} {id_archivo} {tamano} {nombre}"
+
+
+def leer_aviso(contenido):
+    """(id, tamano, nombre) si el contenido de un privado avisa un archivo, si no None"""
+    partes = contenido.split(" ", 3)
+    if len(partes) < 4 or partes[0] != COMANDO or not partes[2].isdigit():
+        return None
+    return partes[1], int(partes[2]), partes[3]
+
+
+def cabecera(datos):
+    return protocolo.enmarcar(json.dumps(datos).encode())
+
+
+def separar_cabecera(datos):
+    """(cabecera, resto) si datos ya tiene una cabecera completa, si no (None, datos)"""
+    if len(datos) < LARGO.size:
+        return None, datos
+    (largo,) = LARGO.unpack_from(datos)
+    if largo > LARGO_CABECERA:
+        raise ErrorTransferencia("Cabecera demasiado larga")
+    fin = LARGO.size + largo
+    if len(datos) < fin:
+        return None, datos
+    try:
+        return json.loads(datos[LARGO.size:fin]), datos[fin:]
+    except ValueError:
+        raise ErrorTransferencia("Cabecera invalida")
+
+
+def leer_cabecera(sock, resto=b""):
+    """Lee una cabecera del socket. Devuelve (cabecera, bytes que llegaron despues)"""
+    datos = bytes(resto)
+    while True:
+        pedido, sobra = separar_cabecera(datos)
+        if pedido is not None:
+            return pedido, sobra
+        bloque = sock.recv(LARGO_CABECERA)
+        if not bloque:
+            raise ErrorTransferencia("Se corto la conexion")
+        datos += bloque
+
+
+def recibir_en(sock, archivo, tamano, resto=b""):
+    """Copia tamano bytes del socket al archivo de a TROZO, recibiendo directo en un buffer fijo"""
+    resto = resto[:tamano]
+    archivo.write(resto)
+    faltan = tamano - len(resto)
+    buffer = bytearray(TROZO)
+    with memoryview(buffer) as vista:
+        while faltan > 0:
+            leidos = sock.recv_into(vista, min(TROZO, faltan))
+            if not leidos:
+                raise ErrorTransferencia("Se corto la conexion")
+            archivo.write(vista[:leidos])
+            faltan -= leidos
+
+
+class Almacen:
+    """Archivos subidos, en disco hasta que vencen. Cada uno es un archivo con su id de nombre;
+    mientras llega se llama <id>.parte y al terminar se renombra, asi nunca se baja uno a medias"""
+
+    def __init__(self, directorio=None):
+        self.directorio = directorio or DIRECTORIO
+        self.lugares = threading.BoundedSemaphore(MAX_TRANSFERENCIAS)
+        os.makedirs(self.directorio, exist_ok=True)
+        self.borrar_vencidos()
+
+    def borrar_vencidos(self):
+        limite = time.time() - EDAD_MAXIMA
+        for archivo in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, archivo)
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+
+    def ocupar(self):
+        """Reserva un lugar para una transferencia; ErrorTransferencia si ya hay demasiadas"""
+        if not self.lugares.acquire(blocking=False):
+            raise ErrorTransferencia("Hay demasiadas transferencias en curso, intenta en unos segundos")
+
+    def liberar(self):
+        self.lugares.release()
+
+    def nuevo(self):
+        """(id, ruta temporal donde escribir, ruta final)"""
+        id_archivo = secrets.token_hex(16)
+        ruta = os.path.join(self.directorio, id_archivo)
+        return id_archivo, ruta + ".parte", ruta
+
+    def ruta(self, id_archivo):
+        """Ruta de un archivo completo; ErrorTransferencia si no existe o vencio"""
+        if len(id_archivo) != 32 or not all(c in "0123456789abcdef" for c in id_archivo):
+            raise ErrorTransferencia("Archivo inexistente")
+        ruta = os.path.join(self.directorio, id_archivo)
+        try:
+            vencido = os.path.getmtime(ruta) < time.time() - EDAD_MAXIMA
+        except OSError:
+            raise ErrorTransferencia("Archivo inexistente")
+        if vencido:
+            raise ErrorTransferencia("El archivo vencio")
+        return ruta
+
+    def recibir(self, sock, tamano, resto=b""):
+        """Guarda un archivo que llega por el socket y devuelve su id"""
+        id_archivo, parcial, ruta = self.nuevo()
+        try:
+            with open(parcial, "wb") as f:
+                recibir_en(sock, f, tamano, resto)
+        except BaseException:
+            os.remove(parcial)
+            raise
+        os.replace(parcial, ruta)
+        return id_archivo
+
+
+# --- LADO DEL CLIENTE ---
+
+def _conectar(host, port, pedido):
+    """Abre el canal, manda la cabecera y devuelve (socket, respuesta, resto)"""
+    sock = socket.create_connection((host, port))
+    try:
+        prompt = sock.recv(1024)
+        if prompt.startswith(b"ERROR"):
+            raise ErrorTransferencia(prompt.decode(errors="replace").strip())
+        sock.sendall(MAGIA + cabecera(pedido))
+        respuesta, resto = leer_cabecera(sock)
+        if "error" in respuesta:
+            raise ErrorTransferencia(respuesta["error"])
+    except BaseException:
+        sock.close()
+        raise
+    return sock, respuesta, resto
+
+
+def subir(host, port, nombre, token, destino, archivo, nombre_archivo, tamano):
+    """Manda un archivo abierto (o cualquier objeto con read) a destino. Devuelve el id que le
+    dio el servidor. El archivo sale con socket.sendfile (si no es un archivo en disco, con send)"""
+    sock, _, _ = _conectar(host, port, {"op": "subir", "nombre": nombre, "token": token, "destino": destino,
+                                        "archivo": nombre_archivo, "tamano": tamano})
+    with sock:
+        sock.sendfile(archivo, offset=archivo.tell(), count=tamano)
+        respuesta, _ = leer_cabecera(sock)
+    if "error" in respuesta:
+        raise ErrorTransferencia(respuesta["error"])
+    return respuesta["id"]
+
+
+def subir_archivo(host, port, nombre, token, destino, archivo, nombre_archivo=None):
+    """Como subir() pero archivo puede ser una ruta o un objeto abierto en modo binario (como el de
+    st.file_uploader); el tamano se calcula y el nombre sale de la ruta si no se pasa"""
+    if isinstance(archivo, (str, os.PathLike)):
+        with open(archivo, "rb") as f:
+            return subir_archivo(host, port, nombre, token, destino, f, nombre_archivo or os.path.basename(archivo))
+    inicio = archivo.tell()
+    tamano = archivo.seek(0, os.SEEK_END) - inicio
+    archivo.seek(inicio)
+    nombre_archivo = nombre_archivo or os.path.basename(getattr(archivo, "name", "archivo"))
+    return subir(host, port, nombre, token, destino, archivo, nombre_archivo, tamano)
+
+
+def bajar(host, port, id_archivo, archivo):
+    """Baja un archivo y lo escribe en archivo (abierto en modo binario). Devuelve el tamano"""
+    sock, respuesta, resto = _conectar(host, port, {"op": "bajar", "id": id_archivo})
+    with sock:
+        recibir_en(sock, archivo, respuesta["tamano"], resto)
+    return respuesta["tamano"]
+
+
+def es_comando(texto):
+    return texto.split(" ", 1)[0] in ("/file", "/download")
+
+
+def comando(cliente, texto, host, port):
+    """/file usuario ruta y /download id ruta de las terminales. Devuelve el texto para mostrar"""
+    orden, *argumentos = texto.split(None, 2)
+    if len(argumentos) < 2:
+        return "Uso: /file usuario ruta o /download id ruta"
+    if orden == "/file":
+        return cliente.enviar_archivo(argumentos[0], argumentos[1])[1]
+    try:
+        with open(argumentos[1], "wb") as f:
+            tamano = bajar(host, port, argumentos[0], f)
+    except (OSError, ErrorTransferencia) as e:
+        if os.path.exists(argumentos[1]) and not os.path.getsize(argumentos[1]):
+            os.remove(argumentos[1])
+        return f"No se pudo bajar el archivo: {e}"
+    return f"{tamano} bytes guardados en {argumentos[1]}"
+
+
+if __name__ == "__main__":
+    import cliente_tcp
+    parser = argparse.ArgumentParser(description="Baja un archivo recibido por /archivo")
+    parser.add_argument("id")
+    parser.add_argument("destino")
+    args = parser.parse_args()
+    with open(args.destino, "wb") as f:
+        tamano = bajar(cliente_tcp.SERVER_IP, cliente_tcp.SERVER_PORT, args.id, f)
+    print(f"{tamano} bytes guardados en {args.destino}")
@@ -0,0 +1,160 @@
+"""Benchmark de la compresion negociada (compresion.py): cuantos bytes se ahorran contra cuanta CPU
+se gasta, sin sockets. Los mensajes son frases al azar (semilla fija) con palabras de un
+vocabulario de chat, de varios largos.
+
+- broadcast: un mensaje comprimido solo (SUELTO) una vez y compartido. Bytes por destinatario sin
+  y con compresion, microsegundos que cuesta comprimirlo y bytes ahorrados por microsegundo de
+  CPU con 1 y con N destinatarios (el costo se paga una vez, el ahorro se multiplica)
+- por conexion: lo que va a una sola conexion TCP (el historial al entrar en un solo lote y
+  privados cortos de a uno) sin comprimir, comprimido de a uno (SUELTO) y con el contexto de la
+  conexion (Flujo)
+- cliente: lo que cuesta abrir cada mensaje
+- difundir: nucleo.difundir() completo a N sesiones falsas sin y con compresion
+
+Todo se repite para cada nivel de --niveles.
+
+Uso: python benchmarks/bench_compresion.py [--niveles 1,6,9] [--destinatarios 10,100,1000]
+                                           [--repeticiones 2000]"""
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+import timeit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import compresion  # noqa: E402
+import mensajes  # noqa: E402
+import nucleo  # noqa: E402
+import salas  # noqa: E402
+
+VOCABULARIO = ("hola", "que", "tal", "todo", "bien", "el", "la", "de", "en", "y", "a", "los", "se", "del", "las",
+               "un", "por", "con", "no", "una", "su", "para", "es", "al", "lo", "como", "mas", "pero", "sus",
+               "servidor", "mensaje", "sala", "usuario", "conexion", "manana", "reunion", "proyecto", "archivo",
+               "gracias", "jaja", "ok", "listo", "despues", "ahora", "entonces", "creo", "puede", "tambien",
+               "codigo", "prueba", "error", "version", "cambio", "nuevo", "viejo", "rapido", "lento", "cola")
+
+LARGOS = (40, 120, 300, 800, 2000)
+
+
+class SesionFalsa:
+    def __init__(self, modo, comprimir=False):
+        self.modo = modo
+        self.comprimir = comprimir
+        self.salida = collections.deque(maxlen=1)
+        self.encolar = self.salida.append
+
+    def profundidad(self):
+        return 0
+
+
+def frase(azar, largo):
+    palabras = []
+    while sum(len(p) + 1 for p in palabras) < largo:
+        palabras.append(azar.choice(VOCABULARIO))
+    return " ".join(palabras)[:largo]
+
+
+def por_llamada(funcion, repeticiones):
+    """Microsegundos por llamada, el mejor de 5 corridas"""
+    return min(timeit.repeat(funcion, number=repeticiones, repeat=5)) / repeticiones * 1e6
+
+
+def broadcast(azar, repeticiones, destinatarios):
+    print(f"\nbroadcast (comprimido una vez, modo binario)\n"
+          f"{'largo':>7}{'sin':>8}{'con':>8}{'ahorro':>8}{'costo':>10}"
+          + "".join(f"{f'B/us N={n}':>13}" for n in (1,) + destinatarios))
+    for largo in LARGOS:
+        texto = frase(azar, largo)
+        sin = len(mensajes.grupal(salas.SALA_GENERAL, "ana", texto).para("binario"))
+        con = len(mensajes.grupal(salas.SALA_GENERAL, "ana", texto).para("binario", True))
+        """un Mensaje nuevo en cada llamada, si no la variante queda armada de la anterior"""
+        costo = (por_llamada(lambda: mensajes.grupal(salas.SALA_GENERAL, "ana", texto).para("binario", True), repeticiones)
+                 - por_llamada(lambda: mensajes.grupal(salas.SALA_GENERAL, "ana", texto).para("binario"), repeticiones))
+        costo = max(costo, 0.01)
+        rendimiento = "".join(f"{(sin - con) * n / costo:>13.0f}" for n in (1,) + destinatarios)
+        print(f"{largo:>7}{sin:>8}{con:>8}{1 - con / sin:>8.0%}{costo:>8.2f}us{rendimiento}")
+
+
+def por_conexion(azar, repeticiones):
+    historia = [mensajes.grupal(salas.SALA_GENERAL, azar.choice(("ana", "beto", "carla")),
+                                frase(azar, azar.choice(LARGOS[:3]))).para("binario") for _ in range(20)]
+    privados = [mensajes.privado("ana", "beto", frase(azar, azar.randint(10, 80)))[0].para("binario")
+                for _ in range(200)]
+
+    def enviados(comprimir, paquetes):
+        """bytes en el socket: lo comprimido viaja en una trama, lo que no se comprime tal cual"""
+        total = 0
+        for paquete in paquetes:
+            comprimido = comprimir(paquete)
+            total += len(paquete) if comprimido is None else len(comprimido) + 4
+        return total
+
+    def sueltos(paquetes):
+        return enviados(compresion.comprimir, paquetes)
+
+    def flujo(paquetes):
+        return enviados(compresion.Flujo().comprimir, paquetes)
+
+    print(f"\npor conexion (bytes y us por mensaje)\n"
+          f"{'caso':<22}{'sin':>9}{'suelto':>9}{'flujo':>9}{'us suelto':>11}{'us flujo':>10}")
+    for caso, lotes in (("historial al entrar", [b"".join(historia)]), ("200 privados cortos", privados)):
+        mensajes_caso = len(historia) if len(lotes) == 1 else len(lotes)
+        sin = sum(len(p) for p in lotes)
+        us_suelto = por_llamada(lambda: sueltos(lotes), max(1, repeticiones // len(lotes))) / mensajes_caso
+        us_flujo = por_llamada(lambda: flujo(lotes), max(1, repeticiones // len(lotes))) / mensajes_caso
+        print(f"{caso:<22}{sin:>9}{sueltos(lotes):>9}{flujo(lotes):>9}{us_suelto:>9.2f}us{us_flujo:>8.2f}us")
+
+
+def cliente(azar, repeticiones):
+    suelto = compresion.comprimir(mensajes.grupal(salas.SALA_GENERAL, "ana", frase(azar, 800)).para("binario"))
+    contexto = compresion.Flujo()
+    privados = [contexto.comprimir(mensajes.privado("ana", "beto", frase(azar, 60))[0].para("binario"))
+                for _ in range(repeticiones)]
+    descompresor = compresion.Descompresor()
+    """los del flujo se abren una sola vez y en orden, como en la conexion"""
+    inicio = time.perf_counter()
+    for privado in privados:
+        descompresor.abrir(privado)
+    flujo = (time.perf_counter() - inicio) / len(privados) * 1e6
+    print(f"\ncliente: abrir un broadcast de 800 {por_llamada(lambda: descompresor.abrir(suelto), repeticiones):.2f}us, "
+          f"un privado del flujo {flujo:.2f}us")
+
+
+def difundir(azar, repeticiones, destinatarios):
+    texto = frase(azar, 300)
+    print("\nnucleo.difundir() de un mensaje de 300")
+    for cantidad in destinatarios:
+        vueltas = max(10, repeticiones * 10 // cantidad)
+        resultado = []
+        for comprimir in (False, True):
+            destinos = [SesionFalsa("binario", comprimir) for _ in range(cantidad)]
+            resultado.append(por_llamada(
+                lambda: nucleo.difundir(destinos, mensajes.grupal(salas.SALA_GENERAL, "ana", texto)), vueltas))
+        print(f"  a {cantidad:<6} sin {resultado[0]:>9.2f}us  con {resultado[1]:>9.2f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ahorro de bytes contra CPU de la compresion")
+    parser.add_argument("--niveles", default="1,6,9")
+    parser.add_argument("--destinatarios", default="10,100,1000")
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args()
+    destinatarios = tuple(int(x) for x in args.destinatarios.split(","))
+
+    print(f"umbral {compresion.UMBRAL} bytes (flujo {compresion.UMBRAL_FLUJO}), ventana {compresion.VENTANA} bits")
+    for nivel in [int(x) for x in args.niveles.split(",")]:
+        compresion.NIVEL = nivel
+        print(f"\n=== nivel {nivel} ===")
+        azar = random.Random(1)
+        broadcast(azar, args.repeticiones, destinatarios)
+        por_conexion(azar, args.repeticiones)
+        cliente(azar, args.repeticiones)
+        difundir(azar, args.repeticiones, destinatarios)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Micro-benchmark del armado de mensajes en el camino caliente del broadcast (mensajes.py y
+nucleo.difundir), sin sockets: las sesiones son falsas y encolar() solo guarda los bytes.
+
+Compara cada paso con la forma anterior de hacerlo:
+- fecha: datetime.now().strftime() en cada mensaje contra fecha_actual() cacheada por segundo
+- armado: f-string + encode() contra mensajes.grupal()
+- broadcast: codificar y empaquetar para cada destinatario contra nucleo.difundir(), que prepara
+  los bytes una vez por modo (mitad de las sesiones en texto y mitad en tramas)
+- procesar: nucleo.procesar() completo para un mensaje grupal en una sala con N miembros
+- formato compacto (binario.py): bytes por mensaje y costo de leerlo en el cliente, separando
+  el texto (clasificar con cadenas y expresion regular) contra decodificar el registro
+
+Uso: python benchmarks/bench_mensajes.py [--destinatarios 10,100,1000] [--repeticiones 2000]"""
+import argparse
+import collections
+import datetime
+import os
+import sys
+import timeit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import binario  # noqa: E402
+import mensajes  # noqa: E402
+import nucleo  # noqa: E402
+import padron  # noqa: E402
+import protocolo  # noqa: E402
+import salas  # noqa: E402
+
+
+class SesionFalsa:
+    def __init__(self, modo):
+        self.modo = modo
+        self.salida = collections.deque(maxlen=1)
+        self.encolar = self.salida.append
+
+    def profundidad(self):
+        return 0
+
+
+def por_llamada(funcion, repeticiones):
+    """Microsegundos por llamada, el mejor de 5 corridas"""
+    return min(timeit.repeat(funcion, number=repeticiones, repeat=5)) / repeticiones * 1e6
+
+
+def fecha_anterior():
+    return datetime.datetime.now().strftime("%d/%m/%Y %I:%M:%S %p")
+
+
+def armado_anterior():
+    return f"[ana] [Fecha:{fecha_anterior()}] hola a todos\n".encode()
+
+
+def broadcast_anterior(destinos):
+    texto = f"[ana] [Fecha:{fecha_anterior()}] hola a todos\n"
+    for sesion in destinos:
+        sesion.encolar(protocolo.empaquetar(texto.encode(), sesion.modo))
+
+
+def broadcast_nuevo(destinos):
+    nucleo.difundir(destinos, mensajes.grupal(salas.SALA_GENERAL, "ana", "hola a todos"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del armado de mensajes")
+    parser.add_argument("--destinatarios", default="10,100,1000")
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args()
+    n = args.repeticiones
+
+    print(f"{'paso':<28}{'anterior':>12}{'actual':>12}{'mejora':>9}")
+
+    def fila(paso, anterior, actual):
+        print(f"{paso:<28}{anterior:>10.2f}us{actual:>10.2f}us{anterior / actual:>8.1f}x")
+
+    fila("fecha", por_llamada(fecha_anterior, n * 10), por_llamada(mensajes.fecha_actual, n * 10))
+    fila("armado", por_llamada(armado_anterior, n * 10),
+         por_llamada(lambda: mensajes.grupal(salas.SALA_GENERAL, "ana", "hola a todos").datos, n * 10))
+
+    for cantidad in [int(x) for x in args.destinatarios.split(",")]:
+        destinos = [SesionFalsa("texto" if i % 2 else "tramas") for i in range(cantidad)]
+        repeticiones = max(10, n * 10 // cantidad)
+        anterior = por_llamada(lambda: broadcast_anterior(destinos), repeticiones)
+        actual = por_llamada(lambda: broadcast_nuevo(destinos), repeticiones)
+        fila(f"broadcast a {cantidad}", anterior, actual)
+        print(f"{'':<28}{anterior / cantidad:>10.3f}us{actual / cantidad:>10.3f}us  por destinatario")
+
+    """procesar() completo: registro real en el nucleo, sala general con N miembros y sin historial"""
+    for cantidad in [int(x) for x in args.destinatarios.split(",")]:
+        nucleo.usuarios = padron.Padron()
+        nucleo.indice_salas = salas.IndiceSalas()
+        sesiones = [SesionFalsa("texto" if i % 2 else "tramas") for i in range(cantidad)]
+        for i, sesion in enumerate(sesiones):
+            nucleo.usuarios.agregar(f"u{i}", sesion)
+            nucleo.indice_salas.unir(sesion, salas.SALA_GENERAL)
+        repeticiones = max(10, n * 10 // cantidad)
+        actual = por_llamada(lambda: nucleo.procesar(sesiones[0], "u0", "hola a todos"), repeticiones)
+        print(f"{f'procesar en sala de {cantidad}':<28}{'':>12}{actual:>10.2f}us"
+              f"  ({actual / cantidad:.3f}us por destinatario)")
+
+    """formato compacto: "anterior" es el texto y "actual" el registro"""
+    print(f"\n{'formato':<28}{'texto':>12}{'compacto':>12}")
+    for sala, nombre in ((salas.SALA_GENERAL, "ana"), ("proyecto", "usuario_largo")):
+        mensaje = mensajes.grupal(sala, nombre, "hola a todos")
+        print(f"{f'bytes grupal ({sala})':<28}{len(mensaje.datos):>12}{len(mensaje.compacto()):>12}")
+    privado, _ = mensajes.privado("ana", "beto", "hola a todos")
+    print(f"{'bytes privado':<28}{len(privado.datos):>12}{len(privado.compacto()):>12}")
+    texto, registro = privado.texto, privado.compacto()
+    fila("leer en el cliente", por_llamada(lambda: binario.desde_texto(texto), n * 10),
+         por_llamada(lambda: binario.decodificar(registro), n * 10))
+
+
+if __name__ == "__main__":
+    main()
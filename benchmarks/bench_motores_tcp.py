@@ -0,0 +1,182 @@
+"""Benchmark de los motores del servidor TCP ("hilos" contra "asyncio").
+
+Mide dos cosas por cada motor:
+- Memoria por conexion inactiva: abre N conexiones que se quedan en el prompt de usuario sin
+  registrarse (cada una ocupa un hilo o una corrutina en el servidor) y compara el RSS del proceso
+  antes y despues.
+- Throughput de mensajes: un usuario envia mensajes grupales y el resto cuenta cuantos recibe
+  por segundo.
+
+Uso: python benchmarks/bench_motores_tcp.py [--conexiones 2000] [--mensajes 20000]
+Solo funciona en Linux porque lee el RSS de /proc."""
+import argparse
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = "127.0.0.1"
+
+
+def rss_kb(pid):
+    """Lee la memoria residente (VmRSS) de un proceso en KB"""
+    with open(f"/proc/{pid}/status") as f:
+        for linea in f:
+            if linea.startswith("VmRSS:"):
+                return int(linea.split()[1])
+    return 0
+
+
+def subir_limite_archivos():
+    """Cada conexion es un descriptor de archivo, se sube el limite blando al maximo permitido"""
+    _, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+    return duro
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def arrancar_servidor(motor, puerto, conexiones, usuarios):
+    """El tope de conexiones tiene que alcanzar para todas las que abre la medicion de memoria"""
+    proc = subprocess.Popen(
+        [sys.executable, "server_tcp.py", "--motor", motor, "--puerto", str(puerto),
+         "--max-conexiones", str(conexiones + 10), "--max-usuarios", str(usuarios),
+         "--mensajes-por-segundo", "0"],
+        cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        if proc.poll() is not None:
+            break
+        try:
+            socket.create_connection((HOST, puerto), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"El servidor {motor} no arranco en el puerto {puerto}")
+
+
+def medir_memoria(proc, puerto, conexiones):
+    """Abre conexiones inactivas y devuelve (rss_base_kb, rss_final_kb). Si el servidor rechaza
+    alguna el RSS no corresponde a `conexiones` y la medicion se corta con error"""
+    time.sleep(0.5)
+    base = rss_kb(proc.pid)
+    socks = []
+    try:
+        for i in range(conexiones):
+            s = socket.create_connection((HOST, puerto))
+            socks.append(s)
+            if s.recv(16).startswith(b"ERROR"):  # si no, es el prompt "Usuario: "
+                raise RuntimeError(f"El servidor rechazo la conexion {i + 1} de {conexiones}")
+        time.sleep(1)
+        final = rss_kb(proc.pid)
+    finally:
+        for s in socks:
+            s.close()
+    time.sleep(0.5)
+    return base, final
+
+
+def registrar(puerto, nombre):
+    s = socket.create_connection((HOST, puerto))
+    s.recv(16)
+    s.sendall(nombre.encode())
+    return s
+
+
+RECEPTORES = 4
+
+
+def medir_throughput(puerto, mensajes, receptores=RECEPTORES):
+    """Un emisor y `receptores` receptores (el servidor se arranca con lugar para todos). Devuelve mensajes
+    entregados por segundo sumando todos los receptores"""
+    lectores = [registrar(puerto, f"rx{i}") for i in range(receptores)]
+    time.sleep(0.3)
+    emisor = registrar(puerto, "tx")
+    time.sleep(0.3)
+    for s in lectores:
+        s.setblocking(False)
+        try:
+            while s.recv(65536):
+                pass
+        except BlockingIOError:
+            pass
+        s.setblocking(True)
+
+    recibidos = [0] * receptores
+    listo = threading.Barrier(receptores + 1)
+
+    def leer(i, s):
+        """Cuenta las cargas "msg " recibidas y no los saltos de linea: si TCP junta dos envios en
+        un recv el servidor los reenvia como un solo mensaje, pero el contenido llega igual"""
+        listo.wait()
+        resto = b""
+        while True:
+            datos = s.recv(65536)
+            if not datos:
+                break
+            datos = resto + datos
+            recibidos[i] += datos.count(b"msg ")
+            if b"FIN" in datos:
+                break
+            resto = datos[-4:]
+            recibidos[i] -= resto.count(b"msg ")
+
+    hilos = [threading.Thread(target=leer, args=(i, s)) for i, s in enumerate(lectores)]
+    for h in hilos:
+        h.start()
+    listo.wait()
+    inicio = time.perf_counter()
+    for i in range(mensajes):
+        emisor.sendall(f"msg {i}".encode())
+    time.sleep(0.2)
+    emisor.sendall(b"FIN")
+    for h in hilos:
+        h.join(timeout=60)
+    duracion = time.perf_counter() - inicio
+    for s in lectores + [emisor]:
+        s.close()
+    return sum(recibidos) / duracion, sum(recibidos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conexiones", type=int, default=2000)
+    parser.add_argument("--mensajes", type=int, default=20000)
+    args = parser.parse_args()
+
+    limite = subir_limite_archivos()
+    conexiones = min(args.conexiones, limite // 2 - 50)
+
+    print(f"{'motor':<8} {'conexiones':>10} {'RSS base':>10} {'RSS final':>10} {'KB/conexion':>12} {'msgs/s':>10}")
+    for motor in ("hilos", "asyncio"):
+        """Cada medicion usa un proceso nuevo para que las conexiones inactivas no afecten al
+        conteo de usuarios de la prueba de throughput"""
+        puerto = puerto_libre()
+        proc = arrancar_servidor(motor, puerto, conexiones, RECEPTORES + 1)
+        try:
+            base, final = medir_memoria(proc, puerto, conexiones)
+        finally:
+            proc.terminate()
+            proc.wait()
+        puerto = puerto_libre()
+        proc = arrancar_servidor(motor, puerto, RECEPTORES + 1, RECEPTORES + 1)
+        try:
+            tasa, _ = medir_throughput(puerto, args.mensajes)
+        finally:
+            proc.terminate()
+            proc.wait()
+        por_conexion = (final - base) / conexiones if conexiones else 0
+        print(f"{motor:<8} {conexiones:>10} {base:>10} {final:>10} {por_conexion:>12.1f} {tasa:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
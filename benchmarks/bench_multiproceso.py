@@ -0,0 +1,120 @@
+"""Benchmark de escalado del servidor TCP multiproceso (servidor_multiproceso.py).
+
+Para cada cantidad de workers arranca el servidor, reparte las sesiones de ClienteTCP entre
+varios procesos generadores de carga (para que el GIL del benchmark no sea el cuello de botella)
+y mide cuantas entregas por segundo logra el servidor con todos enviando mensajes grupales.
+Conviene correrlo en una maquina Linux con varios nucleos; con un solo nucleo no hay escalado.
+
+Uso: python benchmarks/bench_multiproceso.py [--workers 1,2,4,8] [--sesiones 64] [--mensajes 200]"""
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import cliente_tcp  # noqa: E402
+
+HOST = "127.0.0.1"
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def generador(id_proceso, puerto, sesiones, mensajes, listos, resultados):
+    """Proceso generador: abre sus sesiones, espera a los demas, envia y cuenta entregas"""
+    cliente_tcp.SERVER_PORT = puerto
+    clientes = []
+    for i in range(sesiones):
+        cliente = cliente_tcp.ClienteTCP()
+        ok, info = cliente.conectar(f"p{id_proceso}c{i}")
+        if not ok:
+            raise RuntimeError(info)
+        clientes.append(cliente)
+    entregas = [0]
+    ultima = [0.0]
+
+    def escuchar(cliente):
+        while cliente.conectado:
+            msg = cliente.recibir_mensaje()
+            if msg is None:
+                return
+            if "carga" in msg:
+                entregas[0] += 1
+                ultima[0] = time.perf_counter()
+
+    for cliente in clientes:
+        threading.Thread(target=escuchar, args=(cliente,), daemon=True).start()
+
+    listos.wait()
+    inicio = time.perf_counter()
+    for n in range(mensajes):
+        for cliente in clientes:
+            cliente.enviar_mensaje(f"carga {n}")
+    """se espera hasta que pase 1 segundo sin entregas nuevas"""
+    while True:
+        antes = entregas[0]
+        time.sleep(1)
+        if entregas[0] == antes:
+            break
+    resultados.put((entregas[0], inicio, ultima[0]))
+    for cliente in clientes:
+        cliente.cerrar()
+
+
+def medir(workers, sesiones, mensajes, generadores):
+    puerto = puerto_libre()
+    proc = subprocess.Popen(
+        [sys.executable, "servidor_multiproceso.py", "--workers", str(workers), "--puerto", str(puerto),
+         "--max-usuarios", str(sesiones + 10), "--max-conexiones", str(sesiones + 10), "--mensajes-por-segundo", "0"],
+        cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    time.sleep(1 + workers * 0.2)
+    try:
+        listos = multiprocessing.Barrier(generadores)
+        resultados = multiprocessing.Queue()
+        por_generador = sesiones // generadores
+        procesos = [
+            multiprocessing.Process(target=generador, args=(g, puerto, por_generador, mensajes, listos, resultados))
+            for g in range(generadores)
+        ]
+        for p in procesos:
+            p.start()
+        datos = [resultados.get(timeout=300) for _ in procesos]
+        for p in procesos:
+            p.join()
+    finally:
+        proc.terminate()
+        proc.wait()
+    entregas = sum(d[0] for d in datos)
+    duracion = max(d[2] for d in datos) - min(d[1] for d in datos)
+    return entregas, entregas / duracion if duracion > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Escalado del servidor TCP multiproceso")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--sesiones", type=int, default=64)
+    parser.add_argument("--mensajes", type=int, default=100, help="mensajes grupales por sesion")
+    parser.add_argument("--generadores", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    args = parser.parse_args()
+
+    print(f"nucleos: {os.cpu_count()}, sesiones: {args.sesiones}, generadores: {args.generadores}")
+    print(f"{'workers':>8} {'entregas':>10} {'entregas/s':>12} {'escalado':>9}")
+    base = None
+    for workers in (int(x) for x in args.workers.split(",")):
+        entregas, tasa = medir(workers, args.sesiones, args.mensajes, args.generadores)
+        base = base or tasa
+        print(f"{workers:>8} {entregas:>10} {tasa:>12.0f} {tasa / base:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
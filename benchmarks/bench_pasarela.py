@@ -0,0 +1,153 @@
+"""Benchmark de la pasarela de la GUI (pasarela.py) contra un ClienteTCP por sesion.
+
+Simula lo que pasa en el proceso de Streamlit con N pestanas conectadas:
+- directo: cada sesion es un ClienteTCP con su hilo de escucha (como app_gui.py sin pasarela)
+- pasarela: todas las sesiones van por una Pasarela compartida con un solo hilo lector
+
+Cada modo corre en un proceso aparte; se mide el RSS y la cantidad de hilos y descriptores de
+ese proceso antes y despues de abrir las sesiones, y cuanto tarda un mensaje grupal en llegarle
+a todas. Solo funciona en Linux porque lee /proc.
+
+Uso: python benchmarks/bench_pasarela.py [--sesiones 100,1000]"""
+import argparse
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import cliente_tcp  # noqa: E402
+import pasarela  # noqa: E402
+
+HOST = "127.0.0.1"
+
+
+def puerto_libre():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def estado_proceso():
+    """(RSS en KB, hilos, descriptores abiertos) del proceso actual"""
+    datos = {}
+    with open("/proc/self/status") as f:
+        for linea in f:
+            clave, _, valor = linea.partition(":")
+            datos[clave] = valor.split()
+    return int(datos["VmRSS"][0]), int(datos["Threads"][0]), len(os.listdir("/proc/self/fd"))
+
+
+def subir_limite_archivos():
+    _, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+
+
+def simular(modo, sesiones, puerto, resultado):
+    """Proceso que hace de GUI: abre las sesiones, espera que un mensaje grupal le llegue a
+    todas y devuelve las mediciones"""
+    subir_limite_archivos()
+    cliente_tcp.SERVER_PORT = puerto
+    antes = estado_proceso()
+    marca = "bench-fin"
+    pendientes = set(range(sesiones))
+    todos = threading.Event()
+    lock = threading.Lock()
+
+    def recibido(i, mensaje):
+        if mensaje and marca in mensaje:
+            with lock:
+                pendientes.discard(i)
+                if not pendientes:
+                    todos.set()
+
+    clientes = []
+    inicio = time.perf_counter()
+    if modo == "pasarela":
+        compartida = pasarela.Pasarela(HOST, puerto)
+        for i in range(sesiones):
+            sesion = compartida.abrir(lambda m, i=i: recibido(i, m))
+            ok, info = sesion.conectar(f"s{i}")
+            if not ok:
+                raise RuntimeError(info)
+            clientes.append(sesion)
+    else:
+        def escuchar(i, cliente):
+            while cliente.conectado:
+                mensaje = cliente.recibir_mensaje()
+                if mensaje is None:
+                    return
+                recibido(i, mensaje)
+
+        for i in range(sesiones):
+            cliente = cliente_tcp.ClienteTCP()
+            ok, info = cliente.conectar(f"s{i}")
+            if not ok:
+                raise RuntimeError(info)
+            threading.Thread(target=escuchar, args=(i, cliente), daemon=True).start()
+            clientes.append(cliente)
+    conexion = time.perf_counter() - inicio
+    time.sleep(1.0)
+    despues = estado_proceso()
+
+    emisor = cliente_tcp.ClienteTCP()
+    emisor.conectar("emisor")
+    time.sleep(0.2)
+    inicio = time.perf_counter()
+    emisor.enviar_mensaje(marca)
+    entregado = todos.wait(30)
+    entrega = time.perf_counter() - inicio
+    resultado.put({
+        "rss_kb": despues[0] - antes[0], "hilos": despues[1], "descriptores": despues[2],
+        "conexion_s": conexion, "entrega_ms": entrega * 1000 if entregado else float("nan"),
+        "faltaron": len(pendientes),
+    })
+    for cliente in clientes:
+        cliente.cerrar()
+    emisor.cerrar()
+
+
+def medir(modo, sesiones):
+    puerto = puerto_libre()
+    env = dict(os.environ, CHAT_HISTORIAL_DIR=tempfile.mkdtemp(prefix="historial-bench-"), CHAT_HISTORIAL_REPETIR="0")
+    proc = subprocess.Popen([sys.executable, "server_tcp.py", "--motor", "hilos", "--puerto", str(puerto),
+                             "--max-usuarios", str(sesiones + 10), "--max-conexiones", str(sesiones + 20),
+                             "--tamano-cola", "1024", "--mensajes-por-segundo", "0"],
+                            cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection((HOST, puerto), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        resultado = multiprocessing.Queue()
+        hijo = multiprocessing.Process(target=simular, args=(modo, sesiones, puerto, resultado))
+        hijo.start()
+        datos = resultado.get(timeout=300)
+        hijo.join(10)
+        print(f"{modo:>8} {sesiones:>5} sesiones: RSS +{datos['rss_kb'] / 1024:.1f} MB "
+              f"({datos['rss_kb'] / sesiones:.1f} KB/sesion)  hilos={datos['hilos']}  "
+              f"descriptores={datos['descriptores']}  conexion={datos['conexion_s']:.2f}s  "
+              f"broadcast a todas={datos['entrega_ms']:.0f}ms  faltaron={datos['faltaron']}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de la pasarela de la GUI")
+    parser.add_argument("--sesiones", default="100,1000")
+    parser.add_argument("--modos", default="directo,pasarela")
+    args = parser.parse_args()
+    subir_limite_archivos()
+    for n in [int(x) for x in args.sesiones.split(",")]:
+        for modo in args.modos.split(","):
+            medir(modo, n)
@@ -0,0 +1,151 @@
+"""Benchmark de los motores del servidor UDP ("simple" contra "lotes").
+
+Registra N receptores y S emisores (sockets UDP crudos, sin ClienteUDP) y durante unos segundos
+los emisores mandan mensajes grupales a un ritmo fijo desde otro proceso (para no competir por el
+GIL con los receptores). Para cada motor y cada ritmo ofrecido reporta:
+- mensajes de entrada atendidos por segundo (mensajes distintos que llegaron a algun receptor)
+- datagramas de salida por segundo (suma de lo que reciben todos los receptores)
+- fraccion de datagramas perdidos respecto de lo que se hubiera entregado sin perdida
+
+Uso: python benchmarks/bench_udp.py [--receptores 50] [--emisores 4] [--tasas 500,1000,2000]"""
+import argparse
+import multiprocessing
+import os
+import re
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = "127.0.0.1"
+"""solo cuentan los mensajes del benchmark, no los avisos de ingreso ni el historial"""
+CARGA = re.compile(rb"\] m (\d{10})\s*$")
+
+
+def puerto_libre():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def crear_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind((HOST, 0))
+    return sock
+
+
+def emitir(servidor, puertos, tasa, duracion, enviados):
+    """Proceso emisor: cada socket manda su parte de `tasa` mensajes por segundo"""
+    sockets = []
+    for puerto in puertos:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((HOST, puerto))
+        sockets.append(sock)
+    intervalo = len(sockets) / tasa
+    inicio = time.perf_counter()
+    n = 0
+    while time.perf_counter() - inicio < duracion:
+        sock = sockets[n % len(sockets)]
+        sock.sendto(f"m {n:010d}".encode(), servidor)
+        n += 1
+        espera = inicio + n * intervalo / len(sockets) - time.perf_counter()
+        if espera > 0:
+            time.sleep(espera)
+    enviados.value = n
+
+
+def vaciar(sock):
+    """Descarta lo que quedo en el buffer del socket (avisos de ingreso de los que se registraron despues)"""
+    sock.setblocking(False)
+    while True:
+        try:
+            sock.recv(4096)
+        except BlockingIOError:
+            return
+
+
+def medir(motor, receptores, emisores, tasa, duracion):
+    puerto = puerto_libre()
+    env = dict(os.environ, CHAT_HISTORIAL_DIR=tempfile.mkdtemp(prefix="historial-bench-"), CHAT_HISTORIAL_REPETIR="0")
+    proc = subprocess.Popen([sys.executable, "server_udp.py", "--motor", motor, "--puerto", str(puerto),
+                             "--max-usuarios", str(receptores + emisores + 10), "--mensajes-por-segundo", "0"],
+                            cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    servidor = (HOST, puerto)
+    try:
+        sockets_rx = [crear_socket() for _ in range(receptores)]
+        sockets_tx = [crear_socket() for _ in range(emisores)]
+        for i, sock in enumerate(sockets_rx):
+            sock.sendto(f"rx{i}".encode(), servidor)
+        for i, sock in enumerate(sockets_tx):
+            sock.sendto(f"tx{i}".encode(), servidor)
+        time.sleep(0.5)
+        """el proceso emisor reusa los puertos ya registrados"""
+        puertos_tx = [sock.getsockname()[1] for sock in sockets_tx]
+        for sock in sockets_tx:
+            sock.close()
+        for sock in sockets_rx:
+            vaciar(sock)
+
+        recibidos = 0
+        distintos = set()
+        fin = threading.Event()
+
+        def recibir():
+            nonlocal recibidos
+            selector = selectors.DefaultSelector()
+            for sock in sockets_rx:
+                selector.register(sock, selectors.EVENT_READ)
+            while not fin.is_set():
+                for clave, _ in selector.select(timeout=0.1):
+                    while True:
+                        try:
+                            datos = clave.fileobj.recv(4096)
+                        except BlockingIOError:
+                            break
+                        carga = CARGA.search(datos)
+                        if carga:
+                            recibidos += 1
+                            distintos.add(carga.group(1))
+
+        hilo_rx = threading.Thread(target=recibir, daemon=True)
+        hilo_rx.start()
+        enviados = multiprocessing.Value("q", 0)
+        emisor = multiprocessing.Process(target=emitir, args=(servidor, puertos_tx, tasa, duracion, enviados))
+        inicio = time.perf_counter()
+        emisor.start()
+        emisor.join()
+        time.sleep(0.5)
+        fin.set()
+        hilo_rx.join()
+        transcurrido = time.perf_counter() - inicio
+
+        esperados = enviados.value * receptores
+        perdidos = 1 - recibidos / esperados if esperados else 0
+        print(f"{motor:>7} {tasa:>6} msg/s ofrecidos: atendidos={len(distintos) / transcurrido:,.0f} msg/s  "
+              f"salida={recibidos / transcurrido:,.0f} datagramas/s  perdidos={perdidos:.1%}  "
+              f"medido en {transcurrido:.1f}s")
+        for sock in sockets_rx:
+            sock.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de motores UDP")
+    parser.add_argument("--receptores", type=int, default=50)
+    parser.add_argument("--emisores", type=int, default=4)
+    parser.add_argument("--duracion", type=float, default=3.0)
+    parser.add_argument("--tasas", default="500,1000,2000,4000")
+    parser.add_argument("--motores", default="simple,lotes")
+    args = parser.parse_args()
+    print(f"{args.receptores} receptores, {args.emisores} emisores, {args.duracion}s por medicion")
+    for tasa in [int(t) for t in args.tasas.split(",")]:
+        for motor in args.motores.split(","):
+            medir(motor, args.receptores, args.emisores, tasa, args.duracion)
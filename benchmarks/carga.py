@@ -0,0 +1,160 @@
+"""Generador de carga para los servidores del chat.
+
+Abre N sesiones concurrentes de ClienteTCP o ClienteUDP contra un servidor local (lo arranca
+con capacidad de sobra), cada sesion manda mensajes grupales con su marca de tiempo y las demas
+miden cuanto tardan en llegar. Para cada N reporta:
+- latencia de conexion (p50/p99 de conectar())
+- latencia de mensaje (p50/p95/p99 desde el envio hasta que lo recibe otro usuario)
+- throughput (entregas por segundo sumando todos los receptores) y mensajes perdidos
+
+Uso: python benchmarks/carga.py --protocolo tcp --sesiones 10,50,100,200 [--motor asyncio]
+Con esos numeros se elige el valor de CHAT_MAX_USUARIOS para cada maquina."""
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import cliente_tcp  # noqa: E402
+import cliente_udp  # noqa: E402
+
+HOST = "127.0.0.1"
+MARCA = re.compile(r"t=(\d+)")
+
+
+def puerto_libre(tipo=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, tipo) as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def percentil(valores, p):
+    if not valores:
+        return float("nan")
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def arrancar_servidor(protocolo, puerto, sesiones, motor):
+    if protocolo == "tcp":
+        cmd = [sys.executable, "server_tcp.py", "--motor", motor, "--puerto", str(puerto),
+               "--max-usuarios", str(sesiones + 10), "--max-conexiones", str(sesiones + 20), "--mensajes-por-segundo", "0"]
+    else:
+        cmd = [sys.executable, "server_udp.py", "--puerto", str(puerto), "--max-usuarios", str(sesiones + 10),
+               "--mensajes-por-segundo", "0"]
+    proc = subprocess.Popen(cmd, cwd=RAIZ, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    if protocolo == "tcp":
+        for _ in range(100):
+            try:
+                socket.create_connection((HOST, puerto), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+    return proc
+
+
+def crear_cliente(protocolo, puerto):
+    if protocolo == "tcp":
+        cliente_tcp.SERVER_PORT = puerto
+        return cliente_tcp.ClienteTCP()
+    cliente_udp.SERVER_PORT = puerto
+    return cliente_udp.ClienteUDP()
+
+
+def medir(protocolo, sesiones, mensajes, intervalo, motor):
+    puerto = puerto_libre(socket.SOCK_STREAM if protocolo == "tcp" else socket.SOCK_DGRAM)
+    proc = arrancar_servidor(protocolo, puerto, sesiones, motor)
+    clientes = []
+    latencias_conexion = []
+    latencias = []
+    try:
+        for i in range(sesiones):
+            cliente = crear_cliente(protocolo, puerto)
+            inicio = time.perf_counter()
+            ok, info = cliente.conectar(f"u{i}")
+            latencias_conexion.append(time.perf_counter() - inicio)
+            if not ok:
+                raise RuntimeError(f"u{i} no pudo conectarse: {info}")
+            clientes.append(cliente)
+        time.sleep(0.5 + sesiones / 500)
+
+        ultima_entrega = [time.perf_counter()]
+
+        def escuchar(cliente):
+            """list.append es atomico con el GIL, no hace falta lock por mensaje"""
+            while cliente.conectado:
+                msg = cliente.recibir_mensaje()
+                if msg is None:
+                    break
+                ahora = time.perf_counter_ns()
+                for marca in MARCA.findall(msg):
+                    latencias.append((ahora - int(marca)) / 1e6)
+                ultima_entrega[0] = time.perf_counter()
+
+        oyentes = [threading.Thread(target=escuchar, args=(c,), daemon=True) for c in clientes]
+        for h in oyentes:
+            h.start()
+
+        def hablar(cliente):
+            for _ in range(mensajes):
+                cliente.enviar_mensaje(f"t={time.perf_counter_ns()}")
+                time.sleep(intervalo)
+
+        inicio = time.perf_counter()
+        emisores = [threading.Thread(target=hablar, args=(c,)) for c in clientes]
+        for h in emisores:
+            h.start()
+        for h in emisores:
+            h.join()
+
+        """se espera a que lleguen todas las entregas o a que pasen 2 segundos sin novedades"""
+        esperadas = sesiones * mensajes * (sesiones - 1)
+        while len(latencias) < esperadas and time.perf_counter() - ultima_entrega[0] < 2:
+            time.sleep(0.1)
+        duracion = ultima_entrega[0] - inicio
+    finally:
+        for c in clientes:
+            c.cerrar()
+        time.sleep(0.3)
+        proc.terminate()
+        proc.wait()
+
+    return {
+        "sesiones": sesiones,
+        "conexion_p50_ms": percentil(latencias_conexion, 50) * 1000,
+        "conexion_p99_ms": percentil(latencias_conexion, 99) * 1000,
+        "mensaje_p50_ms": percentil(latencias, 50),
+        "mensaje_p95_ms": percentil(latencias, 95),
+        "mensaje_p99_ms": percentil(latencias, 99),
+        "entregas_por_s": len(latencias) / duracion,
+        "perdidas": max(0, esperadas - len(latencias)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de carga para server_tcp/server_udp")
+    parser.add_argument("--protocolo", choices=("tcp", "udp"), default="tcp")
+    parser.add_argument("--motor", choices=("hilos", "asyncio"), default="hilos")
+    parser.add_argument("--sesiones", default="10,50,100,200",
+                        help="lista de N separada por comas")
+    parser.add_argument("--mensajes", type=int, default=20, help="mensajes que manda cada sesion")
+    parser.add_argument("--intervalo", type=float, default=0.05, help="segundos entre mensajes de una sesion")
+    args = parser.parse_args()
+
+    columnas = ("sesiones", "conexion_p50_ms", "conexion_p99_ms", "mensaje_p50_ms",
+                "mensaje_p95_ms", "mensaje_p99_ms", "entregas_por_s", "perdidas")
+    print(" ".join(f"{c:>15}" for c in columnas))
+    for n in (int(x) for x in args.sesiones.split(",")):
+        fila = medir(args.protocolo, n, args.mensajes, args.intervalo, args.motor)
+        print(" ".join(f"{fila[c]:>15.2f}" if isinstance(fila[c], float) else f"{fila[c]:>15}" for c in columnas))
+
+
+if __name__ == "__main__":
+    main()
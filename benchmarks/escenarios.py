@@ -0,0 +1,295 @@
+"""Suite de benchmarks de punta a punta para comparar motores del servidor en el tiempo.
+
+Para cada protocolo y motor arranca el servidor en un proceso aparte (historial en un directorio
+temporal) y lo maneja con muchos ClienteTCP/ClienteUDP sin interfaz, en tres escenarios:
+- broadcast: cada sesion manda mensajes grupales y todas las demas los reciben
+- priv: cada sesion manda /priv a otra sesion elegida al azar (con semilla fija)
+- churn: sesiones que entran, mandan un mensaje y salen, una y otra vez, con oyentes fijos
+
+Reporta latencia de entrega p50/p99 (desde el envio hasta que lo recibe el destinatario; en churn
+desde conectar() hasta que llega el aviso de entrada propio), mensajes entregados por segundo (en
+churn, sesiones que entraron y salieron por segundo) y
+el RSS del servidor (actual y maximo). El resultado es un JSON con la configuracion, el commit y
+una entrada por (protocolo, motor, escenario); con --comparar se imprime la diferencia contra un
+JSON anterior.
+
+Uso:
+    python benchmarks/escenarios.py --salida base.json
+    python benchmarks/escenarios.py --motores-tcp asyncio --comparar base.json
+Solo funciona en Linux porque lee el RSS de /proc."""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from carga import RAIZ, crear_cliente, percentil, puerto_libre
+
+MARCA = re.compile(r"t=(\d+)")
+ESCENARIOS = ("broadcast", "priv", "churn")
+
+
+def memoria(pid):
+    """(RSS actual, RSS maximo) del proceso en KB"""
+    datos = {}
+    with open(f"/proc/{pid}/status") as f:
+        for linea in f:
+            clave, _, valor = linea.partition(":")
+            datos[clave] = valor.split()
+    return int(datos["VmRSS"][0]), int(datos["VmHWM"][0])
+
+
+def arrancar_servidor(protocolo, motor, puerto, sesiones):
+    env = dict(os.environ, CHAT_HISTORIAL_DIR=tempfile.mkdtemp(prefix="historial-bench-"),
+               CHAT_HISTORIAL_REPETIR="0", CHAT_METRICAS_PUERTO="0")
+    if protocolo == "tcp":
+        cmd = [sys.executable, "server_tcp.py", "--motor", motor, "--puerto", str(puerto),
+               "--max-usuarios", str(sesiones + 10), "--max-conexiones", str(sesiones + 20), "--mensajes-por-segundo", "0"]
+    else:
+        cmd = [sys.executable, "server_udp.py", "--motor", motor, "--puerto", str(puerto),
+               "--max-usuarios", str(sesiones + 10), "--mensajes-por-segundo", "0"]
+    proc = subprocess.Popen(cmd, cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    return proc
+
+
+class Sesiones:
+    """Clientes conectados con un hilo de escucha cada uno. filtro(texto) decide que mensajes
+    cuentan como entregas; las latencias salen de la marca t=<perf_counter_ns> del mensaje"""
+
+    def __init__(self, protocolo, puerto, filtro):
+        self.protocolo = protocolo
+        self.puerto = puerto
+        self.filtro = filtro
+        self.clientes = []
+        self.latencias = []
+        self.ultima_entrega = time.perf_counter()
+
+    def abrir(self, nombre):
+        cliente = crear_cliente(self.protocolo, self.puerto)
+        ok, info = cliente.conectar(nombre)
+        if not ok:
+            raise RuntimeError(f"{nombre} no pudo conectarse: {info}")
+        self.clientes.append(cliente)
+        threading.Thread(target=self._escuchar, args=(cliente,), daemon=True).start()
+        return cliente
+
+    def _escuchar(self, cliente):
+        """list.append es atomico con el GIL, no hace falta lock por mensaje"""
+        while cliente.conectado:
+            msg = cliente.recibir_mensaje()
+            if msg is None:
+                break
+            ahora = time.perf_counter_ns()
+            for linea in msg.splitlines():
+                if self.filtro(linea):
+                    for marca in MARCA.findall(linea):
+                        self.latencias.append((ahora - int(marca)) / 1e6)
+                        self.ultima_entrega = time.perf_counter()
+
+    def esperar(self, esperadas, silencio=2.0):
+        """Hasta que lleguen las entregas esperadas o pasen `silencio` segundos sin novedades"""
+        while len(self.latencias) < esperadas and time.perf_counter() - self.ultima_entrega < silencio:
+            time.sleep(0.05)
+
+    def cerrar(self):
+        for cliente in self.clientes:
+            cliente.cerrar()
+
+
+def en_paralelo(funcion, argumentos):
+    hilos = [threading.Thread(target=funcion, args=(a,)) for a in argumentos]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+
+def broadcast(protocolo, puerto, args):
+    grupo = Sesiones(protocolo, puerto, lambda linea: linea.startswith("["))
+    for i in range(args.sesiones):
+        grupo.abrir(f"u{i}")
+    time.sleep(0.5 + args.sesiones / 500)
+
+    def hablar(cliente):
+        for _ in range(args.mensajes):
+            cliente.enviar_mensaje(f"t={time.perf_counter_ns()}")
+            time.sleep(args.intervalo)
+
+    inicio = time.perf_counter()
+    en_paralelo(hablar, grupo.clientes)
+    esperadas = args.sesiones * args.mensajes * (args.sesiones - 1)
+    grupo.esperar(esperadas)
+    return grupo, esperadas, grupo.ultima_entrega - inicio
+
+
+def priv(protocolo, puerto, args):
+    """Solo cuentan los privados recibidos, no la confirmacion "[PRIVADO para" del remitente"""
+    grupo = Sesiones(protocolo, puerto, lambda linea: linea.startswith("[PRIVADO de"))
+    for i in range(args.sesiones):
+        grupo.abrir(f"u{i}")
+    time.sleep(0.5 + args.sesiones / 500)
+    azar = random.Random(args.semilla)
+    destinos = [[azar.choice([j for j in range(args.sesiones) if j != i]) for _ in range(args.mensajes)]
+                for i in range(args.sesiones)]
+
+    def hablar(i):
+        cliente = grupo.clientes[i]
+        for destino in destinos[i]:
+            cliente.enviar_mensaje(f"/priv u{destino} t={time.perf_counter_ns()}")
+            time.sleep(args.intervalo)
+
+    inicio = time.perf_counter()
+    en_paralelo(hablar, range(args.sesiones))
+    esperadas = args.sesiones * args.mensajes
+    grupo.esperar(esperadas)
+    return grupo, esperadas, grupo.ultima_entrega - inicio
+
+
+def churn(protocolo, puerto, args):
+    """Cada una de las sesiones que entran y salen espera su propio aviso de entrada antes de
+    hablar; la latencia es conectar() -> aviso. Los oyentes fijos reciben los avisos y mensajes
+    de todas (son los que hacen crecer el trabajo de cada entrada y salida)"""
+    oyentes = Sesiones(protocolo, puerto, lambda linea: False)
+    for i in range(max(1, args.sesiones // 2)):
+        oyentes.abrir(f"o{i}")
+    latencias = []
+    time.sleep(0.5)
+
+    def rotar(i):
+        for vuelta in range(args.mensajes):
+            nombre = f"c{i}-{vuelta}"
+            cliente = crear_cliente(protocolo, puerto)
+            inicio = time.perf_counter()
+            ok, _ = cliente.conectar(nombre)
+            if not ok:
+                continue
+            """si el aviso no llega (UDP puede perderlo) el recv se corta a los 5 segundos"""
+            cliente.sock.settimeout(5)
+            aviso = f"*** {nombre} se unio al chat ***"
+            limite = time.perf_counter() + 5
+            while time.perf_counter() < limite:
+                msg = cliente.recibir_mensaje()
+                if msg is None:
+                    break
+                if aviso in msg:
+                    latencias.append((time.perf_counter() - inicio) * 1000)
+                    break
+            cliente.enviar_mensaje("chau")
+            cliente.cerrar()
+
+    inicio = time.perf_counter()
+    en_paralelo(rotar, range(max(1, args.sesiones // 2)))
+    duracion = time.perf_counter() - inicio
+    oyentes.latencias = latencias
+    return oyentes, max(1, args.sesiones // 2) * args.mensajes, duracion
+
+
+def correr(protocolo, motor, escenario, args):
+    puerto = puerto_libre(socket.SOCK_STREAM if protocolo == "tcp" else socket.SOCK_DGRAM)
+    proc = arrancar_servidor(protocolo, motor, puerto, args.sesiones * 2)
+    grupo = None
+    try:
+        grupo, esperadas, duracion = globals()[escenario](protocolo, puerto, args)
+        rss, rss_max = memoria(proc.pid)
+    finally:
+        if grupo is not None:
+            grupo.cerrar()
+        time.sleep(0.3)
+        proc.terminate()
+        proc.wait()
+    latencias = grupo.latencias
+
+    def ms(valor):
+        """sin entregas el percentil es nan, que no es JSON valido"""
+        return None if math.isnan(valor) else valor
+
+    return {
+        "protocolo": protocolo, "motor": motor, "escenario": escenario,
+        "sesiones": args.sesiones, "mensajes": args.mensajes,
+        "entregados": len(latencias), "esperados": esperadas,
+        "perdidos": max(0, esperadas - len(latencias)),
+        "latencia_p50_ms": ms(percentil(latencias, 50)),
+        "latencia_p99_ms": ms(percentil(latencias, 99)),
+        "mensajes_por_s": len(latencias) / duracion if duracion > 0 else 0.0,
+        "rss_kb": rss, "rss_max_kb": rss_max,
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def comparar(resultados, archivo):
+    """Imprime la variacion de cada medida contra una corrida anterior guardada con --salida"""
+    with open(archivo) as f:
+        anteriores = {(r["protocolo"], r["motor"], r["escenario"]): r for r in json.load(f)["resultados"]}
+    for r in resultados:
+        base = anteriores.get((r["protocolo"], r["motor"], r["escenario"]))
+        if base is None:
+            continue
+        partes = []
+        for medida in ("latencia_p50_ms", "latencia_p99_ms", "mensajes_por_s", "rss_max_kb"):
+            if base[medida] and r[medida] is not None:
+                partes.append(f"{medida} {100 * (r[medida] - base[medida]) / base[medida]:+.1f}%")
+        print(f"{r['protocolo']}/{r['motor']}/{r['escenario']}: " + "  ".join(partes), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de punta a punta de server_tcp y server_udp")
+    parser.add_argument("--protocolos", default="tcp,udp")
+    parser.add_argument("--motores-tcp", default="hilos,asyncio")
+    parser.add_argument("--motores-udp", default="simple,lotes")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--sesiones", type=int, default=50)
+    parser.add_argument("--mensajes", type=int, default=20, help="mensajes (o vueltas en churn) por sesion")
+    parser.add_argument("--intervalo", type=float, default=0.02, help="segundos entre mensajes de una sesion")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", help="archivo JSON (por defecto se escribe en la salida estandar)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    motores = {"tcp": args.motores_tcp.split(","), "udp": args.motores_udp.split(",")}
+    resultados = []
+    for protocolo in args.protocolos.split(","):
+        for motor in motores[protocolo]:
+            for escenario in args.escenarios.split(","):
+                if escenario not in ESCENARIOS:
+                    raise SystemExit(f"Escenario desconocido: {escenario}")
+                r = correr(protocolo, motor, escenario, args)
+                print(f"{protocolo}/{motor}/{escenario}: p50={r['latencia_p50_ms']}ms "
+                      f"p99={r['latencia_p99_ms']}ms {r['mensajes_por_s']:.0f} msg/s "
+                      f"perdidos={r['perdidos']} rss_max={r['rss_max_kb'] / 1024:.1f}MB", file=sys.stderr)
+                resultados.append(r)
+
+    documento = {
+        "commit": commit(), "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(), "maquina": platform.machine(), "cpus": os.cpu_count(),
+        "parametros": {"sesiones": args.sesiones, "mensajes": args.mensajes,
+                       "intervalo": args.intervalo, "semilla": args.semilla},
+        "resultados": resultados,
+    }
+    texto = json.dumps(documento, indent=2)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+
+if __name__ == "__main__":
+    main()
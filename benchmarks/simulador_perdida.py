@@ -0,0 +1,149 @@
+"""Simulador de red con perdida, duplicados y desorden para probar udp_confiable.py.
+
+Arranca server_udp.py y pone en el medio un proxy UDP que, en los dos sentidos, descarta una
+fraccion de los datagramas, duplica otros y demora algunos para que lleguen desordenados. Dos
+clientes confiables se registran a traves del proxy; uno manda mensajes numerados (algunos mas
+grandes que 4096 bytes, para que se fragmenten) y se verifica que el otro los reciba todos,
+una sola vez y en orden. Con --sin-confiable se corre lo mismo con UDP plano para comparar.
+
+Uso: python benchmarks/simulador_perdida.py --perdida 0.2 --duplicados 0.05 --desorden 0.2"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import cliente_udp  # noqa: E402
+
+HOST = "127.0.0.1"
+
+
+def puerto_libre():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+class Proxy:
+    """Reenvia datagramas entre los clientes y el servidor aplicando las fallas. Cada cliente
+    tiene su propio socket hacia el servidor, asi el servidor ve direcciones distintas"""
+
+    def __init__(self, puerto_servidor, perdida, duplicados, desorden, demora):
+        self.servidor = (HOST, puerto_servidor)
+        self.perdida = perdida
+        self.duplicados = duplicados
+        self.desorden = desorden
+        self.demora = demora
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((HOST, 0))
+        self.puerto = self.sock.getsockname()[1]
+        self.hacia_servidor = {}
+        self.descartados = 0
+        threading.Thread(target=self._desde_clientes, daemon=True).start()
+
+    def _reenviar(self, sock, datos, destino):
+        if random.random() < self.perdida:
+            self.descartados += 1
+            return
+        copias = 2 if random.random() < self.duplicados else 1
+        for _ in range(copias):
+            if random.random() < self.desorden:
+                threading.Timer(random.uniform(0, self.demora), sock.sendto, (datos, destino)).start()
+            else:
+                sock.sendto(datos, destino)
+
+    def _desde_clientes(self):
+        while True:
+            datos, cliente = self.sock.recvfrom(65536)
+            upstream = self.hacia_servidor.get(cliente)
+            if upstream is None:
+                upstream = self.hacia_servidor[cliente] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                upstream.bind((HOST, 0))
+                threading.Thread(target=self._desde_servidor, args=(upstream, cliente), daemon=True).start()
+            self._reenviar(upstream, datos, self.servidor)
+
+    def _desde_servidor(self, upstream, cliente):
+        while True:
+            datos, _ = upstream.recvfrom(65536)
+            self._reenviar(self.sock, datos, cliente)
+
+
+def correr(args):
+    puerto = puerto_libre()
+    env = dict(os.environ, CHAT_HISTORIAL_DIR=tempfile.mkdtemp(prefix="historial-sim-"), CHAT_HISTORIAL_REPETIR="0")
+    proc = subprocess.Popen([sys.executable, "server_udp.py", "--puerto", str(puerto), "--mensajes-por-segundo", "0"],
+                            cwd=RAIZ, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    try:
+        proxy = Proxy(puerto, args.perdida, args.duplicados, args.desorden, args.demora)
+        cliente_udp.SERVER_PORT = proxy.puerto
+        confiable = not args.sin_confiable
+        emisor = cliente_udp.ClienteUDP(confiable=confiable)
+        receptor = cliente_udp.ClienteUDP(confiable=confiable)
+        emisor.conectar("emisor")
+        receptor.conectar("receptor")
+        time.sleep(0.5)
+
+        recibidos = []
+        receptor.sock.settimeout(args.espera)
+
+        def escuchar():
+            while len(recibidos) < args.mensajes:
+                msg = receptor.recibir_mensaje()
+                if msg is None:
+                    return
+                if "msg#" in msg:
+                    recibidos.append(msg)
+
+        def drenar():
+            """el emisor tambien tiene que leer su socket para procesar los ACK del servidor"""
+            while emisor.conectado:
+                emisor.recibir_mensaje()
+
+        hilo = threading.Thread(target=escuchar, daemon=True)
+        hilo.start()
+        threading.Thread(target=drenar, daemon=True).start()
+        inicio = time.perf_counter()
+        for i in range(args.mensajes):
+            relleno = "x" * (args.grande if i % 10 == 0 else 0)
+            emisor.enviar_mensaje(f"msg#{i}# {relleno}")
+            time.sleep(args.intervalo)
+        hilo.join(args.espera + args.mensajes * args.intervalo)
+        duracion = time.perf_counter() - inicio
+
+        numeros = [int(m.split("msg#")[1].split("#")[0]) for m in recibidos]
+        en_orden = numeros == sorted(numeros)
+        completos = all(len(m.split("msg#", 1)[1].split("#", 1)[1].strip()) == (args.grande if n % 10 == 0 else 0)
+                        for m, n in zip(recibidos, numeros))
+        print(f"modo={'confiable' if confiable else 'plano'} perdida={args.perdida} duplicados={args.duplicados} "
+              f"desorden={args.desorden}")
+        print(f"  recibidos {len(recibidos)}/{args.mensajes}  unicos={len(set(numeros))}  en_orden={en_orden}  "
+              f"grandes_completos={completos}")
+        print(f"  datagramas descartados por el proxy={proxy.descartados}  "
+              f"retransmisiones={emisor.canal.retransmitidos if emisor.canal else 0}  duracion={duracion:.2f}s")
+        emisor.cerrar()
+        receptor.cerrar()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba udp_confiable con perdida y desorden simulados")
+    parser.add_argument("--mensajes", type=int, default=200)
+    parser.add_argument("--perdida", type=float, default=0.2)
+    parser.add_argument("--duplicados", type=float, default=0.05)
+    parser.add_argument("--desorden", type=float, default=0.2)
+    parser.add_argument("--demora", type=float, default=0.05, help="demora maxima (s) de los paquetes desordenados")
+    parser.add_argument("--grande", type=int, default=10000, help="bytes de los mensajes grandes (1 de cada 10)")
+    parser.add_argument("--intervalo", type=float, default=0.002)
+    parser.add_argument("--espera", type=float, default=10.0)
+    parser.add_argument("--sin-confiable", action="store_true")
+    correr(parser.parse_args())
@@ -0,0 +1,277 @@
+"""Prueba de estres del registro de usuarios (padron.py), con altas, bajas, busquedas y broadcast
+al mismo tiempo desde varios hilos.
+
+- rendimiento: el Padron contra el registro anterior (un diccionario con un solo lock, copiado
+  en cada broadcast). Unos hilos entran y salen con nombres propios, otros buscan nombres y
+  otros toman la lista de destinatarios de un broadcast; se cuentan las operaciones por segundo
+  de cada tipo, con pocos y muchos usuarios fijos. Cada tipo se mide solo y con los tres juntos:
+  con el GIL los hilos se reparten el interprete, asi que en la mezcla lo que un tipo deja de
+  esperar en un lock lo pueden perder los otros
+- invariantes: nucleo.registrar(), nucleo.salir() y nucleo.broadcast() de verdad con sesiones
+  falsas. Mientras otros hilos entran y salen (la mitad con direccion, como server_udp), cada
+  sesion fija tiene que recibir cada broadcast exactamente una vez; varios hilos que registran
+  el mismo nombre a la vez tienen que quedar con uno solo adentro; y al final el registro, la
+  foto y el indice inverso tienen que coincidir
+
+Termina con codigo 1 si alguna invariante no se cumple.
+
+Uso: python benchmarks/stress_padron.py [--fijos 10,1000] [--segundos 2] [--hilos 4]"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import admision  # noqa: E402
+import nucleo  # noqa: E402
+import padron  # noqa: E402
+import salas  # noqa: E402
+
+MARCA = "#difusion"
+
+TIPOS = ("altas+bajas", "busquedas", "broadcast")
+
+
+class RegistroAnterior:
+    """Como estaba en nucleo.py: un diccionario con un lock y una lista nueva por broadcast"""
+
+    def __init__(self):
+        self.usuarios = {}
+        self.lock = threading.Lock()
+
+    def agregar(self, nombre, sesion):
+        with self.lock:
+            if nombre in self.usuarios:
+                raise padron.NombreOcupado(nombre)
+            self.usuarios[nombre] = sesion
+
+    def quitar(self, nombre, sesion):
+        with self.lock:
+            if self.usuarios.get(nombre) is not sesion:
+                return False
+            del self.usuarios[nombre]
+            return True
+
+    def sesion(self, nombre):
+        with self.lock:
+            return self.usuarios.get(nombre)
+
+    def sesiones(self):
+        with self.lock:
+            return list(self.usuarios.values())
+
+
+class SesionFalsa:
+    """Guarda lo que le llega; list.append es atomico, asi que varios hilos pueden encolar"""
+
+    def __init__(self, modo="texto"):
+        self.modo = modo
+        self.recibidos = []
+        self.encolar = self.recibidos.append
+
+    def profundidad(self):
+        return 0
+
+    def difusiones(self):
+        return [datos for datos in self.recibidos if datos.startswith(MARCA.encode())]
+
+
+def correr(hilos, segundos):
+    """Arranca los hilos (funciones que reciben el evento de parada y devuelven cuantas
+    operaciones hicieron) y devuelve la suma por tipo"""
+    parada = threading.Event()
+    totales = {}
+    lock = threading.Lock()
+
+    def envolver(tipo, funcion):
+        hechas = funcion(parada)
+        with lock:
+            totales[tipo] = totales.get(tipo, 0) + hechas
+
+    corriendo = [threading.Thread(target=envolver, args=hilo) for hilo in hilos]
+    for hilo in corriendo:
+        hilo.start()
+    time.sleep(segundos)
+    parada.set()
+    for hilo in corriendo:
+        hilo.join()
+    return totales
+
+
+def rendimiento(registro, fijos, segundos, hilos, tipos=TIPOS):
+    for i in range(fijos):
+        registro.agregar(f"fijo{i}", SesionFalsa())
+
+    def rotar(numero):
+        def funcion(parada):
+            hechas = 0
+            sesion = SesionFalsa()
+            while not parada.is_set():
+                nombre = f"rota{numero}-{hechas}"
+                registro.agregar(nombre, sesion)
+                registro.quitar(nombre, sesion)
+                hechas += 1
+            return hechas
+        return funcion
+
+    def buscar(parada):
+        hechas = 0
+        while not parada.is_set():
+            registro.sesion(f"fijo{hechas % fijos}")
+            hechas += 1
+        return hechas
+
+    def difundir(parada):
+        hechas = 0
+        while not parada.is_set():
+            for sesion in registro.sesiones():
+                pass
+            hechas += 1
+        return hechas
+
+    funciones = {"altas+bajas": rotar, "busquedas": lambda _: buscar, "broadcast": lambda _: difundir}
+    tareas = [(tipo, funciones[tipo](i)) for tipo in tipos for i in range(hilos)]
+    totales = correr(tareas, segundos)
+    return {tipo: hechas / segundos for tipo, hechas in totales.items()}
+
+
+def comparar(cantidades, segundos, hilos):
+    print(f"rendimiento: {hilos} hilos por tipo, {segundos}s por corrida (operaciones por segundo)\n"
+          f"solo corre un tipo a la vez, mezcla corre los tres juntos")
+    print(f"{'fijos':>7}{'tipo':>14}{'solo antes':>13}{'padron':>11}{'mezcla antes':>15}{'padron':>11}")
+    for fijos in cantidades:
+        mezcla = [rendimiento(registro(), fijos, segundos, hilos) for registro in (RegistroAnterior, padron.Padron)]
+        for tipo in TIPOS:
+            solo = [rendimiento(registro(), fijos, segundos, hilos, (tipo,))[tipo]
+                    for registro in (RegistroAnterior, padron.Padron)]
+            print(f"{fijos:>7}{tipo:>14}{solo[0]:>13.0f}{solo[1]:>11.0f}{mezcla[0][tipo]:>15.0f}{mezcla[1][tipo]:>11.0f}")
+
+
+def reiniciar_nucleo():
+    admision.MAX_USUARIOS = 10 ** 6
+    nucleo.control = admision.ControlAdmision()
+    nucleo.usuarios = padron.Padron()
+    nucleo.indice_salas = salas.IndiceSalas()
+    nucleo.salas_previas.clear()
+
+
+def invariantes(fijos, segundos, hilos):
+    reiniciar_nucleo()
+    errores = []
+    permanentes = {}
+    for i in range(fijos):
+        sesion = permanentes[f"fijo{i}"] = SesionFalsa()
+        direccion = ("10.0.0.1", i) if i % 2 else None
+        if nucleo.registrar(f"fijo{i}", sesion, direccion=direccion) is not None:
+            errores.append(f"no se pudo registrar fijo{i}")
+
+    def rotar(numero):
+        def funcion(parada):
+            hechas = 0
+            while not parada.is_set():
+                nombre = f"rota{numero}-{hechas}"
+                sesion = SesionFalsa()
+                direccion = ("10.0.1.1", numero * 100000 + hechas) if hechas % 2 else None
+                rechazo = nucleo.registrar(nombre, sesion, direccion=direccion)
+                if rechazo is not None:
+                    errores.append(f"{nombre} rechazado: {rechazo}")
+                if direccion is not None and nucleo.usuarios.en(direccion) is not sesion:
+                    errores.append(f"{nombre} no aparece por su direccion")
+                if not nucleo.salir(sesion, nombre):
+                    errores.append(f"{nombre} no se pudo sacar")
+                if direccion is not None and nucleo.usuarios.en(direccion) is not None:
+                    errores.append(f"{nombre} sigue apareciendo por su direccion")
+                hechas += 1
+            return hechas
+        return funcion
+
+    def difundir(numero):
+        def funcion(parada):
+            hechas = 0
+            while not parada.is_set():
+                nucleo.broadcast(f"{MARCA} {numero} {hechas}\n")
+                hechas += 1
+            return hechas
+        return funcion
+
+    def repetidos(parada):
+        """rondas de varios hilos registrando el mismo nombre a la vez"""
+        rondas = 0
+        while not parada.is_set():
+            nombre = f"repetido{rondas}"
+            sesiones = [SesionFalsa() for _ in range(4)]
+            resultados = [None] * len(sesiones)
+            largada = threading.Barrier(len(sesiones))
+
+            def registrar(i):
+                largada.wait()
+                resultados[i] = nucleo.registrar(nombre, sesiones[i])
+
+            competidores = [threading.Thread(target=registrar, args=(i,)) for i in range(len(sesiones))]
+            for hilo in competidores:
+                hilo.start()
+            for hilo in competidores:
+                hilo.join()
+            adentro = [sesiones[i] for i, rechazo in enumerate(resultados) if rechazo is None]
+            if len(adentro) != 1 or nucleo.usuarios.sesion(nombre) is not adentro[0]:
+                errores.append(f"{nombre}: quedaron {len(adentro)} registrados")
+            for sesion in adentro:
+                nucleo.salir(sesion, nombre)
+            rondas += 1
+        return rondas
+
+    tareas = ([("altas+bajas", rotar(i)) for i in range(hilos)] + [("broadcast", difundir(i)) for i in range(hilos)]
+              + [("nombres repetidos", repetidos)])
+    totales = correr(tareas, segundos)
+
+    esperadas = None
+    for nombre, sesion in permanentes.items():
+        recibidas = sesion.difusiones()
+        if len(recibidas) != len(set(recibidas)):
+            errores.append(f"{nombre} recibio broadcast repetidos")
+        if len(recibidas) != totales["broadcast"]:
+            errores.append(f"{nombre} recibio {len(recibidas)} de {totales['broadcast']} broadcast")
+        if esperadas is None:
+            esperadas = set(recibidas)
+        elif set(recibidas) != esperadas:
+            errores.append(f"{nombre} recibio otros broadcast que los demas")
+
+    foto = dict(nucleo.usuarios.foto())
+    if foto != permanentes or len(nucleo.usuarios) != fijos:
+        errores.append(f"al final quedaron {len(nucleo.usuarios)} registrados y {len(foto)} en la foto, no {fijos}")
+    if set(nucleo.usuarios.sesiones()) != set(permanentes.values()):
+        errores.append("sesiones() no coincide con los registrados")
+    direcciones = {("10.0.0.1", i) for i in range(1, fijos, 2)}
+    if set(nucleo.usuarios.direcciones()) != direcciones:
+        errores.append("el indice inverso no coincide con las direcciones registradas")
+    for i in range(1, fijos, 2):
+        if nucleo.usuarios.en(("10.0.0.1", i)) is not permanentes[f"fijo{i}"]:
+            errores.append(f"fijo{i} no aparece por su direccion")
+
+    print(f"\ninvariantes: {fijos} fijos, {hilos} hilos de altas+bajas y {hilos} de broadcast, {segundos}s")
+    for tipo, hechas in sorted(totales.items()):
+        print(f"  {tipo:<20}{hechas:>10}")
+    for error in errores[:20]:
+        print(f"  ERROR {error}")
+    print(f"  {'bien' if not errores else f'{len(errores)} errores'}")
+    return not errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Altas, bajas y broadcast concurrentes sobre el padron")
+    parser.add_argument("--fijos", default="10,1000")
+    parser.add_argument("--segundos", type=float, default=2)
+    parser.add_argument("--hilos", type=int, default=4)
+    args = parser.parse_args()
+    cantidades = [int(x) for x in args.fijos.split(",")]
+
+    comparar(cantidades, args.segundos, args.hilos)
+    bien = all([invariantes(fijos, args.segundos, args.hilos) for fijos in cantidades])
+    sys.exit(0 if bien else 1)
+
+
+if __name__ == "__main__":
+    main()
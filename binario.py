@@ -0,0 +1,151 @@
+"""Formato binario compacto para los mensajes que manda el servidor. El formato de texto de
+siempre ("[nombre] [Fecha:dd/mm/YYYY hh:mm:ss AM] mensaje") obliga a cada cliente a buscar
+cadenas para saber que recibio (como hace app_gui.py con "[PRIVADO" in msj) y gasta unos 30
+bytes por mensaje en la fecha y los corchetes. Cada mensaje en este formato es un registro:
+
+    [tipo: u8][id: u32][fecha: u32 epoch][largo remitente: u8][largo sala: u8][remitente][sala][contenido]
+
+- tipo es una de las constantes de abajo; todas son menores a 0x20, asi un cliente distingue un
+  registro de un texto suelto (por ejemplo un error que el servidor UDP manda antes de registrar)
+- id es el del mensaje en el historial del servidor (0 si no se guardo, como los avisos); el
+  cliente recuerda el ultimo para pedir solo lo que se perdio al reconectarse (ver reanudacion.py)
+- remitente identifica al usuario por su nombre, que es lo que lo identifica en todos los
+  transportes y workers (en PRIVADO_ENVIADO es el destinatario)
+- sala solo viene en los mensajes grupales fuera de la sala general
+- contenido es el texto en UTF-8, sin el salto de linea final; en SESION es el token para
+  reanudar la sesion, que el cliente guarda y no muestra
+
+El cliente lo pide al conectarse mandando MAGIA antes del nombre: por TCP el resto viaja en
+tramas (ver protocolo.py) y por UDP cada registro es un datagrama. Lo que el cliente manda
+despues (mensajes y comandos) sigue siendo texto. La terminal de menu.py sigue en texto plano
+salvo con CHAT_TERMINAL_BINARIO=1 (ver cliente_tcp.py)."""
+import datetime
+import re
+import struct
+
+MAGIA = b"\x00BIN1"
+CABECERA = struct.Struct("!BIIBB")
+
+TEXTO = 1
+GRUPAL = 2
+PRIVADO = 3
+PRIVADO_ENVIADO = 4
+AVISO = 5
+ERROR = 6
+SESION = 7
+
+TIPOS = (TEXTO, GRUPAL, PRIVADO, PRIVADO_ENVIADO, AVISO, ERROR, SESION)
+
+FORMATO_FECHA = "%d/%m/%Y %I:%M:%S %p"
+PREFIJO_ERROR = "[ERROR] "
+
+
+class ErrorRegistro(ValueError):
+    """Los bytes recibidos no son un registro valido"""
+
+
+def _recortar(texto):
+    """El texto en UTF-8 con a lo sumo 255 bytes (lo que entra en su largo de un byte), cortado
+    entre caracteres para que siempre se pueda decodificar"""
+    datos = texto.encode()
+    if len(datos) <= 255:
+        return datos
+    return datos[:255].decode("utf-8", "ignore").encode()
+
+
+class Registro:
+    """Un mensaje del servidor ya separado en sus partes. texto() lo vuelve a armar en el formato
+    de texto de siempre, para mostrarlo igual que antes"""
+    __slots__ = ("tipo", "fecha", "remitente", "sala", "contenido", "id")
+
+    def __init__(self, tipo, fecha, remitente="", sala="", contenido="", id=0):
+        self.tipo = tipo
+        self.fecha = fecha
+        self.remitente = remitente
+        self.sala = sala
+        self.contenido = contenido
+        self.id = id
+
+    def codificar(self):
+        remitente = _recortar(self.remitente)
+        sala = _recortar(self.sala)
+        return (CABECERA.pack(self.tipo, self.id, self.fecha, len(remitente), len(sala))
+                + remitente + sala + self.contenido.encode())
+
+    def texto(self):
+        """El mensaje en el formato de texto, terminado en "\\n" como lo manda el servidor"""
+        if self.tipo == ERROR:
+            return f"{PREFIJO_ERROR}{self.contenido}\n"
+        if self.tipo not in (GRUPAL, PRIVADO, PRIVADO_ENVIADO):
+            return f"{self.contenido}\n"
+        fecha = datetime.datetime.fromtimestamp(self.fecha).strftime(FORMATO_FECHA)
+        if self.tipo == PRIVADO:
+            return f"[PRIVADO de {self.remitente}] [Fecha:{fecha}] {self.contenido}\n"
+        if self.tipo == PRIVADO_ENVIADO:
+            return f"[PRIVADO para {self.remitente}] [Fecha:{fecha}] {self.contenido}\n"
+        etiqueta = f"[#{self.sala}] " if self.sala else ""
+        return f"{etiqueta}[{self.remitente}] [Fecha:{fecha}] {self.contenido}\n"
+
+    def __repr__(self):
+        return (f"Registro({self.tipo}, {self.fecha}, {self.remitente!r}, {self.sala!r}, {self.contenido!r},"
+                f" id={self.id})")
+
+
+def es_registro(datos):
+    return len(datos) >= CABECERA.size and datos[0] in TIPOS
+
+
+def tipo_e_id(datos):
+    """(tipo, id) de un registro sin decodificar el resto"""
+    tipo, id_mensaje, *_ = CABECERA.unpack_from(datos)
+    return tipo, id_mensaje
+
+
+def decodificar(datos):
+    """Separa un registro recibido. Lee la cabecera en el lugar con unpack_from y corta los
+    textos sobre un memoryview, sin copias intermedias"""
+    if not es_registro(datos):
+        raise ErrorRegistro(f"No es un registro: {bytes(datos[:16])!r}")
+    tipo, id_mensaje, fecha, largo_remitente, largo_sala = CABECERA.unpack_from(datos)
+    with memoryview(datos) as vista:
+        inicio = CABECERA.size
+        remitente = str(vista[inicio:inicio + largo_remitente], "utf-8", "replace")
+        inicio += largo_remitente
+        sala = str(vista[inicio:inicio + largo_sala], "utf-8", "replace")
+        contenido = str(vista[inicio + largo_sala:], "utf-8", "replace")
+    return Registro(tipo, fecha, remitente, sala, contenido, id_mensaje)
+
+
+def leer(datos):
+    """Lo que usan los clientes en modo binario: el registro recibido o, si llego un texto suelto
+    (un error que el servidor manda antes de conocer el modo del cliente), su Registro armado
+    a partir del texto"""
+    if es_registro(datos):
+        return decodificar(datos)
+    return desde_texto(bytes(datos).decode(errors="replace"))
+
+
+"""Mensajes grupales y privados en el formato de texto (con la etiqueta de sala opcional)"""
+_LINEA = re.compile(r"(?:\[#(?P<sala>[^\]]+)\] )?\[(?:(?P<privado>PRIVADO de|PRIVADO para) )?(?P<nombre>[^\]]+)\]"
+                    r" \[Fecha:(?P<fecha>[^\]]+)\] (?P<contenido>.*)", re.S)
+
+
+def desde_texto(texto, fecha=0):
+    """Registro de un mensaje que solo se tiene en texto: avisos, errores, respuestas a comandos
+    y los mensajes que vienen del historial o del bus entre procesos. Los grupales y privados se
+    reconocen por su formato; lo demas queda como TEXTO con la fecha que se pase"""
+    if texto.endswith("\n"):
+        texto = texto[:-1]
+    if texto.startswith(PREFIJO_ERROR):
+        return Registro(ERROR, fecha, contenido=texto[len(PREFIJO_ERROR):])
+    if texto.startswith("***"):
+        return Registro(AVISO, fecha, contenido=texto)
+    partes = _LINEA.fullmatch(texto)
+    if partes is not None:
+        try:
+            fecha_mensaje = int(datetime.datetime.strptime(partes["fecha"], FORMATO_FECHA).timestamp())
+        except ValueError:
+            return Registro(TEXTO, fecha, contenido=texto)
+        tipo = {None: GRUPAL, "PRIVADO de": PRIVADO, "PRIVADO para": PRIVADO_ENVIADO}[partes["privado"]]
+        return Registro(tipo, fecha_mensaje, partes["nombre"], partes["sala"] or "", partes["contenido"])
+    return Registro(TEXTO, fecha, contenido=texto)
@@ -0,0 +1,79 @@
+"""Bus de mensajes entre procesos para el servidor TCP multiproceso (servidor_multiproceso.py).
+Cada worker tiene una multiprocessing.Queue de entrada; publicar un evento es ponerlo en la
+cola de los demas workers (o de uno solo si se sabe donde esta el destinatario).
+
+Eventos (tuplas):
+- ("broadcast", texto, remitente): aviso para todos los usuarios
+- ("sala", sala, texto, guardar): mensaje para los miembros de una sala; guardar dice si va al
+  historial de la sala en el worker que lo recibe (ver nucleo.enviar_a_sala)
+- ("priv", destino, texto): mensaje privado para un usuario de otro worker
+- ("entra", nombre, worker) / ("sale", nombre, worker): presencia, la maneja el propio bus
+  para saber en que worker esta cada usuario
+- ("caido", worker): el worker se cayo y el supervisor lo reinicia, sus usuarios ya no estan"""
+import threading
+
+
+class BusProcesos:
+    def __init__(self, id_worker, colas):
+        """colas es la lista de multiprocessing.Queue de todos los workers, la de la posicion
+        id_worker es la propia"""
+        self.id_worker = id_worker
+        self.colas = colas
+        self.remotos = {}
+        self.lock = threading.Lock()
+        self.hilo = None
+
+    def publicar(self, evento, worker=None):
+        """Envia el evento a un worker puntual o a todos los demas"""
+        if worker is not None:
+            self.colas[worker].put(evento)
+            return
+        for i, cola in enumerate(self.colas):
+            if i != self.id_worker:
+                cola.put(evento)
+
+    def anunciar_entrada(self, nombre):
+        self.publicar(("entra", nombre, self.id_worker))
+
+    def anunciar_salida(self, nombre):
+        self.publicar(("sale", nombre, self.id_worker))
+
+    def ubicar(self, nombre):
+        """Devuelve el worker donde esta conectado un usuario remoto o None"""
+        with self.lock:
+            return self.remotos.get(nombre)
+
+    def cantidad_remotos(self):
+        with self.lock:
+            return len(self.remotos)
+
+    def escuchar(self, manejador):
+        """Arranca un hilo que lee la cola propia. Los eventos de presencia actualizan la tabla
+        de usuarios remotos, el resto se le pasa al manejador del servidor"""
+
+        def bucle():
+            cola = self.colas[self.id_worker]
+            while True:
+                evento = cola.get()
+                if evento is None:
+                    return
+                tipo = evento[0]
+                if tipo == "entra":
+                    with self.lock:
+                        self.remotos[evento[1]] = evento[2]
+                elif tipo == "sale":
+                    with self.lock:
+                        if self.remotos.get(evento[1]) == evento[2]:
+                            del self.remotos[evento[1]]
+                elif tipo == "caido":
+                    with self.lock:
+                        for nombre in [n for n, w in self.remotos.items() if w == evento[1]]:
+                            del self.remotos[nombre]
+                else:
+                    manejador(evento)
+
+        self.hilo = threading.Thread(target=bucle, daemon=True)
+        self.hilo.start()
+
+    def cerrar(self):
+        self.colas[self.id_worker].put(None)
@@ -0,0 +1,209 @@
+"""Buzon de mensajes privados para usuarios que no estan conectados. Un /priv a alguien que ya
+entro alguna vez al chat (un usuario conocido) se guarda y se le entrega cuando vuelve.
+
+- En disco: un archivo por usuario en DIRECTORIO, con un registro binario por mensaje
+  ([fecha: f64][largo: u32][texto UTF-8]), y conocidos.txt con un nombre por linea
+- Limites: BUZON_MAXIMO bytes por usuario (el que manda recibe un error si esta lleno) y
+  EDAD_MAXIMA segundos; los mensajes vencidos se descartan al entregar y al arrancar se borran
+  los buzones que no se tocaron en ese tiempo
+
+guardar(), conocer() y entregar() solo dejan un pedido en una cola; un hilo los atiende en orden
+y junta las escrituras de cada usuario en un solo write. Asi ni el /priv ni el registro del
+usuario que vuelve esperan al disco, y una entrega siempre ve lo que se guardo antes.
+
+Configuracion por variables de entorno: CHAT_BUZON_DIR (por defecto "buzon" dentro del
+directorio del historial), CHAT_BUZON_MAXIMO (bytes) y CHAT_BUZON_DIAS.
+
+Con varios workers (servidor_multiproceso.py) todos usan el mismo directorio: el buzon se llena
+en el worker del que manda y se vacia en el del que vuelve. El limite de bytes lo lleva cada
+worker por su cuenta, asi que es aproximado."""
+import os
+import queue
+import struct
+import threading
+import time
+
+import historial
+import metricas
+
+DIRECTORIO = os.environ.get("CHAT_BUZON_DIR", os.path.join(historial.DIRECTORIO, "buzon"))
+BUZON_MAXIMO = int(os.environ.get("CHAT_BUZON_MAXIMO", str(64 * 1024)))
+EDAD_MAXIMA = float(os.environ.get("CHAT_BUZON_DIAS", "7")) * 86400
+
+CABECERA = struct.Struct("!dI")
+CONOCIDOS = "conocidos.txt"
+
+mensajes = metricas.Contador("chat_buzon_mensajes_total", "Mensajes privados del buzon de usuarios desconectados",
+                             ("evento",))
+
+
+class BuzonLleno(Exception):
+    """El buzon del destinatario llego a BUZON_MAXIMO bytes"""
+
+
+class Buzon:
+    def __init__(self, directorio=None):
+        self.directorio = directorio or DIRECTORIO
+        self.lock = threading.Lock()
+        self.tamanos = {}
+        self.pedidos = queue.SimpleQueue()
+        os.makedirs(self.directorio, exist_ok=True)
+        self._borrar_vencidos()
+        self.conocidos = set()
+        self.version_conocidos = None
+        self._leer_conocidos()
+        self.hilo = threading.Thread(target=self._atender, daemon=True)
+        self.hilo.start()
+
+    def _ruta(self, nombre):
+        """El nombre puede tener cualquier caracter, el archivo se llama con sus bytes en hexa"""
+        return os.path.join(self.directorio, nombre.encode().hex() + ".buz")
+
+    def _borrar_vencidos(self):
+        limite = time.time() - EDAD_MAXIMA
+        for archivo in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, archivo)
+            if archivo.endswith(".buz") and os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+
+    def _leer_conocidos(self):
+        """Carga conocidos.txt si cambio desde la ultima vez (otro worker pudo agregar nombres)"""
+        ruta = os.path.join(self.directorio, CONOCIDOS)
+        try:
+            version = os.stat(ruta).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if version == self.version_conocidos:
+            return
+        with open(ruta, encoding="utf-8") as f:
+            nombres = {linea.rstrip("\n") for linea in f}
+        with self.lock:
+            self.conocidos |= nombres
+            self.version_conocidos = version
+
+    def conocido(self, nombre):
+        with self.lock:
+            if nombre in self.conocidos:
+                return True
+        self._leer_conocidos()
+        with self.lock:
+            return nombre in self.conocidos
+
+    def conocer(self, nombre):
+        """Anota a un usuario que se registro, a partir de ahora se le pueden dejar mensajes"""
+        with self.lock:
+            if nombre in self.conocidos:
+                return
+            self.conocidos.add(nombre)
+        self.pedidos.put(("conocer", nombre, None))
+
+    def guardar(self, nombre, texto):
+        """Deja un mensaje ya formateado en el buzon de un usuario. Lanza BuzonLleno si no entra"""
+        datos = texto.encode()
+        registro = CABECERA.pack(time.time(), len(datos)) + datos
+        with self.lock:
+            tamano = self.tamanos.get(nombre)
+            if tamano is None:
+                ruta = self._ruta(nombre)
+                tamano = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+            if tamano + len(registro) > BUZON_MAXIMO:
+                mensajes.inc(1, ("lleno",))
+                raise BuzonLleno(f"El buzon de {nombre} esta lleno")
+            self.tamanos[nombre] = tamano + len(registro)
+        mensajes.inc(1, ("guardado",))
+        self.pedidos.put(("guardar", nombre, registro))
+
+    def entregar(self, nombre, entregar):
+        """Vacia el buzon de un usuario que volvio: entregar(textos) se llama desde el hilo del
+        buzon con todos sus mensajes juntos (no se llama si no tenia ninguno). Si devuelve False
+        (el usuario ya se fue otra vez) los mensajes vuelven al buzon"""
+        self.pedidos.put(("entregar", nombre, entregar))
+
+    def _atender(self):
+        """Hilo del buzon: atiende los pedidos en orden. Un error de disco (disco lleno, permisos)
+        se cuenta en metricas.errores y el hilo sigue con los pedidos siguientes; si se cortara,
+        los pedidos se juntarian en la cola para siempre"""
+        while True:
+            lote = [self.pedidos.get()]
+            while True:
+                try:
+                    lote.append(self.pedidos.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._atender_lote(lote)
+            except Exception as e:
+                metricas.errores.inc(1, (type(e).__name__,))
+
+    def _atender_lote(self, lote):
+        """Las escrituras de cada usuario se juntan en memoria y se bajan a disco con un solo
+        write al final del lote (o antes de entregarle). Si falla el disco con un usuario se
+        pierden sus mensajes de este lote pero no los de los demas"""
+        escrituras = {}
+        conocidos = []
+        for tipo, nombre, dato in lote:
+            if tipo == "guardar":
+                escrituras.setdefault(nombre, []).append(dato)
+            elif tipo == "conocer":
+                conocidos.append(nombre)
+            else:
+                try:
+                    self._entregar(nombre, escrituras.pop(nombre, []), dato)
+                except OSError as e:
+                    metricas.errores.inc(1, (type(e).__name__,))
+        for nombre, registros in escrituras.items():
+            try:
+                with open(self._ruta(nombre), "ab") as f:
+                    f.write(b"".join(registros))
+            except OSError as e:
+                metricas.errores.inc(1, (type(e).__name__,))
+                mensajes.inc(len(registros), ("perdido",))
+                """el tamano se vuelve a leer del disco con el proximo mensaje"""
+                with self.lock:
+                    self.tamanos.pop(nombre, None)
+        if conocidos:
+            with open(os.path.join(self.directorio, CONOCIDOS), "a", encoding="utf-8") as f:
+                f.write("".join(n + "\n" for n in conocidos))
+
+    def _entregar(self, nombre, sin_escribir, entregar):
+        ruta = self._ruta(nombre)
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            os.remove(ruta)
+        except FileNotFoundError:
+            datos = b""
+        datos += b"".join(sin_escribir)
+        with self.lock:
+            self.tamanos[nombre] = 0
+        limite = time.time() - EDAD_MAXIMA
+        textos = []
+        vigentes = []
+        vencidos = 0
+        inicio = 0
+        while inicio + CABECERA.size <= len(datos):
+            fecha, largo = CABECERA.unpack_from(datos, inicio)
+            fin = inicio + CABECERA.size + largo
+            if fecha < limite:
+                vencidos += 1
+            else:
+                vigentes.append(datos[inicio:fin])
+                textos.append(datos[inicio + CABECERA.size:fin].decode(errors="replace"))
+            inicio = fin
+        if vencidos:
+            mensajes.inc(vencidos, ("vencido",))
+        if not textos:
+            return
+        try:
+            entregado = entregar(textos) is not False
+        except Exception as e:
+            """la sesion se cerro mientras tanto; el hilo del buzon tiene que seguir"""
+            metricas.errores.inc(1, (type(e).__name__,))
+            entregado = False
+        if entregado:
+            mensajes.inc(len(textos), ("entregado",))
+            return
+        with open(ruta, "ab") as f:
+            f.write(b"".join(vigentes))
+        with self.lock:
+            self.tamanos[nombre] = self.tamanos.get(nombre, 0) + sum(len(r) for r in vigentes)
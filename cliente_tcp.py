@@ -1,51 +1,197 @@
+import collections
+import os
 import socket
 import threading
 
+import archivos
+import binario
+import compresion
+import protocolo
+import reanudacion
+
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 5000
 
+"""CHAT_COMPRESION=1 hace que la terminal (y la GUI) pidan los mensajes comprimidos (ver
+compresion.py)"""
+COMPRESION = os.environ.get("CHAT_COMPRESION", "0") == "1"
+
+"""La terminal habla en texto plano. CHAT_TERMINAL_BINARIO=1 hace que pida los registros compactos
+como la GUI (recibir_mensaje los muestra en el texto de siempre), asi recibe el token de la sesion
+que hace falta para mandar archivos con /file"""
+TERMINAL_BINARIO = os.environ.get("CHAT_TERMINAL_BINARIO", "0") == "1"
+AVISO_SIN_TOKEN = "Para mandar archivos hace falta una sesion binaria (CHAT_TERMINAL_BINARIO=1)"
+
+"""Lo que devuelve recibir_mensaje() cuando se corta la conexion de un cliente con reconectar=True"""
+AVISO_PERDIDA = b"*** Se perdio la conexion con el servidor, reconectando... ***\n"
+
 class ClienteTCP:
-    def __init__(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def __init__(self, modo="tramas", reconectar=False, comprimir=False):
+        """modo "tramas" separa bien los mensajes aunque TCP los junte o los parta (ver protocolo.py),
+        modo "binario" ademas recibe registros compactos (ver binario.py) que se leen con
+        recibir_registro() sin buscar cadenas, y modo "texto" es el protocolo viejo donde cada
+        recv es un mensaje.
+        Con reconectar=True un corte no termina la sesion: recibir_mensaje() devuelve AVISO_PERDIDA
+        y la llamada siguiente se vuelve a conectar, esperando cada vez mas entre intentos (ver
+        reanudacion.py). En modo binario ademas retoma la sesion y recibe solo lo que se perdio.
+        Con comprimir=True (en los modos con tramas) el servidor manda los mensajes comprimidos y
+        se abren aca antes de devolverlos (ver compresion.py)"""
         self.conectado = False
+        self.modo = modo
+        self.comprimir = comprimir and modo != "texto"
+        self.pendientes = collections.deque()
+        self.reconectar = reconectar
+        self.nombre = None
+        self.token = None
+        self.ultimo_id = 0
+        self.caido = False
+        self.cerrado = threading.Event()
+        self._nuevo_socket()
+
+    def _nuevo_socket(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.modo != "texto":
+            self.lector = protocolo.LectorTramas()
+        else:
+            self.lector = protocolo.LectorTexto(tamano_recv=4096)
+        """el contexto de compresion es de cada conexion, con una nueva se empieza de cero"""
+        self.descompresor = compresion.Descompresor() if self.comprimir else None
+        self.interno = protocolo.LectorTramas(capacidad=4096) if self.comprimir else None
+        self.pendientes.clear()
 
     def conectar(self, nombre_usuario):
         """Conecta al socket y realiza el 'handshake' inicial del nombre."""
+        self.nombre = nombre_usuario
+        return self._conectar()
+
+    def _conectar(self):
         try:
             self.sock.connect((SERVER_IP, SERVER_PORT))
             
             # El servidor envía un prompt inicial (lo leemos para limpiar el buffer)
             prompt = self.sock.recv(1024).decode()
+            if prompt.startswith("ERROR"):
+                # el servidor rechazo la conexion (por ejemplo porque esta lleno)
+                self.sock.close()
+                return False, prompt.strip()
             
             # Enviamos el nombre inmediatamente como pide tu protocolo
-            self.sock.sendall(nombre_usuario.encode())
+            # (en modo tramas va precedido de MAGIA para que el servidor sepa como hablarnos;
+            # si ya tenemos token de una conexion anterior se pide reanudar la sesion)
+            presentacion = reanudacion.pedido(self.nombre, self.token, self.ultimo_id) if self.token else self.nombre
+            datos = protocolo.empaquetar(presentacion.encode(), self.modo)
+            if self.modo == "tramas":
+                datos = protocolo.MAGIA + datos
+            elif self.modo == "binario":
+                datos = binario.MAGIA + datos
+            if self.comprimir:
+                datos = compresion.MAGIA + datos
+            self.sock.sendall(datos)
             self.conectado = True
             return True, "Conectado exitosamente"
         except Exception as e:
             return False, f"Error de conexión: {e}"
 
+    def _reconectar(self):
+        """Intenta conectarse de nuevo hasta lograrlo, con las esperas de reanudacion.esperas().
+        False si el cliente se cerro mientras tanto"""
+        for espera in reanudacion.esperas():
+            if self.cerrado.wait(espera):
+                return False
+            self._nuevo_socket()
+            exito, _ = self._conectar()
+            if exito:
+                self.caido = False
+                return True
+
     def enviar_mensaje(self, mensaje):
         """Envía bytes al servidor."""
         if self.conectado:
             try:
-                self.sock.sendall(mensaje.encode())
+                self.sock.sendall(protocolo.empaquetar(mensaje.encode(), self.modo))
             except Exception as e:
                 print(f"Error enviando: {e}")
 
-    def recibir_mensaje(self):
-        """Intenta recibir mensajes. Retorna el mensaje o None si falla."""
-        if self.conectado:
+    def _siguiente(self):
+        """Siguiente mensaje del socket; con compresion una trama puede traer varios comprimidos"""
+        if self.descompresor is None:
+            return self.lector.siguiente(self.sock)
+        while not self.pendientes:
+            datos = self.lector.siguiente(self.sock)
+            if datos is None:
+                return None
+            abierto = self.descompresor.abrir(datos)
+            if abierto is None:
+                return datos
+            self.interno.alimentar(abierto)
+            mensaje = self.interno.pendiente()
+            while mensaje is not None:
+                self.pendientes.append(mensaje)
+                mensaje = self.interno.pendiente()
+        return self.pendientes.popleft()
+
+    def _recibir(self):
+        """Siguiente mensaje en bytes o None si se cerro la conexion o fallo. El token de la
+        sesion no se devuelve, se guarda; de los demas registros se anota el id"""
+        while self.conectado:
+            if self.caido and not self._reconectar():
+                return None
             try:
-                msg = self.sock.recv(4096).decode()
-                if not msg:
-                    self.cerrar()
-                    return None
-                return msg
+                datos = self._siguiente()
+            except socket.timeout:
+                return None
             except:
+                if not self.reconectar:
+                    return None
+                datos = None
+            if datos is None:
+                if self.reconectar and not self.cerrado.is_set():
+                    self.caido = True
+                    return AVISO_PERDIDA
+                self.cerrar()
                 return None
+            if self.modo == "binario" and binario.es_registro(datos):
+                tipo, id_mensaje = binario.tipo_e_id(datos)
+                if tipo == binario.SESION:
+                    self.token = binario.decodificar(datos).contenido
+                    continue
+                self.ultimo_id = max(self.ultimo_id, id_mensaje)
+            return datos
         return None
 
+    def enviar_archivo(self, destino, archivo, nombre_archivo=None):
+        """Manda un archivo (ruta u objeto abierto en modo binario) a destino por el canal de
+        archivos (ver archivos.py), sin ocupar esta conexion. Devuelve (exito, info)"""
+        if not self.token:
+            return False, AVISO_SIN_TOKEN
+        try:
+            archivos.subir_archivo(SERVER_IP, SERVER_PORT, self.nombre, self.token, destino, archivo, nombre_archivo)
+        except (OSError, archivos.ErrorTransferencia) as e:
+            return False, f"No se pudo mandar el archivo: {e}"
+        return True, f"Archivo enviado a {destino}"
+
+    def recibir_mensaje(self):
+        """Intenta recibir mensajes. Retorna el mensaje o None si falla."""
+        datos = self._recibir()
+        if datos is None:
+            return None
+        if self.modo == "binario":
+            return binario.leer(datos).texto()
+        return datos.decode()
+
+    def recibir_registro(self):
+        """Como recibir_mensaje pero devuelve un binario.Registro con el tipo, el remitente, la
+        fecha y el contenido separados. En los modos de texto se arma a partir del texto"""
+        datos = self._recibir()
+        if datos is None:
+            return None
+        if self.modo == "binario":
+            return binario.leer(datos)
+        return binario.desde_texto(datos.decode())
+
     def cerrar(self):
+        self.cerrado.set()
         self.conectado = False
         try:
             self.sock.close()
@@ -63,24 +209,25 @@ def escucharServidor(cliente_obj):
             break
 
 def main():
-    cliente = ClienteTCP()
-    # Simulación del input original
-    # Primero conectamos 'físicamente' para recibir el banner
-    # Nota: Modifiqué ligeramente el flujo para adaptar la clase
-    cliente.sock.connect((SERVER_IP, SERVER_PORT)) 
-    banner = cliente.sock.recv(1024).decode()
-    nombre = input(banner)
-    cliente.sock.sendall(nombre.encode())
-    cliente.conectado = True
+    cliente = ClienteTCP(modo="binario" if TERMINAL_BINARIO else "texto", comprimir=COMPRESION)
+    nombre = input("Usuario: ")
+    exito, info = cliente.conectar(nombre)
+    if not exito:
+        print(info)
+        return
 
     threading.Thread(target=escucharServidor, args=(cliente,), daemon=True).start()
 
-    print("Comandos:\n /priv usuario mensaje\n /salir")
+    print("Comandos:\n /priv usuario mensaje\n /join sala\n /leave [sala]\n /rooms\n /history [pagina]\n"
+          " /file usuario ruta\n /download id ruta\n /salir")
     while True:
         texto = input("> ").strip()
         if texto == "/salir":
             cliente.cerrar()
             break
+        if archivos.es_comando(texto):
+            print(archivos.comando(cliente, texto, SERVER_IP, SERVER_PORT))
+            continue
         cliente.enviar_mensaje(texto)
 
 if __name__ == "__main__":
@@ -1,42 +1,190 @@
+import collections
+import os
 import socket
 import threading
+import time
+
+import archivos
+import binario
+import cliente_tcp
+import compresion
+import presencia
+import reanudacion
+import udp_confiable
 
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 6000
 
+"""Los archivos van por el canal de archivos del servidor TCP (ver archivos.py; servidores.py
+corre los dos servidores juntos)"""
+PUERTO_ARCHIVOS = 5000
+
+"""CHAT_UDP_CONFIABLE=1 hace que la terminal use la entrega confiable (ver udp_confiable.py)"""
+CONFIABLE = os.environ.get("CHAT_UDP_CONFIABLE", "0") == "1"
+
+"""CHAT_COMPRESION=1 hace que la terminal pida los datagramas grandes comprimidos (ver compresion.py)"""
+COMPRESION = os.environ.get("CHAT_COMPRESION", "0") == "1"
+
+"""Lo que devuelve recibir_mensaje() cuando el servidor ya no reconoce la sesion de un cliente
+con reconectar=True (la expulso o se reinicio)"""
+AVISO_PERDIDA = b"*** Se perdio la sesion con el servidor, volviendo a registrarse... ***"
+
 class ClienteUDP:
-    def __init__(self):
+    def __init__(self, confiable=False, compacto=False, reconectar=False, comprimir=False):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind(("", 0)) # Puerto aleatorio
         self.conectado = False
+        """con confiable=True todo pasa por la capa de udp_confiable: el servidor la detecta por
+        el primer paquete y desde ahi le contesta igual. Los ACK llegan por recibir_mensaje, asi
+        que alguien tiene que estar leyendo (como el hilo escuchar de la terminal o la GUI)"""
+        self.canal = udp_confiable.CanalConfiable(self.sock) if confiable else None
+        """con compacto=True el servidor manda registros compactos (ver binario.py) que se leen
+        con recibir_registro() sin buscar cadenas"""
+        self.compacto = compacto
+        """con reconectar=True, si el servidor contesta que la sesion expiro recibir_mensaje()
+        devuelve AVISO_PERDIDA y la llamada siguiente vuelve a registrarse despues de una espera
+        que crece con cada intento fallido (ver reanudacion.py). Con compacto=True ademas retoma
+        la sesion con su token y recibe solo lo que se perdio"""
+        self.reconectar = reconectar
+        """con comprimir=True el servidor comprime los datagramas que pasan compresion.UMBRAL y se
+        abren aca antes de devolverlos"""
+        self.descompresor = compresion.Descompresor() if comprimir else None
+        self.nombre = None
+        self.token = None
+        self.ultimo_id = 0
+        self.caido = False
+        self.esperas = None
+        self.recibidos = collections.deque()
+        self.ultimo_envio = time.monotonic()
+        self.cerrado = threading.Event()
+
+    def _enviar(self, datos):
+        self.ultimo_envio = time.monotonic()
+        if self.canal is not None:
+            self.canal.enviar(datos, (SERVER_IP, SERVER_PORT))
+        else:
+            self.sock.sendto(datos, (SERVER_IP, SERVER_PORT))
 
     def conectar(self, nombre_usuario):
         """En UDP no hay conexión real, pero enviamos el nombre para registrarnos."""
         try:
-            self.sock.sendto(nombre_usuario.encode(), (SERVER_IP, SERVER_PORT))
+            self.nombre = nombre_usuario
+            self._registrar()
             self.conectado = True
+            threading.Thread(target=self._mantener_vivo, daemon=True).start()
             return True, "Registrado en UDP"
         except Exception as e:
             return False, f"Error UDP: {e}"
 
+    def _registrar(self):
+        presentacion = reanudacion.pedido(self.nombre, self.token, self.ultimo_id) if self.token else self.nombre
+        datos = presentacion.encode()
+        if self.compacto:
+            datos = binario.MAGIA + datos
+        if self.descompresor is not None:
+            datos = compresion.MAGIA + datos
+        self._enviar(datos)
+
+    def _volver(self):
+        """Vuelve a registrarse despues de la espera que toca (ver reanudacion.esperas). Las
+        esperas vuelven a empezar cuando llega un mensaje. False si el cliente se cerro"""
+        if self.esperas is None:
+            self.esperas = reanudacion.esperas()
+        if self.cerrado.wait(next(self.esperas)):
+            return False
+        self.caido = False
+        self._registrar()
+        return True
+
     def enviar_mensaje(self, mensaje):
         if self.conectado:
             try:
-                self.sock.sendto(mensaje.encode(), (SERVER_IP, SERVER_PORT))
+                self._enviar(mensaje.encode())
             except Exception as e:
                 print(f"Error enviando UDP: {e}")
 
-    def recibir_mensaje(self):
-        if self.conectado:
+    def _siguiente(self):
+        while not self.recibidos:
+            data, addr = self.sock.recvfrom(4096)
+            if self.canal is None:
+                self.recibidos.append(data)
+            else:
+                """los ACK no traen mensajes y un paquete puede completar varios"""
+                self.recibidos.extend(self.canal.procesar(data, addr) or ())
+        datos = self.recibidos.popleft()
+        if self.descompresor is not None:
+            abierto = self.descompresor.abrir(datos)
+            if abierto is not None:
+                return abierto
+        return datos
+
+    def _recibir(self):
+        """Siguiente datagrama con un mensaje (bytes) o None si fallo. El token de la sesion no se
+        devuelve, se guarda; de los demas registros se anota el id"""
+        while self.conectado:
+            if self.caido and not self._volver():
+                return None
             try:
-                data, addr = self.sock.recvfrom(4096)
-                return data.decode()
+                datos = self._siguiente()
             except:
                 return None
+            if self.reconectar and datos == presencia.EXPIRADA.encode():
+                self.caido = True
+                return AVISO_PERDIDA
+            self.esperas = None
+            if self.compacto and binario.es_registro(datos):
+                tipo, id_mensaje = binario.tipo_e_id(datos)
+                if tipo == binario.SESION:
+                    self.token = binario.decodificar(datos).contenido
+                    continue
+                self.ultimo_id = max(self.ultimo_id, id_mensaje)
+            return datos
         return None
 
+    def enviar_archivo(self, destino, archivo, nombre_archivo=None):
+        """Manda un archivo (ruta u objeto abierto en modo binario) a destino por el canal de
+        archivos (ver archivos.py), sin ocupar esta conexion. Devuelve (exito, info)"""
+        if not self.token:
+            return False, cliente_tcp.AVISO_SIN_TOKEN
+        try:
+            archivos.subir_archivo(SERVER_IP, PUERTO_ARCHIVOS, self.nombre, self.token, destino, archivo, nombre_archivo)
+        except (OSError, archivos.ErrorTransferencia) as e:
+            return False, f"No se pudo mandar el archivo: {e}"
+        return True, f"Archivo enviado a {destino}"
+
+    def recibir_mensaje(self):
+        datos = self._recibir()
+        if datos is None:
+            return None
+        if self.compacto:
+            return binario.leer(datos).texto()[:-1]
+        return datos.decode()
+
+    def recibir_registro(self):
+        """Como recibir_mensaje pero devuelve un binario.Registro con el tipo, el remitente, la
+        fecha y el contenido separados. Sin compacto=True se arma a partir del texto"""
+        datos = self._recibir()
+        if datos is None:
+            return None
+        if self.compacto:
+            return binario.leer(datos)
+        return binario.desde_texto(datos.decode())
+
+    def _mantener_vivo(self):
+        """Manda PING si no se envio nada en INTERVALO_PING segundos, para que el servidor no
+        expulse la sesion por inactividad (ver presencia.py)"""
+        while not self.cerrado.wait(presencia.INTERVALO_PING / 4):
+            if not self.caido and time.monotonic() - self.ultimo_envio >= presencia.INTERVALO_PING:
+                self.enviar_mensaje(presencia.PING)
+
     def cerrar(self):
+        """Avisa al servidor que se va, asi libera el lugar sin esperar a que venza la sesion"""
+        if self.conectado:
+            self.enviar_mensaje(presencia.SALIR)
+        self.cerrado.set()
         self.conectado = False
+        if self.canal is not None:
+            self.canal.cerrar()
         try:
             self.sock.close()
         except:
@@ -51,18 +199,23 @@ def escuchar(cliente_obj):
             print("> ", end="", flush=True)
 
 def main():
-    cliente = ClienteUDP()
+    """como en cliente_tcp, los registros compactos (y con ellos /file) solo con CHAT_TERMINAL_BINARIO=1"""
+    cliente = ClienteUDP(confiable=CONFIABLE, compacto=cliente_tcp.TERMINAL_BINARIO, comprimir=COMPRESION)
     nombre = input("Tu nombre de usuario: ")
     cliente.conectar(nombre)
 
     threading.Thread(target=escuchar, args=(cliente,), daemon=True).start()
 
-    print("Comandos:\n/priv usuario mensaje\n/salir")
+    print("Comandos:\n/priv usuario mensaje\n/join sala\n/leave [sala]\n/rooms\n/history [pagina]\n"
+          "/file usuario ruta\n/download id ruta\n/salir")
     while True:
         msg = input("> ").strip()
         if msg == "/salir":
             cliente.cerrar()
             break
+        if archivos.es_comando(msg):
+            print(archivos.comando(cliente, msg, SERVER_IP, PUERTO_ARCHIVOS))
+            continue
         cliente.enviar_mensaje(msg)
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+"""Colas de envio acotadas por cliente. Cada conexion tiene su propia cola de salida y un
+escritor (hilo o tarea asyncio) que la vacia hacia el socket, asi el broadcast solo encola
+y un cliente lento no retrasa la entrega a los demas.
+
+Cuando la cola de un cliente se llena se aplica una politica de desborde:
+- "descartar_antiguo": se tira el mensaje mas viejo de la cola para hacer lugar
+- "desconectar": se cierra la conexion del consumidor lento
+- "bloquear": quien encola espera hasta que haya lugar
+
+Si el cliente negocio compresion (ver compresion.py), lo que se encola con encolar_flujo() son
+los mensajes para esta sola conexion: quedan en la cola como una lista de paquetes y el escritor
+los comprime con el contexto de la conexion recien al mandarlos, en el orden en que salen. Lo
+que se encola con encolar() (los broadcast, ya comprimidos una vez para todos) sale tal cual."""
+import asyncio
+import collections
+import os
+import socket
+import threading
+
+import compresion
+import metricas
+import protocolo
+
+POLITICAS = ("descartar_antiguo", "desconectar", "bloquear")
+
+"""Valores por defecto, se pueden cambiar con variables de entorno"""
+TAMANO_COLA = int(os.environ.get("CHAT_TAMANO_COLA", "256"))
+POLITICA = os.environ.get("CHAT_POLITICA_COLA", "descartar_antiguo")
+
+
+def validar_politica(politica):
+    if politica not in POLITICAS:
+        raise ValueError(f"Politica de cola desconocida: {politica} (opciones: {', '.join(POLITICAS)})")
+    return politica
+
+
+def preparar(flujo, datos):
+    """Lo que saca el escritor de la cola, listo para el socket: una lista de paquetes de
+    encolar_flujo() se une y pasa por el contexto de compresion de la conexion. Un lote enorme
+    va sin comprimir, asi lo comprimido siempre entra en una trama"""
+    if not isinstance(datos, list):
+        return datos
+    datos = b"".join(datos)
+    comprimido = flujo.comprimir(datos) if len(datos) <= protocolo.TAMANO_MAXIMO // 2 else None
+    return datos if comprimido is None else protocolo.enmarcar(comprimido)
+
+
+class ColaEnvio:
+    """Cola de salida de un socket con su hilo escritor. encolar() nunca toca el socket,
+    el hilo escritor es el unico que llama a sendall. modo indica si el cliente recibe texto
+    plano, tramas o registros compactos en tramas (ver protocolo.py) y comprimir si negocio
+    compresion"""
+
+    def __init__(self, conn, tamano=None, politica=None, modo="texto", comprimir=False):
+        self.conn = conn
+        self.modo = modo
+        self.comprimir = comprimir
+        self.flujo = compresion.Flujo() if comprimir else None
+        self.tamano = tamano or TAMANO_COLA
+        self.politica = validar_politica(politica or POLITICA)
+        self.mensajes = collections.deque()
+        self.condicion = threading.Condition()
+        self.cerrada = False
+        self.descartados = 0
+        self.hilo = threading.Thread(target=self._escribir, daemon=True)
+        self.hilo.start()
+
+    def profundidad(self):
+        return len(self.mensajes)
+
+    def encolar(self, datos):
+        """Agrega bytes a la cola aplicando la politica de desborde. Devuelve False si el
+        mensaje no se encolo (cola cerrada o cliente desconectado por lento)"""
+        with self.condicion:
+            if self.cerrada:
+                return False
+            if len(self.mensajes) >= self.tamano:
+                if self.politica == "descartar_antiguo":
+                    self.mensajes.popleft()
+                    self.descartados += 1
+                    metricas.descartados.inc(1, ("cola_llena",))
+                elif self.politica == "desconectar":
+                    self.descartados += 1
+                    metricas.descartados.inc(1, ("cola_llena",))
+                    self._cortar()
+                    return False
+                else:
+                    while len(self.mensajes) >= self.tamano and not self.cerrada:
+                        self.condicion.wait()
+                    if self.cerrada:
+                        return False
+            self.mensajes.append(datos)
+            self.condicion.notify_all()
+            return True
+
+    def encolar_flujo(self, paquetes):
+        """Como encolar() pero con mensajes para esta sola conexion, que el escritor comprime con
+        el contexto de la conexion (solo si comprimir)"""
+        return self.encolar(paquetes)
+
+    def enviar(self, datos):
+        """Encola un mensaje suelto adaptandolo al modo del cliente (texto o tramas)"""
+        return self.encolar(protocolo.empaquetar(datos, self.modo))
+
+    def cortar(self):
+        """Corta la conexion desde afuera (el usuario retomo su sesion desde otra, ver nucleo.py)"""
+        with self.condicion:
+            self._cortar()
+
+    def _cortar(self):
+        """Cierra la cola y hace shutdown del socket para que el hilo lector del cliente
+        salga del recv y haga la limpieza normal de desconexion"""
+        self.cerrada = True
+        self.mensajes.clear()
+        self.condicion.notify_all()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _escribir(self):
+        """Hilo escritor: saca mensajes de la cola y los manda al socket uno por uno"""
+        while True:
+            with self.condicion:
+                while not self.mensajes and not self.cerrada:
+                    self.condicion.wait()
+                if not self.mensajes:
+                    return
+                datos = self.mensajes.popleft()
+                self.condicion.notify_all()
+            try:
+                datos = preparar(self.flujo, datos)
+                self.conn.sendall(datos)
+            except OSError:
+                metricas.descartados.inc(1, ("error_envio",))
+                with self.condicion:
+                    self._cortar()
+                return
+            metricas.bytes_salida.inc(len(datos), ("tcp",))
+
+    def cerrar(self, timeout=1.0):
+        """Deja de aceptar mensajes y espera un poco a que el escritor mande lo pendiente"""
+        with self.condicion:
+            self.cerrada = True
+            self.condicion.notify_all()
+        if threading.current_thread() is not self.hilo:
+            self.hilo.join(timeout)
+
+
+class ColaEnvioAsync:
+    """Misma idea que ColaEnvio para el motor asyncio: una tarea escritora por cliente que
+    vacia la cola hacia el StreamWriter y espera drain() entre mensajes.
+
+    Como el registro de usuarios es comun a todos los transportes (ver nucleo.py), a esta cola
+    tambien encolan hilos que no son el del event loop (server_udp, el bus entre procesos o un
+    /history que se lee en el executor). Esas llamadas se pasan al loop con call_soon_threadsafe"""
+
+    def __init__(self, writer, tamano=None, politica=None, modo="texto", comprimir=False):
+        self.writer = writer
+        self.modo = modo
+        self.comprimir = comprimir
+        self.flujo = compresion.Flujo() if comprimir else None
+        self.tamano = tamano or TAMANO_COLA
+        self.politica = validar_politica(politica or POLITICA)
+        self.mensajes = collections.deque()
+        self.hay_datos = asyncio.Event()
+        self.hay_lugar = asyncio.Event()
+        self.hay_lugar.set()
+        self.cerrada = False
+        self.descartados = 0
+        self.loop = asyncio.get_running_loop()
+        self.hilo_loop = threading.get_ident()
+        self.tarea = asyncio.ensure_future(self._escribir())
+
+    def profundidad(self):
+        return len(self.mensajes)
+
+    def encolar(self, datos):
+        """Version sin espera, es la que usa el nucleo (que no es asincronico). Con la politica
+        "bloquear" y la cola llena no se puede frenar a quien encola, asi que la espera de lugar
+        la hace una tarea del loop. Desde otro hilo el mensaje se le pasa al loop y devuelve True
+        mientras la cola no este cerrada"""
+        if threading.get_ident() != self.hilo_loop:
+            if self.cerrada:
+                return False
+            try:
+                self.loop.call_soon_threadsafe(self._encolar_o_esperar, datos)
+            except RuntimeError:
+                """el event loop ya termino"""
+                return False
+            return True
+        return self._encolar_o_esperar(datos)
+
+    def _encolar_o_esperar(self, datos):
+        if self._encolar(datos):
+            return True
+        if self.cerrada:
+            return False
+        asyncio.ensure_future(self.encolar_espera(datos))
+        return True
+
+    def _encolar(self, datos):
+        if self.cerrada:
+            return False
+        if len(self.mensajes) >= self.tamano:
+            if self.politica == "descartar_antiguo":
+                self.mensajes.popleft()
+                self.descartados += 1
+                metricas.descartados.inc(1, ("cola_llena",))
+            elif self.politica == "desconectar":
+                self.descartados += 1
+                metricas.descartados.inc(1, ("cola_llena",))
+                self._cortar()
+                return False
+            else:
+                return False
+        self.mensajes.append(datos)
+        if len(self.mensajes) >= self.tamano:
+            self.hay_lugar.clear()
+        self.hay_datos.set()
+        return True
+
+    async def encolar_espera(self, datos):
+        """Encola esperando lugar si la politica es "bloquear", en otro caso igual que encolar()"""
+        while self.politica == "bloquear" and len(self.mensajes) >= self.tamano and not self.cerrada:
+            await self.hay_lugar.wait()
+        return self._encolar(datos)
+
+    def encolar_flujo(self, paquetes):
+        return self.encolar(paquetes)
+
+    async def enviar(self, datos):
+        return await self.encolar_espera(protocolo.empaquetar(datos, self.modo))
+
+    def cortar(self):
+        """Igual que ColaEnvio.cortar(), desde cualquier hilo"""
+        if threading.get_ident() != self.hilo_loop:
+            try:
+                self.loop.call_soon_threadsafe(self._cortar)
+            except RuntimeError:
+                pass
+            return
+        self._cortar()
+
+    def _cortar(self):
+        self.cerrada = True
+        self.mensajes.clear()
+        self.hay_datos.set()
+        self.hay_lugar.set()
+        self.writer.close()
+
+    async def _escribir(self):
+        try:
+            while True:
+                while not self.mensajes:
+                    if self.cerrada:
+                        return
+                    self.hay_datos.clear()
+                    await self.hay_datos.wait()
+                datos = preparar(self.flujo, self.mensajes.popleft())
+                self.writer.write(datos)
+                self.hay_lugar.set()
+                await self.writer.drain()
+                metricas.bytes_salida.inc(len(datos), ("tcp",))
+        except (ConnectionError, OSError):
+            metricas.descartados.inc(1, ("error_envio",))
+            self._cortar()
+
+    async def cerrar(self, timeout=1.0):
+        self.cerrada = True
+        self.hay_datos.set()
+        self.hay_lugar.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.tarea), timeout)
+        except (asyncio.TimeoutError, Exception):
+            self.tarea.cancel()
@@ -0,0 +1,100 @@
+"""Compresion opcional de lo que manda el servidor, negociada por conexion. El cliente la pide
+mandando MAGIA antes que todo lo demas: por TCP antes de protocolo.MAGIA o binario.MAGIA (el modo
+"texto" no la usa), por UDP antes de binario.MAGIA o del nombre. Solo se comprime lo que manda el
+servidor, que es donde un mensaje se multiplica por la cantidad de destinatarios y donde viaja el
+historial al entrar; lo que mandan los clientes son lineas cortas.
+
+Se usa deflate crudo (zlib sin cabecera ni suma de control). Un mensaje comprimido empieza con
+una marca y ningun mensaje del servidor empieza con esos bytes (los textos empiezan con "[" o "*"
+y los registros compactos con su tipo, ver binario.py), asi los mensajes chicos, que no ganan
+nada, viajan igual que sin compresion:
+
+- SUELTO + deflate: comprimido solo, se abre sin estado. Es lo que reciben los broadcast:
+  mensajes.Mensaje lo arma una vez y todos los destinatarios con el mismo modo y compresion
+  comparten los mismos bytes (ver nucleo.difundir). Solo si tiene al menos UMBRAL bytes y se achica
+- FLUJO + deflate: solo por TCP, para los mensajes de una sola conexion (el historial al entrar o
+  reanudar, /history, el buzon, los privados). Pasan por un contexto propio de la conexion (Flujo)
+  que aprovecha lo que ya mando antes (nombres, fechas, salas) y achica hasta mensajes cortos. Lo
+  comprime el escritor de la cola de envio al mandarlo, asi un mensaje descartado por la cola
+  llena nunca rompe el flujo. Cada uno termina en un Z_SYNC_FLUSH sin sus 4 bytes finales
+  (00 00 ff ff), que agrega el cliente, como en permessage-deflate de WebSocket
+
+Por TCP lo comprimido va en una trama y al abrirlo salen una o varias tramas (ver protocolo.py);
+por UDP cada datagrama es un mensaje y se comprime solo (SUELTO).
+
+Configuracion por variables de entorno: CHAT_ZLIB_NIVEL, CHAT_ZLIB_UMBRAL, CHAT_ZLIB_UMBRAL_FLUJO
+y CHAT_ZLIB_VENTANA (bits de la ventana del contexto de cada conexion: con 12 ocupa unos 32 KB por
+conexion en lugar de los 256 KB que usa zlib por defecto).
+
+Para medir cuanto se ahorra y cuanto cuesta: python benchmarks/bench_compresion.py"""
+import os
+import zlib
+
+import metricas
+
+MAGIA = b"\x00ZLB1"
+
+SUELTO = 0x1E
+FLUJO = 0x1F
+FIN_FLUSH = b"\x00\x00\xff\xff"
+
+NIVEL = int(os.environ.get("CHAT_ZLIB_NIVEL", "6"))
+UMBRAL = int(os.environ.get("CHAT_ZLIB_UMBRAL", "128"))
+UMBRAL_FLUJO = int(os.environ.get("CHAT_ZLIB_UMBRAL_FLUJO", "32"))
+VENTANA = int(os.environ.get("CHAT_ZLIB_VENTANA", "12"))
+NIVEL_MEMORIA = 5
+
+bytes_comprimidos = metricas.Contador("chat_compresion_bytes_total",
+                                      "Bytes de los mensajes que se comprimieron, antes y despues",
+                                      ("forma", "medida"))
+
+
+def comprimir(datos):
+    """SUELTO + datos comprimidos, o None si datos es chico o no se achica"""
+    if len(datos) < UMBRAL:
+        return None
+    compresor = zlib.compressobj(NIVEL, zlib.DEFLATED, -VENTANA, NIVEL_MEMORIA)
+    comprimido = bytes((SUELTO,)) + compresor.compress(datos) + compresor.flush()
+    if len(comprimido) >= len(datos):
+        return None
+    bytes_comprimidos.inc(len(datos), ("suelto", "original"))
+    bytes_comprimidos.inc(len(comprimido), ("suelto", "comprimido"))
+    return comprimido
+
+
+class Flujo:
+    """Contexto de compresion de una conexion TCP. Lo usa solo el escritor de su cola de envio; el
+    compresor se crea con el primer mensaje que se comprime, asi una conexion que solo recibe
+    broadcast no ocupa su memoria"""
+    __slots__ = ("compresor",)
+
+    def __init__(self):
+        self.compresor = None
+
+    def comprimir(self, datos):
+        """FLUJO + datos comprimidos con lo anterior de la conexion, o None si datos es chico"""
+        if len(datos) < UMBRAL_FLUJO:
+            return None
+        if self.compresor is None:
+            self.compresor = zlib.compressobj(NIVEL, zlib.DEFLATED, -VENTANA, NIVEL_MEMORIA)
+        comprimido = self.compresor.compress(datos) + self.compresor.flush(zlib.Z_SYNC_FLUSH)
+        comprimido = bytes((FLUJO,)) + comprimido[:-len(FIN_FLUSH)]
+        bytes_comprimidos.inc(len(datos), ("flujo", "original"))
+        bytes_comprimidos.inc(len(comprimido), ("flujo", "comprimido"))
+        return comprimido
+
+
+class Descompresor:
+    """Lado del cliente, uno por conexion (el contexto de FLUJO sigue al del servidor)"""
+    __slots__ = ("flujo",)
+
+    def __init__(self):
+        self.flujo = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def abrir(self, datos):
+        """Lo que traia un mensaje comprimido, o None si datos no venia comprimido"""
+        if not datos or datos[0] not in (SUELTO, FLUJO):
+            return None
+        if datos[0] == SUELTO:
+            return zlib.decompress(datos[1:], -zlib.MAX_WBITS)
+        return self.flujo.decompress(bytes(datos[1:]) + FIN_FLUSH)
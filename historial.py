@@ -0,0 +1,193 @@
+"""Historial de mensajes del lado del servidor.
+
+- En disco: un log de solo agregado partido en segmentos (historial-000001.log, ...), una linea
+  JSON por mensaje. Cuando un segmento supera TAMANO_SEGMENTO se empieza el siguiente.
+- En memoria: un buffer circular acotado con los ultimos mensajes de cada sala y los ultimos
+  privados de cada usuario, para repetirlos al que entra sin tocar el disco.
+
+guardar() solo agrega al buffer en memoria y deja el registro en una cola; un hilo escritor los
+baja a disco en lotes, asi la persistencia no suma latencia al camino del broadcast.
+
+Configuracion por variables de entorno: CHAT_HISTORIAL_DIR, CHAT_HISTORIAL_REPETIR (mensajes que
+recibe quien entra), CHAT_HISTORIAL_MEMORIA (tamano de cada buffer circular)."""
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+DIRECTORIO = os.environ.get("CHAT_HISTORIAL_DIR", "historial")
+REPETIR = int(os.environ.get("CHAT_HISTORIAL_REPETIR", "20"))
+MEMORIA = int(os.environ.get("CHAT_HISTORIAL_MEMORIA", "200"))
+TAMANO_PAGINA = 20
+TAMANO_SEGMENTO = 1 << 20
+INTERVALO_ESCRITURA = 0.2
+
+
+class Historial:
+    def __init__(self, directorio=None, memoria=None):
+        self.directorio = directorio or DIRECTORIO
+        self.memoria = memoria or MEMORIA
+        self.por_sala = {}
+        self.por_usuario = {}
+        self.lock = threading.Lock()
+        self.pendientes = queue.SimpleQueue()
+        self.escrito = threading.Condition()
+        self.ultimo_id = 0
+        self.ultimo_escrito = 0
+        os.makedirs(self.directorio, exist_ok=True)
+        self.segmento, self.ultimo_id = self._abrir_ultimo_segmento()
+        self.ultimo_escrito = self.ultimo_id
+        self.hilo = threading.Thread(target=self._escribir, daemon=True)
+        self.hilo.start()
+
+    def _segmentos(self):
+        return sorted(n for n in os.listdir(self.directorio) if n.startswith("historial-") and n.endswith(".log"))
+
+    def _abrir_ultimo_segmento(self):
+        """Abre el ultimo segmento para seguir agregando, recupera el ultimo id usado y carga sus
+        mensajes en los buffers en memoria para poder repetirlos despues de reiniciar"""
+        segmentos = self._segmentos()
+        ultimo_id = 0
+        if segmentos:
+            for registro in self._leer_segmento(segmentos[-1]):
+                ultimo_id = registro["id"]
+                self._indexar(registro)
+            numero = int(segmentos[-1][len("historial-"):-len(".log")])
+        else:
+            numero = 1
+        return self._abrir(numero), ultimo_id
+
+    def _abrir(self, numero):
+        ruta = os.path.join(self.directorio, f"historial-{numero:06d}.log")
+        self.numero_segmento = numero
+        return open(ruta, "a", encoding="utf-8")
+
+    def _leer_segmento(self, nombre):
+        with open(os.path.join(self.directorio, nombre), encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    yield json.loads(linea)
+                except ValueError:
+                    """una linea cortada por un cierre abrupto se ignora"""
+                    continue
+
+    def guardar(self, texto, sala=None, de=None, para=None):
+        """Registra un mensaje ya formateado. sala para mensajes grupales, para/de para privados.
+        Devuelve el id asignado"""
+        with self.lock:
+            self.ultimo_id += 1
+            registro = {"id": self.ultimo_id, "ts": time.time(), "sala": sala, "de": de, "para": para, "texto": texto}
+            self._indexar(registro)
+            self.pendientes.put(registro)
+        return registro["id"]
+
+    def _indexar(self, registro):
+        if registro["sala"] is not None:
+            self._buffer(self.por_sala, registro["sala"]).append(registro)
+        if registro["para"] is not None:
+            for usuario in {registro["de"], registro["para"]} - {None}:
+                self._buffer(self.por_usuario, usuario).append(registro)
+
+    def _buffer(self, indice, clave):
+        buffer = indice.get(clave)
+        if buffer is None:
+            buffer = indice[clave] = collections.deque(maxlen=self.memoria)
+        return buffer
+
+    def recientes(self, sala, cantidad=None):
+        """Ultimos mensajes de una sala (del mas viejo al mas nuevo), sale de memoria"""
+        cantidad = REPETIR if cantidad is None else cantidad
+        with self.lock:
+            buffer = self.por_sala.get(sala, ())
+            return [r["texto"] for r in list(buffer)[-cantidad:]] if cantidad else []
+
+    def privados(self, usuario, cantidad=None):
+        """Ultimos mensajes privados enviados o recibidos por un usuario"""
+        cantidad = REPETIR if cantidad is None else cantidad
+        with self.lock:
+            buffer = self.por_usuario.get(usuario, ())
+            return [r["texto"] for r in list(buffer)[-cantidad:]] if cantidad else []
+
+    def al_entrar(self, sala, usuario=None, cantidad=None):
+        """Registros para repetirle a alguien que entra: los ultimos de la sala, en el orden en que
+        se guardaron (con su id, ver reanudacion.py). Con usuario se mezclan sus ultimos privados;
+        solo se pasa si retomo su sesion con un token valido, un nombre solo no prueba quien es"""
+        cantidad = REPETIR if cantidad is None else cantidad
+        if not cantidad:
+            return []
+        with self.lock:
+            registros = list(self.por_sala.get(sala, ()))[-cantidad:]
+            if usuario is not None:
+                registros += list(self.por_usuario.get(usuario, ()))[-cantidad:]
+        registros.sort(key=lambda r: r["id"])
+        return registros[-cantidad:]
+
+    def desde(self, ultimo, usuario, salas):
+        """Lo que se perdio un usuario que se reconecta: los registros de sus salas y sus privados
+        con id mayor a ultimo, sin los grupales que mando el mismo. Devuelve (registros, completo);
+        completo es False si algun buffer en memoria ya descarto mensajes de ese periodo"""
+        with self.lock:
+            buffers = [self.por_sala.get(sala, ()) for sala in salas] + [self.por_usuario.get(usuario, ())]
+            completo = all(len(b) < self.memoria or b[0]["id"] <= ultimo + 1 for b in buffers if b)
+            registros = [r for b in buffers for r in b if r["id"] > ultimo and not (r["sala"] is not None and r["de"] == usuario)]
+        registros.sort(key=lambda r: r["id"])
+        return registros, completo
+
+    def pagina(self, sala, numero=1, tamano=TAMANO_PAGINA):
+        """Pagina `numero` del historial de una sala yendo hacia atras (1 son los ultimos
+        `tamano` mensajes). Si la pagina esta en el buffer en memoria no se lee el disco"""
+        saltar = (numero - 1) * tamano
+        with self.lock:
+            buffer = list(self.por_sala.get(sala, ()))
+        if saltar + tamano <= len(buffer):
+            fin = len(buffer) - saltar
+            return [r["texto"] for r in buffer[max(0, fin - tamano):max(0, fin)]]
+
+        """la pagina es mas vieja que lo que hay en memoria: se baja lo pendiente y se recorren
+        los segmentos del mas nuevo al mas viejo"""
+        self.vaciar()
+        encontrados = []
+        for nombre in reversed(self._segmentos()):
+            registros = [r for r in self._leer_segmento(nombre) if r["sala"] == sala]
+            encontrados.extend(reversed(registros))
+            if len(encontrados) >= saltar + tamano:
+                break
+        return [r["texto"] for r in reversed(encontrados[saltar:saltar + tamano])]
+
+    def _escribir(self):
+        """Hilo escritor: junta todo lo pendiente y lo escribe en un solo write + flush"""
+        while True:
+            lote = [self.pendientes.get()]
+            time.sleep(INTERVALO_ESCRITURA)
+            while True:
+                try:
+                    lote.append(self.pendientes.get_nowait())
+                except queue.Empty:
+                    break
+            self.segmento.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in lote))
+            self.segmento.flush()
+            if self.segmento.tell() >= TAMANO_SEGMENTO:
+                self.segmento.close()
+                self.segmento = self._abrir(self.numero_segmento + 1)
+            with self.escrito:
+                self.ultimo_escrito = lote[-1]["id"]
+                self.escrito.notify_all()
+
+    def vaciar(self, timeout=2.0):
+        """Espera a que todo lo guardado hasta ahora este escrito en disco"""
+        objetivo = self.ultimo_id
+        with self.escrito:
+            self.escrito.wait_for(lambda: self.ultimo_escrito >= objetivo, timeout)
+
+
+def paginar_comando(texto):
+    """Interpreta "/history [pagina]" y devuelve el numero de pagina (1 si no se indica)"""
+    _, _, argumento = texto.partition(" ")
+    argumento = argumento.strip()
+    if not argumento:
+        return 1
+    if not argumento.isdigit() or int(argumento) < 1:
+        raise ValueError("Uso: /history [pagina]")
+    return int(argumento)
@@ -0,0 +1,129 @@
+"""Armado de los mensajes que manda el servidor. Es el camino caliente del broadcast: cada
+mensaje grupal se arma, se codifica y se prepara para cada modo de sesion una sola vez, y todos
+los destinatarios reciben el mismo objeto bytes.
+
+- fecha_actual() formatea la fecha con strftime solo una vez por segundo; los demas mensajes
+  del mismo segundo reusan el texto ya armado
+- Mensaje guarda el texto (para el historial) y sus bytes, y prepara a pedido la variante de
+  cada modo (texto plano, tramas, datagrama o sus versiones con registros compactos, ver
+  binario.py) que despues se reusa
+- para(modo, comprimido=True) es la variante comprimida sola (ver compresion.py), tambien armada
+  una vez y compartida por todos los destinatarios que negociaron compresion
+- grupal() y privado() arman los formatos del chat directamente, y tambien su Registro, asi la
+  variante compacta no tiene que volver a separar el texto
+
+Para medir el costo por mensaje: python benchmarks/bench_mensajes.py"""
+import datetime
+import time
+
+import binario
+import compresion
+import protocolo
+import salas
+
+FORMATO_FECHA = binario.FORMATO_FECHA
+
+"""Los clientes UDP reciben cada mensaje en un datagrama, sin el salto de linea final; con
+MODO_DATAGRAMA_BINARIO cada datagrama es un registro compacto"""
+MODO_DATAGRAMA = "datagrama"
+MODO_DATAGRAMA_BINARIO = "datagrama-binario"
+
+"""Modos TCP (protocolo.py) y UDP que reciben registros compactos en lugar de texto"""
+MODOS_BINARIOS = ("binario", MODO_DATAGRAMA_BINARIO)
+
+"""(segundo, fecha formateada) del ultimo mensaje. Se reemplaza la tupla entera, asi un hilo
+nunca ve el segundo de una fecha con el texto de otra"""
+_fecha = (None, "")
+
+
+def _segundo_actual():
+    """(segundo epoch, fecha formateada) del momento actual"""
+    global _fecha
+    segundo = int(time.time())
+    if _fecha[0] != segundo:
+        _fecha = (segundo, datetime.datetime.fromtimestamp(segundo).strftime(FORMATO_FECHA))
+    return _fecha
+
+
+def fecha_actual():
+    """Fecha y hora actual en formato dia/mes/año horas:minutos:segundos AM/PM"""
+    return _segundo_actual()[1]
+
+
+def empaquetar(datos, modo):
+    """Prepara los bytes de un mensaje para el modo de una sesion. Para los modos binarios datos
+    tiene que ser el registro compacto"""
+    if modo == MODO_DATAGRAMA:
+        return datos[:-1] if datos.endswith(b"\n") else datos
+    if modo == MODO_DATAGRAMA_BINARIO:
+        return datos
+    return protocolo.empaquetar(datos, modo)
+
+
+class Mensaje:
+    """Un mensaje listo para enviar. texto termina en "\\n" y es lo que se guarda en el
+    historial; para(modo) devuelve los bytes de ese modo, armados la primera vez que se piden.
+    registro es el binario.Registro del mensaje si ya se conoce; si no se saca del texto la
+    primera vez que lo pide una sesion binaria. id es el del historial si el mensaje se guardo y
+    tiene que estar puesto antes de pedir las variantes"""
+    __slots__ = ("texto", "datos", "variantes", "registro", "id")
+
+    def __init__(self, texto, registro=None, id=0):
+        self.texto = texto
+        self.datos = texto.encode()
+        self.variantes = {"texto": self.datos}
+        self.registro = registro
+        self.id = id
+
+    def compacto(self):
+        """El registro compacto codificado (es tambien la variante de MODO_DATAGRAMA_BINARIO)"""
+        datos = self.variantes.get(MODO_DATAGRAMA_BINARIO)
+        if datos is None:
+            registro = self.registro or binario.desde_texto(self.texto, _segundo_actual()[0])
+            registro.id = self.id
+            datos = self.variantes[MODO_DATAGRAMA_BINARIO] = registro.codificar()
+        return datos
+
+    def para(self, modo, comprimido=False):
+        if comprimido:
+            return self.comprimido(modo)
+        paquete = self.variantes.get(modo)
+        if paquete is None:
+            datos = self.compacto() if modo in MODOS_BINARIOS else self.datos
+            paquete = self.variantes[modo] = empaquetar(datos, modo)
+        return paquete
+
+    def comprimido(self, modo):
+        """para(modo) comprimido solo (compresion.SUELTO): por TCP la trama comprimida va en otra
+        trama, por UDP el datagrama comprimido es el datagrama. Si no conviene es para(modo)"""
+        clave = (modo, compresion.SUELTO)
+        paquete = self.variantes.get(clave)
+        if paquete is None:
+            paquete = self.para(modo)
+            comprimido = compresion.comprimir(paquete) if modo != "texto" else None
+            if comprimido is not None:
+                paquete = comprimido if modo in (MODO_DATAGRAMA, MODO_DATAGRAMA_BINARIO) else protocolo.enmarcar(comprimido)
+            self.variantes[clave] = paquete
+        return paquete
+
+
+def grupal(sala, nombre, texto):
+    """Mensaje de un usuario para una sala; la sala general no lleva etiqueta ni en el texto ni
+    en el registro"""
+    segundo, fecha = _segundo_actual()
+    return Mensaje(f"{salas.etiqueta(sala)}[{nombre}] [Fecha:{fecha}] {texto}\n",
+                   binario.Registro(binario.GRUPAL, segundo, nombre, "" if sala == salas.SALA_GENERAL else sala, texto))
+
+
+def privado(remitente, destino, texto):
+    """Devuelve (mensaje para el destinatario, confirmacion para el remitente), con la misma fecha"""
+    segundo, fecha = _segundo_actual()
+    return (Mensaje(f"[PRIVADO de {remitente}] [Fecha:{fecha}] {texto}\n",
+                    binario.Registro(binario.PRIVADO, segundo, remitente, contenido=texto)),
+            Mensaje(f"[PRIVADO para {destino}] [Fecha:{fecha}] {texto}\n",
+                    binario.Registro(binario.PRIVADO_ENVIADO, segundo, destino, contenido=texto)))
+
+
+def sesion(token):
+    """Token para reanudar la sesion (ver reanudacion.py), solo se manda a las sesiones binarias"""
+    return Mensaje(f"*** Sesion {token} ***\n", binario.Registro(binario.SESION, _segundo_actual()[0], contenido=token))
@@ -0,0 +1,209 @@
+"""Metricas de los servidores del chat, expuestas en formato de texto de Prometheus.
+
+Hay tres tipos:
+- Contador: solo sube (mensajes, bytes, comandos, envios descartados)
+- Histograma: cantidad de observaciones por cubeta, para latencias
+- Medidor: valor que se calcula recien cuando alguien pide las metricas (usuarios activos,
+  mensajes pendientes en las colas), asi no cuesta nada en el camino caliente
+
+Cada metrica tiene su propio lock y actualizarla es una suma en un diccionario. Las etiquetas se
+pasan como una tupla de valores en el orden en que se declararon.
+
+Con CHAT_METRICAS_PUERTO (o --metricas-puerto en servidores.py) se levanta un servidor HTTP
+local en 127.0.0.1 que responde:
+- /metrics: todas las metricas
+- /perfil[?reiniciar=1]: resultado del perfilador por muestreo (ver perfilador.py)
+- /perfil/activar[?intervalo=0.005] y /perfil/desactivar: lo prenden y apagan en caliente
+- lo que se agregue en rutas (por ejemplo /salud, ver supervisor.py)"""
+import bisect
+import http.server
+import os
+import threading
+import urllib.parse
+
+import perfilador
+
+"""0 deja el servidor HTTP apagado (las metricas se cuentan igual)"""
+PUERTO = int(os.environ.get("CHAT_METRICAS_PUERTO", "0"))
+HOST = "127.0.0.1"
+
+"""Cubetas de los histogramas de latencia, en segundos"""
+CUBETAS_LATENCIA = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+registro = []
+
+"""Rutas extra del servidor HTTP: camino -> (funcion que devuelve el texto, Content-Type)"""
+rutas = {}
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    partes = ",".join(f'{n}="{v}"' for n, v in zip(nombres, valores))
+    return "{" + partes + "}"
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.valores = {}
+        self.lock = threading.Lock()
+        registro.append(self)
+
+    def inc(self, valor=1, etiquetas=()):
+        with self.lock:
+            self.valores[etiquetas] = self.valores.get(etiquetas, 0) + valor
+
+    def valor(self, etiquetas=()):
+        return self.valores.get(etiquetas, 0)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self.lock:
+            valores = list(self.valores.items())
+        for etiquetas, valor in sorted(valores):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {valor}")
+        return lineas
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, cubetas=CUBETAS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.cubetas = cubetas
+        self.cuentas = [0] * (len(cubetas) + 1)
+        self.suma = 0.0
+        self.lock = threading.Lock()
+        registro.append(self)
+
+    def observar(self, valor):
+        i = bisect.bisect_left(self.cubetas, valor)
+        with self.lock:
+            self.cuentas[i] += 1
+            self.suma += valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self.lock:
+            cuentas = list(self.cuentas)
+            suma = self.suma
+        acumulado = 0
+        for limite, cuenta in zip(self.cubetas, cuentas):
+            acumulado += cuenta
+            lineas.append(f'{self.nombre}_bucket{{le="{limite}"}} {acumulado}')
+        acumulado += cuentas[-1]
+        lineas.append(f'{self.nombre}_bucket{{le="+Inf"}} {acumulado}')
+        lineas.append(f"{self.nombre}_sum {suma}")
+        lineas.append(f"{self.nombre}_count {acumulado}")
+        return lineas
+
+
+class Medidor:
+    """funcion() devuelve un numero, o un diccionario {tupla de etiquetas: numero}"""
+
+    def __init__(self, nombre, ayuda, funcion, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.etiquetas = etiquetas
+        registro.append(self)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge"]
+        valores = self.funcion()
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for etiquetas, valor in sorted(valores.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {valor}")
+        return lineas
+
+
+def exponer():
+    """Todas las metricas en formato de texto de Prometheus"""
+    lineas = []
+    for metrica in registro:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+"""Metricas comunes a todos los servidores. transporte es "tcp" o "udp" """
+mensajes_recibidos = Contador("chat_mensajes_recibidos_total", "Mensajes recibidos de los clientes", ("transporte",))
+bytes_entrada = Contador("chat_bytes_entrada_total", "Bytes recibidos de los clientes", ("transporte",))
+bytes_salida = Contador("chat_bytes_salida_total", "Bytes enviados a los clientes", ("transporte",))
+comandos = Contador("chat_comandos_total", "Mensajes procesados por tipo de comando", ("comando",))
+descartados = Contador("chat_envios_descartados_total", "Envios que no llegaron al socket", ("motivo",))
+limitados = Contador("chat_mensajes_limitados_total", "Mensajes descartados por superar el ritmo permitido",
+                     ("transporte", "limite"))
+rachas_limitadas = Contador("chat_rachas_limitadas_total",
+                            "Veces que un cliente empezo a superar el ritmo permitido (se le avisa una vez)", ("transporte",))
+errores = Contador("chat_errores_total", "Excepciones inesperadas al atender a un cliente", ("tipo",))
+entrega = Histograma("chat_entrega_segundos",
+                     "Desde que se recibe un mensaje hasta que quedo encolado (o enviado por UDP) a todos sus destinatarios")
+
+
+# --- SERVIDOR HTTP ---
+
+class _Manejador(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        consulta = urllib.parse.parse_qs(url.query)
+        tipo = "text/plain; version=0.0.4; charset=utf-8"
+        if url.path == "/metrics":
+            cuerpo = exponer()
+        elif url.path in rutas:
+            funcion, tipo = rutas[url.path]
+            cuerpo = funcion()
+        elif url.path == "/perfil":
+            cuerpo = perfilador.reporte(reiniciar="reiniciar" in consulta)
+        elif url.path == "/perfil/activar":
+            try:
+                intervalo = float(consulta.get("intervalo", [perfilador.INTERVALO])[0])
+                perfilador.activar(intervalo)
+            except ValueError:
+                self.send_error(400, "intervalo tiene que ser un numero de segundos mayor a 0")
+                return
+            cuerpo = f"perfilador activo (cada {intervalo}s)\n"
+        elif url.path == "/perfil/desactivar":
+            perfilador.desactivar()
+            cuerpo = "perfilador detenido\n"
+        else:
+            self.send_error(404)
+            return
+        datos = cuerpo.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+_servidor = None
+_pid = None
+_lock = threading.Lock()
+
+
+def servir(puerto=None):
+    """Levanta el servidor HTTP de metricas en un hilo, una sola vez por proceso (servidores.py
+    corre TCP y UDP juntos y los dos lo piden). No hace nada si el puerto es 0"""
+    global _servidor, _pid
+    puerto = PUERTO if puerto is None else puerto
+    if not puerto:
+        return
+    with _lock:
+        """un worker creado con fork hereda _servidor del proceso principal pero no su hilo"""
+        if _servidor is not None and _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        try:
+            _servidor = http.server.ThreadingHTTPServer((HOST, puerto), _Manejador)
+        except OSError as e:
+            print(f"[METRICAS] No se pudo abrir el puerto {puerto}: {e}")
+            return
+        _servidor.daemon_threads = True
+    threading.Thread(target=_servidor.serve_forever, daemon=True).start()
+    print(f"[METRICAS] http://{HOST}:{puerto}/metrics")
@@ -0,0 +1,507 @@
+"""Nucleo del chat, comun a todos los transportes. Tiene el unico registro de usuarios (ver
+padron.py), las salas, el historial y el ruteo de mensajes; server_tcp, server_tcp_async y
+server_udp solo se ocupan de leer del socket, negociar el formato y entregarle a este modulo los
+mensajes de texto.
+
+Como servidores.py corre TCP y UDP en el mismo proceso, los dos comparten este registro: un
+usuario UDP puede mandarle un /priv a uno TCP, las salas mezclan usuarios de los dos protocolos
+y los avisos de entrada y salida llegan a todos.
+
+Una sesion es cualquier objeto con:
+- modo: "texto", "tramas" o "binario" (TCP, ver protocolo.py) o MODO_DATAGRAMA o
+  MODO_DATAGRAMA_BINARIO (UDP); en los modos binarios recibe registros compactos (binario.py)
+- encolar(datos): recibe los bytes ya preparados para su modo y no se bloquea esperando la red
+- profundidad(): mensajes que tiene pendientes de enviar (para /colas)
+ColaEnvio y ColaEnvioAsync ya cumplen con eso; server_udp tiene su SesionUDP.
+
+Los mensajes se arman con mensajes.py: se codifican una vez y se preparan una vez por modo (con
+tramas, sin el "\\n" para UDP o como registro compacto); todos los destinatarios del mismo modo
+comparten los mismos bytes. Una sesion puede tener ademas encolar_lote(datos, sesiones) para
+recibir de una vez a todos los destinatarios de su tipo (SesionUDP lo usa para encolar un solo
+envio por broadcast). Si tiene cortar(), el nucleo la usa para cerrar la conexion vieja de un
+usuario que retomo su sesion desde otra (ver reanudacion.py).
+
+Si tiene comprimir en True el cliente negocio compresion (ver compresion.py): los broadcast le
+llegan comprimidos una vez para todos los que comparten su modo, y lo que es solo para esa sesion
+va a encolar_flujo(paquetes) si lo tiene (TCP, con el contexto de compresion de la conexion) o
+comprimido solo (UDP)."""
+import collections
+import os
+import threading
+import time
+
+import admision
+import archivos
+import buzon
+import historial
+import mensajes
+import metricas
+import padron
+import reanudacion
+import salas
+from mensajes import Mensaje
+
+MODO_DATAGRAMA = mensajes.MODO_DATAGRAMA
+MODO_DATAGRAMA_BINARIO = mensajes.MODO_DATAGRAMA_BINARIO
+
+"""Registro unico: nombre de usuario -> sesion (ver padron.py), con su propio manejo de locks.
+lock protege lo demas que cambia al entrar y salir (cerrando y salas_previas)"""
+usuarios = padron.Padron()
+lock = threading.Lock()
+
+"""Limite de usuarios registrados entre todos los transportes (las conexiones TCP y el ritmo de
+registros UDP los sigue controlando cada servidor). iniciar() lo vuelve a crear con la
+configuracion final"""
+control = admision.ControlAdmision()
+
+"""Membresia de salas, los miembros son las sesiones"""
+indice_salas = salas.IndiceSalas()
+
+"""Historial de mensajes (ver historial.py), buzon de privados para usuarios desconectados (ver
+buzon.py) y archivos subidos por el canal de archivos (ver archivos.py), los crea iniciar()"""
+historia = None
+buzones = None
+almacen = None
+
+"""Tokens para reanudar sesiones (ver reanudacion.py), lo crea iniciar(). salas_previas guarda las
+salas de los usuarios que se fueron estando en alguna ademas de la general, para devolverlos a
+ellas si se reconectan: nombre -> (vencimiento, salas, sala activa), en orden de salida"""
+reanudaciones = None
+salas_previas = collections.OrderedDict()
+
+"""Se esta cerrando el servidor (ver supervisor.py): ya no se registran usuarios nuevos"""
+cerrando = False
+AVISO_CIERRE = "*** El servidor se esta cerrando ***\n"
+
+AVISO_LIMITE = "Estas mandando mensajes demasiado rapido, se descartan hasta que bajes el ritmo"
+
+"""Bus entre procesos cuando el servidor TCP corre con varios workers (ver
+servidor_multiproceso.py), queda en None cuando hay un solo proceso"""
+bus = None
+
+
+def _usuarios_por_modo():
+    cuentas = {}
+    for sesion in usuarios.sesiones():
+        cuentas[(sesion.modo,)] = cuentas.get((sesion.modo,), 0) + 1
+    return cuentas
+
+
+def _colas_pendientes():
+    profundidades = profundidades_colas().values()
+    return {("total",): sum(profundidades), ("maximo",): max(profundidades, default=0)}
+
+
+metricas.Medidor("chat_usuarios_activos", "Usuarios registrados en este proceso por modo de sesion",
+                 _usuarios_por_modo, ("modo",))
+metricas.Medidor("chat_colas_pendientes", "Mensajes esperando en las colas de envio (suma y la mas larga)",
+                 _colas_pendientes, ("medida",))
+
+
+def iniciar(subdirectorio):
+    """Crea el control de admision y el historial la primera vez que arranca un servidor del
+    proceso; si TCP y UDP corren juntos el segundo reusa lo que creo el primero"""
+    global control, historia, buzones, almacen, reanudaciones, cerrando
+    with lock:
+        cerrando = False
+        if historia is None:
+            control = admision.ControlAdmision()
+            historia = historial.Historial(os.path.join(historial.DIRECTORIO, subdirectorio))
+            buzones = buzon.Buzon()
+            almacen = archivos.Almacen()
+            reanudaciones = reanudacion.Reanudacion(historia.directorio)
+
+
+def error(texto):
+    return f"[ERROR] {texto}\n"
+
+
+def armar(mensaje):
+    """Acepta el texto de un mensaje o un Mensaje ya armado"""
+    return mensaje if isinstance(mensaje, Mensaje) else Mensaje(mensaje)
+
+
+def difundir(destinos, mensaje):
+    """Encola un mensaje en cada sesion de destinos. Los bytes se preparan una vez por modo (y
+    compresion) y todos los destinatarios del mismo modo comparten el mismo objeto"""
+    mensaje = armar(mensaje)
+    grupos = {}
+    for sesion in destinos:
+        clave = (sesion.modo, getattr(sesion, "comprimir", False))
+        grupo = grupos.get(clave)
+        if grupo is None:
+            grupo = grupos[clave] = []
+        grupo.append(sesion)
+    for (modo, comprimir), sesiones in grupos.items():
+        paquete = mensaje.para(modo, comprimir)
+        lote = getattr(sesiones[0], "encolar_lote", None)
+        if lote is not None:
+            lote(paquete, sesiones)
+            continue
+        for sesion in sesiones:
+            sesion.encolar(paquete)
+
+
+def _flujo(sesion):
+    """encolar_flujo de la sesion si negocio compresion y lo tiene, si no None"""
+    return getattr(sesion, "encolar_flujo", None) if getattr(sesion, "comprimir", False) else None
+
+
+def enviar(sesion, mensaje):
+    """Mensaje suelto para una sola sesion"""
+    flujo = _flujo(sesion)
+    if flujo is not None:
+        flujo([armar(mensaje).para(sesion.modo)])
+        return
+    sesion.encolar(armar(mensaje).para(sesion.modo, getattr(sesion, "comprimir", False)))
+
+
+def enviar_lote(sesion, textos):
+    """Varios mensajes para una sola sesion con un solo encolar (por TCP salen en un solo
+    sendall, y con compresion se comprimen juntos). Los datagramas no se pueden juntar y van de a
+    uno"""
+    flujo = _flujo(sesion)
+    if flujo is not None:
+        if textos:
+            flujo([armar(texto).para(sesion.modo) for texto in textos])
+        return
+    comprimir = getattr(sesion, "comprimir", False)
+    paquetes = [armar(texto).para(sesion.modo, comprimir) for texto in textos]
+    if not paquetes:
+        return
+    if sesion.modo in (MODO_DATAGRAMA, MODO_DATAGRAMA_BINARIO):
+        for paquete in paquetes:
+            sesion.encolar(paquete)
+        return
+    sesion.encolar(b"".join(paquetes))
+
+
+def broadcast(mensaje, remitente=None, propagar=True):
+    """Envia un mensaje a todos los usuarios excepto al remitente (por nombre). Los destinatarios
+    salen de la foto del padron, que se comparte entre broadcast mientras nadie entre ni salga.
+    Con varios workers tambien se publica en el bus para los usuarios de los demas procesos"""
+    mensaje = armar(mensaje)
+    destinos = usuarios.sesiones()
+    excluida = usuarios.sesion(remitente) if remitente is not None else None
+    if excluida is not None:
+        destinos = [sesion for sesion in destinos if sesion is not excluida]
+    difundir(destinos, mensaje)
+    if propagar and bus is not None:
+        bus.publicar(("broadcast", mensaje.texto, remitente))
+
+
+def enviar_a_sala(sala, mensaje, remitente=None, propagar=True, guardar=False):
+    """Como broadcast pero solo para los miembros de una sala. remitente es la sesion a excluir.
+    Con guardar=True el mensaje queda en el historial de la sala (con su autor si se conoce, para
+    no repetirselo cuando se reconecta)"""
+    mensaje = armar(mensaje)
+    if guardar and historia is not None:
+        autor = mensaje.registro.remitente if mensaje.registro is not None else None
+        mensaje.id = historia.guardar(mensaje.texto, sala=sala, de=autor)
+    difundir([sesion for sesion in indice_salas.miembros(sala) if sesion is not remitente], mensaje)
+    if propagar and bus is not None:
+        bus.publicar(("sala", sala, mensaje.texto, guardar))
+
+
+def enviar_privado(sesion_destino, destino, mensaje):
+    """Envia un privado a una sesion local y lo guarda en el historial del destinatario"""
+    mensaje = armar(mensaje)
+    if historia is not None:
+        mensaje.id = historia.guardar(mensaje.texto, para=destino)
+    enviar(sesion_destino, mensaje)
+
+
+def enviar_historial(sesion, sala, numero):
+    """Responde a /history con una pagina del historial de la sala"""
+    mensajes = historia.pagina(sala, numero) if historia is not None else []
+    if not mensajes:
+        enviar(sesion, f"*** No hay mas mensajes en el historial de {sala} ***\n")
+        return
+    enviar(sesion, f"*** Historial de {sala} (pagina {numero}) ***\n")
+    for texto in mensajes:
+        enviar(sesion, texto)
+
+
+def recibir_evento(evento):
+    """Entrega a los usuarios de este proceso un evento que publico otro worker en el bus"""
+    tipo = evento[0]
+    if tipo == "broadcast":
+        broadcast(evento[1], evento[2], propagar=False)
+    elif tipo == "sala":
+        enviar_a_sala(evento[1], evento[2], propagar=False, guardar=evento[3])
+    elif tipo == "priv":
+        sesion_destino = usuarios.sesion(evento[1])
+        if sesion_destino is not None:
+            enviar_privado(sesion_destino, evento[1], evento[2])
+
+
+def profundidades_colas():
+    """Devuelve {nombre: mensajes pendientes} para detectar consumidores lentos"""
+    return {nombre: sesion.profundidad() for nombre, sesion in usuarios.foto()}
+
+
+def registrar(nombre, sesion, reanudar=None, direccion=None):
+    """Registra una sesion con su nombre, la une a la sala general, le repite el historial y
+    avisa a todos. reanudar es (token, ultimo id visto) si el cliente pide retomar su sesion (ver
+    reanudacion.py): con un token valido reemplaza a su sesion vieja si sigue registrada, vuelve a
+    sus salas y solo recibe lo que se perdio. direccion es la del cliente si el transporte lo
+    busca por ella (ver padron.Padron.en). Devuelve None si quedo registrada o el texto del error
+    para mandarle.
+    Que el nombre no se repita en este proceso se decide en el padron; el limite de usuarios se
+    revisa antes, sin lock, asi que dos registros al mismo tiempo pueden pasarlo por uno"""
+    reanuda = reanudar is not None and reanudaciones is not None and reanudaciones.valido(nombre, reanudar[0])
+    if cerrando:
+        return error("El servidor se esta cerrando")
+    if not (reanuda and nombre in usuarios):
+        remotos = bus.cantidad_remotos() if bus is not None else 0
+        if control.lleno(len(usuarios) + remotos):
+            return error(control.mensaje_lleno())
+        if bus is not None and bus.ubicar(nombre) is not None:
+            return error("Usuario ya existe")
+    try:
+        vieja = usuarios.agregar(nombre, sesion, direccion, reemplazar=reanuda)
+    except padron.NombreOcupado:
+        return error("Usuario ya existe")
+    """si el cierre empezo mientras tanto, el aviso pudo salir sin esta sesion"""
+    if cerrando and vieja is None:
+        usuarios.quitar(nombre, sesion)
+        return error("El servidor se esta cerrando")
+    with lock:
+        previas = salas_previas.pop(nombre, None)
+
+    """el servidor todavia no habia notado que la conexion vieja se cayo: se la saca de las
+    salas (su transporte la va a dar de baja sin avisar la salida) y se la corta"""
+    if vieja is not None:
+        activa = indice_salas.sala_activa(vieja)
+        previas = (None, indice_salas.quitar(vieja), activa)
+        cortar = getattr(vieja, "cortar", None)
+        if cortar is not None:
+            cortar()
+    elif bus is not None:
+        bus.anunciar_entrada(nombre)
+
+    unidas, activa = previas[1:] if reanuda and previas is not None else ({salas.SALA_GENERAL}, salas.SALA_GENERAL)
+    for sala in unidas:
+        indice_salas.unir(sesion, sala)
+    indice_salas.unir(sesion, activa)
+
+    """las sesiones binarias reciben el token antes que nada, por si se vuelven a caer"""
+    if reanudaciones is not None and sesion.modo in mensajes.MODOS_BINARIOS:
+        enviar(sesion, mensajes.sesion(reanudaciones.token(nombre)))
+
+    """antes del aviso de entrada se le repiten los ultimos mensajes de la sala general, o si se
+    reconecta lo que vino despues del ultimo que vio, todo en un solo envio. Sus privados solo se
+    repiten si retoma la sesion con su token: cualquiera puede entrar con un nombre libre"""
+    if historia is not None:
+        aviso = []
+        if reanuda and reanudar[1]:
+            registros, completo = historia.desde(reanudar[1], nombre, unidas)
+            if not completo:
+                aviso = ["*** Puede que falten mensajes de cuando no estabas, usa /history ***\n"]
+        else:
+            registros = historia.al_entrar(salas.SALA_GENERAL, nombre if reanuda else None)
+        enviar_lote(sesion, aviso + [Mensaje(r["texto"], id=r["id"]) for r in registros])
+    if vieja is None:
+        broadcast(f"*** {nombre} {'volvio' if reanuda else 'se unio'} al chat ***\n")
+
+    """los privados que le dejaron mientras no estaba los lee y se los manda el hilo del buzon,
+    el registro no espera al disco"""
+    if buzones is not None:
+        buzones.conocer(nombre)
+        buzones.entregar(nombre, lambda textos: entregar_buzon(sesion, nombre, textos))
+    return None
+
+
+def entregar_buzon(sesion, nombre, textos):
+    """Manda de una vez los privados guardados en el buzon. False si el usuario ya se fue, asi
+    los mensajes vuelven al buzon"""
+    if usuarios.sesion(nombre) is not sesion:
+        return False
+    enviar_lote(sesion, [f"*** Tienes {len(textos)} mensajes privados que llegaron mientras no estabas ***\n"] + textos)
+    return True
+
+
+def avisar_cierre():
+    """Primer paso del cierre ordenado: no se aceptan mas registros y se avisa a todos los
+    usuarios de este proceso. Si TCP y UDP se cierran juntos el aviso sale una sola vez"""
+    global cerrando
+    with lock:
+        if cerrando:
+            return
+        cerrando = True
+    broadcast(AVISO_CIERRE, propagar=False)
+
+
+def limitar(sesion, limite, transporte):
+    """Aplica el limite de ritmo (ver admision.LimiteMensajes) a un mensaje recien recibido, antes
+    de decodificarlo. Devuelve True si hay que descartarlo; al primero de cada racha se le avisa
+    al cliente y los demas se descartan sin responder, asi el aviso no multiplica el trafico"""
+    motivo = limite.tomar()
+    if motivo is None:
+        return False
+    metricas.limitados.inc(1, (transporte, motivo))
+    if not limite.limitado:
+        limite.limitado = True
+        metricas.rachas_limitadas.inc(1, (transporte,))
+        enviar(sesion, error(AVISO_LIMITE))
+    return True
+
+
+def salir(sesion, nombre):
+    """Quita una sesion registrada y avisa a todos. Solo se borra la entrada propia, asi un
+    nombre repetido que fue rechazado no saca del chat al usuario original"""
+    if not usuarios.quitar(nombre, sesion):
+        return False
+    activa = indice_salas.sala_activa(sesion)
+    recordar_salas(nombre, indice_salas.quitar(sesion), activa)
+    if bus is not None:
+        bus.anunciar_salida(nombre)
+    broadcast(f"*** {nombre} salio del chat ***\n")
+    return True
+
+
+def recordar_salas(nombre, unidas, activa):
+    """Guarda las salas de un usuario que se fue, por si se reconecta con su token. Si solo
+    estaba en la general no hace falta; de paso se borran las que vencieron"""
+    ahora = time.monotonic()
+    with lock:
+        salas_previas.pop(nombre, None)
+        if unidas - {salas.SALA_GENERAL}:
+            salas_previas[nombre] = (ahora + reanudacion.DURACION, unidas, activa)
+        while salas_previas and next(iter(salas_previas.values()))[0] < ahora:
+            salas_previas.popitem(last=False)
+
+
+def existe(nombre):
+    """True si se le puede mandar un privado: esta en este proceso (con cualquier transporte), en
+    otro worker o, aunque este desconectado, ya estuvo en el chat (le queda el buzon)"""
+    if nombre in usuarios:
+        return True
+    if bus is not None and bus.ubicar(nombre) is not None:
+        return True
+    return buzones is not None and buzones.conocido(nombre)
+
+
+def privado(sesion, nombre, destino, contenido):
+    """Manda un privado de nombre a destino: a su sesion, a su worker o a su buzon si esta
+    desconectado. sesion es la del remitente, que recibe la confirmacion o el error (None si no
+    esta conectado a este proceso)"""
+    sesion_destino = usuarios.sesion(destino)
+    worker = bus.ubicar(destino) if sesion_destino is None and bus is not None else None
+    if sesion_destino is None and worker is None:
+        if buzones is None or not buzones.conocido(destino):
+            if sesion is not None:
+                enviar(sesion, error(f"Usuario '{destino}' no existe"))
+            return
+        """alguien que ya estuvo en el chat: el privado queda en su buzon hasta que vuelva"""
+        mensaje, confirmacion = mensajes.privado(nombre, destino, contenido)
+        try:
+            buzones.guardar(destino, mensaje.texto)
+        except buzon.BuzonLleno as e:
+            if sesion is not None:
+                enviar(sesion, error(e))
+            return
+        if sesion is not None:
+            enviar_privado(sesion, nombre, confirmacion)
+            enviar(sesion, f"*** {destino} no esta conectado, se le entregara cuando vuelva ***\n")
+        return
+    mensaje, confirmacion = mensajes.privado(nombre, destino, contenido)
+    if sesion_destino is not None:
+        enviar_privado(sesion_destino, destino, mensaje)
+    else:
+        bus.publicar(("priv", destino, mensaje.texto), worker)
+    if sesion is not None:
+        enviar_privado(sesion, nombre, confirmacion)
+
+
+def validar_subida(pedido):
+    """Revisa un pedido de subir un archivo (ver archivos.py) antes de recibir un solo byte: quien
+    sube prueba su nombre con su token y el destinatario tiene que poder recibir un privado.
+    Devuelve (nombre, destino, nombre del archivo, tamano) o lanza archivos.ErrorTransferencia"""
+    nombre, destino, tamano = str(pedido.get("nombre", "")), str(pedido.get("destino", "")), pedido.get("tamano")
+    archivo = os.path.basename(str(pedido.get("archivo", ""))).replace("\n", " ").strip()[:255]
+    if reanudaciones is None or not reanudaciones.valido(nombre, str(pedido.get("token", ""))):
+        raise archivos.ErrorTransferencia("Sesion invalida, vuelve a conectarte")
+    if not isinstance(tamano, int) or tamano < 0 or not archivo:
+        raise archivos.ErrorTransferencia("Pedido invalido")
+    if tamano > archivos.TAMANO_MAXIMO:
+        raise archivos.ErrorTransferencia(f"El archivo supera el maximo de {archivos.TAMANO_MAXIMO} bytes")
+    if not existe(destino):
+        raise archivos.ErrorTransferencia(f"Usuario '{destino}' no existe")
+    return nombre, destino, archivo, tamano
+
+
+def avisar_archivo(nombre, destino, id_archivo, tamano, archivo):
+    """Un archivo termino de subir: el destinatario recibe el aviso como un privado de quien lo
+    mando (asi pasa por el historial, el buzon y el bus como cualquier otro)"""
+    privado(usuarios.sesion(nombre), nombre, destino, archivos.aviso(id_archivo, tamano, archivo))
+
+
+def procesar(sesion, nombre, msg, recibido=None):
+    """Procesa un mensaje de texto de un usuario registrado y mide cuanto tardo desde que se
+    recibio (recibido es un time.perf_counter() del transporte; sin el se mide desde aca)"""
+    recibido = recibido or time.perf_counter()
+    metricas.comandos.inc(1, (_comando(msg),))
+    _procesar(sesion, nombre, msg)
+    metricas.entrega.observar(time.perf_counter() - recibido)
+
+
+def _comando(msg):
+    """Etiqueta del mensaje para chat_comandos_total (solo comandos conocidos, para no crear
+    una etiqueta por cada texto que empiece con /)"""
+    if not msg.startswith("/"):
+        return "grupal"
+    comando = msg.split(" ", 1)[0][1:]
+    return comando if comando in COMANDOS else "grupal"
+
+
+COMANDOS = ("priv", "colas", "join", "leave", "rooms", "history")
+
+
+def _procesar(sesion, nombre, msg):
+    """Procesa un mensaje de texto de un usuario registrado: /priv, /colas, comandos de salas,
+    /history o mensaje grupal para su sala activa"""
+    """para mensajes privados se separa el destinatario y el contenido; el destinatario puede
+    estar en este proceso (con cualquier transporte) o en otro worker"""
+    if msg.split(" ", 1)[0] == "/priv":
+        _, destino, contenido = (msg.split(None, 2) + ["", ""])[:3]
+        if not destino:
+            enviar(sesion, error("Uso: /priv usuario mensaje"))
+            return
+        privado(sesion, nombre, destino, contenido)
+        return
+
+    if msg == "/colas":
+        """muestra cuantos mensajes tiene pendientes cada usuario, para ver quien lee lento"""
+        pendientes = ", ".join(f"{n}={p}" for n, p in profundidades_colas().items())
+        enviar(sesion, f"[COLAS] {pendientes}\n")
+        return
+
+    if salas.es_comando(msg):
+        """/join, /leave y /rooms: se responde al usuario y se avisa a la sala afectada"""
+        try:
+            respuesta, avisos = salas.ejecutar(indice_salas, sesion, nombre, msg)
+        except salas.ErrorSala as e:
+            enviar(sesion, error(e))
+            return
+        enviar(sesion, respuesta)
+        for sala, aviso in avisos:
+            """al entrar a una sala nueva se le repiten sus ultimos mensajes"""
+            if msg.startswith("/join") and historia is not None:
+                for texto in historia.recientes(sala):
+                    enviar(sesion, texto)
+            enviar_a_sala(sala, aviso, remitente=sesion)
+        return
+
+    if msg.split(" ", 1)[0] == "/history":
+        try:
+            numero = historial.paginar_comando(msg)
+        except ValueError as e:
+            enviar(sesion, error(e))
+            return
+        enviar_historial(sesion, indice_salas.sala_activa(sesion), numero)
+        return
+
+    """mensaje grupal para los miembros de la sala activa"""
+    sala = indice_salas.sala_activa(sesion)
+    enviar_a_sala(sala, mensajes.grupal(sala, nombre, msg), remitente=sesion, guardar=True)
@@ -0,0 +1,185 @@
+"""Padron de los usuarios conectados: nombre -> sesion, armado para que ni los broadcast ni las
+busquedas esperen a las altas y bajas. El nucleo tiene uno solo para todos los transportes (ver
+nucleo.py).
+
+- Busquedas sin lock: sesion(nombre), nombre in padron y en(direccion) son un get sobre un
+  diccionario, que en CPython es atomico
+- Altas y bajas sin lock, por franja: el nombre elige una de FRANJAS franjas por su hash, cada
+  una con su diccionario. Con el GIL un hilo que espera un lock lo suelta y despues tarda en
+  volver a tenerlo si los demas no lo sueltan (las busquedas y los broadcast nunca esperan), asi
+  que con locks las altas y bajas quedaban casi paradas mientras habia broadcast. Por eso solo
+  usan operaciones atomicas de CPython: el alta es un setdefault(), que decide solo quien se
+  queda con el nombre, y cada entrada trae un lock que nadie espera, con el que la baja (o el
+  reemplazo) se la adjudica con acquire(blocking=False). Quien se la adjudico es el unico que la
+  puede borrar o pisar, asi una baja nunca se lleva a la sesion que reemplazo a la suya
+- Foto para los broadcast (copy-on-write por franja): cada franja guarda su propia tupla
+  inmutable y un numero de version que cambia con cada alta o baja, asi entrar o salir es O(1) y
+  solo toca su franja. sesiones() y foto() juntan las tuplas de las franjas y la comparten todos
+  los broadcast hasta que cambia alguna version; recien ahi el proximo que la pide rearma solo
+  las franjas que cambiaron y vuelve a juntarlas, que es concatenar tuplas. Con mucha rotacion
+  se rearma a lo sumo una foto por broadcast
+- Indice inverso direccion -> nombre, para los transportes que identifican a sus clientes por
+  la direccion de donde mandan (server_udp). Se mantiene junto con el nombre, con el lock de la
+  franja de la direccion (solo lo usa quien tiene direccion), y en() confirma
+  que la sesion de ese nombre siga siendo la de esa direccion, asi nunca devuelve una sesion que
+  ya se fue o que reemplazo otra
+
+Para ver como se porta con altas, bajas y broadcast al mismo tiempo:
+python benchmarks/stress_padron.py"""
+import itertools
+import operator
+import threading
+import time
+
+FRANJAS = 16
+
+
+class NombreOcupado(Exception):
+    """Ya hay una sesion con ese nombre"""
+
+
+_sesion = operator.itemgetter(0)
+
+
+class Franja:
+    __slots__ = ("lock", "nombres", "direcciones", "cambios", "version", "foto")
+
+    def __init__(self):
+        """solo para el indice inverso, los nombres no lo usan"""
+        self.lock = threading.Lock()
+        """nombre -> (sesion, direccion, lock de la baja)"""
+        self.nombres = {}
+        """direccion -> nombre (de las direcciones que caen en esta franja)"""
+        self.direcciones = {}
+        """cada alta o baja de un nombre de esta franja toma un numero nuevo despues de tocar el
+        diccionario (next() de itertools.count es atomico) y lo deja en version. Dos cambios
+        pueden dejarlo fuera de orden, pero ningun numero se repite: una foto guardada con la
+        version que se leyo antes de copiar ya no coincide apenas cambia algo despues"""
+        self.cambios = itertools.count(1)
+        self.version = 0
+        """(version, ((nombre, sesion), ...), (sesion, ...)) de cuando se armo"""
+        self.foto = (0, (), ())
+
+    def vigente(self):
+        """La foto de esta franja al dia. La version se lee antes de copiar el diccionario (copy()
+        es una sola operacion atomica), asi que si algo cambia en el medio la foto queda guardada
+        con una version vieja y la proxima vez se vuelve a armar"""
+        foto = self.foto
+        version = self.version
+        if foto[0] == version:
+            return foto
+        nombres = self.nombres.copy()
+        sesiones = tuple(map(_sesion, nombres.values()))
+        foto = self.foto = (version, tuple(zip(nombres, sesiones)), sesiones)
+        return foto
+
+
+class Padron:
+    def __init__(self, franjas=FRANJAS):
+        self.franjas = tuple(Franja() for _ in range(franjas))
+        """como la version de las franjas pero de todo el padron, para que un broadcast vea con
+        una sola comparacion que no hubo cambios"""
+        self.cambios = itertools.count(1)
+        self.version = 0
+        """(version, pares, sesiones) de la ultima vez que se juntaron las fotos de las franjas"""
+        self._foto = (0, (), ())
+
+    def _franja(self, clave):
+        return self.franjas[hash(clave) % len(self.franjas)]
+
+    def sesion(self, nombre):
+        entrada = self._franja(nombre).nombres.get(nombre)
+        return entrada[0] if entrada is not None else None
+
+    def __contains__(self, nombre):
+        return nombre in self._franja(nombre).nombres
+
+    def __len__(self):
+        return sum(len(franja.nombres) for franja in self.franjas)
+
+    def en(self, direccion):
+        """Sesion registrada desde direccion, o None"""
+        nombre = self._franja(direccion).direcciones.get(direccion)
+        if nombre is None:
+            return None
+        entrada = self._franja(nombre).nombres.get(nombre)
+        return entrada[0] if entrada is not None and entrada[1] == direccion else None
+
+    def direcciones(self):
+        """Todas las direcciones del indice inverso (una copia)"""
+        todas = []
+        for franja in self.franjas:
+            with franja.lock:
+                todas.extend(franja.direcciones)
+        return todas
+
+    def agregar(self, nombre, sesion, direccion=None, reemplazar=False):
+        """Registra la sesion con su nombre (y su direccion, si el transporte la usa). Si el
+        nombre ya esta lanza NombreOcupado, salvo con reemplazar=True: ahi la sesion nueva toma su
+        lugar y se devuelve la vieja. Devuelve None si el nombre estaba libre"""
+        franja = self._franja(nombre)
+        entrada = (sesion, direccion, threading.Lock())
+        while True:
+            vieja = franja.nombres.setdefault(nombre, entrada)
+            if vieja is entrada:
+                vieja = None
+                break
+            if not reemplazar:
+                raise NombreOcupado(nombre)
+            if vieja[2].acquire(blocking=False):
+                franja.nombres[nombre] = entrada
+                break
+            """otro la esta sacando o reemplazando en este momento, se prueba de nuevo cuando termine"""
+            time.sleep(0)
+        franja.version = next(franja.cambios)
+        self.version = next(self.cambios)
+        if vieja is not None and vieja[1] is not None and vieja[1] != direccion:
+            self._olvidar_direccion(vieja[1], nombre)
+        if direccion is not None:
+            franja = self._franja(direccion)
+            with franja.lock:
+                franja.direcciones[direccion] = nombre
+        return vieja[0] if vieja is not None else None
+
+    def quitar(self, nombre, sesion):
+        """Saca el nombre solo si sigue registrado con esta sesion (no con una que la reemplazo).
+        Devuelve True si lo saco"""
+        franja = self._franja(nombre)
+        entrada = franja.nombres.get(nombre)
+        if entrada is None or entrada[0] is not sesion or not entrada[2].acquire(blocking=False):
+            return False
+        del franja.nombres[nombre]
+        franja.version = next(franja.cambios)
+        self.version = next(self.cambios)
+        if entrada[1] is not None:
+            self._olvidar_direccion(entrada[1], nombre)
+        return True
+
+    def _olvidar_direccion(self, direccion, nombre):
+        franja = self._franja(direccion)
+        with franja.lock:
+            if franja.direcciones.get(direccion) == nombre:
+                del franja.direcciones[direccion]
+
+    def _vigente(self):
+        """(version, ((nombre, sesion), ...), (sesion, ...)) al dia. Si no hubo cambios devuelve la
+        misma tupla de antes; si no, junta las fotos de las franjas (que solo se rearman si
+        cambiaron). Como en Franja.vigente, la version se lee antes de juntarlas. Dos broadcast
+        pueden juntarlas a la vez, las dos quedan bien"""
+        foto = self._foto
+        version = self.version
+        if foto[0] == version:
+            return foto
+        fotos = [franja.vigente() for franja in self.franjas]
+        foto = self._foto = (version,
+                             tuple(itertools.chain.from_iterable(f[1] for f in fotos)),
+                             tuple(itertools.chain.from_iterable(f[2] for f in fotos)))
+        return foto
+
+    def foto(self):
+        """Tupla de (nombre, sesion) de todos los registrados; no cambia aunque entre o salga alguien"""
+        return self._vigente()[1]
+
+    def sesiones(self):
+        """Tupla con todas las sesiones, la que usan los broadcast"""
+        return self._vigente()[2]
@@ -0,0 +1,448 @@
+"""Pasarela: una sola conexion TCP que lleva el trafico de muchos usuarios de la GUI. Sin ella
+cada pestana del navegador abre su propio ClienteTCP con su hilo de escucha, asi que N usuarios
+de Streamlit son N sockets de loopback y N hilos en el proceso de la GUI.
+
+La pasarela se conecta al servidor TCP como cualquier cliente pero en vez del nombre manda
+MAGIA. Desde ahi todo viaja en tramas (protocolo.enmarcar) con una cabecera propia:
+
+    [sesion: u32][tipo: u8][contenido]
+
+- ABRIR (GUI -> servidor): contenido es lo primero que mandaria un cliente comun en una sesion
+  nueva: el nombre (o el pedido de reanudar), solo en texto o con binario.MAGIA y en una trama
+- DATOS: un mensaje de o para esa sesion
+- CERRAR: la sesion termino (en cualquiera de los dos sentidos)
+
+Del lado del servidor cada sesion es una ConexionVirtual que se comporta como un socket, asi
+server_tcp.manejarCliente la atiende igual que a una conexion real (negociacion del modo,
+registro, salas, historial, colas de envio). Del lado de la GUI, Pasarela tiene un unico hilo
+lector que entrega cada mensaje directo a la sesion que corresponde, sin un hilo por usuario. Las
+sesiones de la GUI piden registros compactos, asi reciben el token para reconectarse y retomar la
+sesion (ver reanudacion.py) y para mandar archivos."""
+import queue
+import socket
+import struct
+import threading
+
+import archivos
+import binario
+import protocolo
+import reanudacion
+
+MAGIA = b"\x00TRMX"
+CABECERA = struct.Struct("!IB")
+ABRIR = 1
+DATOS = 2
+CERRAR = 3
+
+"""Cola de salida de la conexion compartida en el servidor: lleva los mensajes de todos los
+usuarios de la pasarela, por eso es bastante mas grande que la de un cliente comun"""
+TAMANO_COLA = 16384
+
+
+def trama(sesion, tipo, datos=b""):
+    return protocolo.enmarcar(CABECERA.pack(sesion, tipo) + datos)
+
+
+# --- LADO DEL SERVIDOR ---
+
+class ConexionVirtual:
+    """Lo que manejarCliente y ColaEnvio usan de un socket (recv, recv_into, sendall, shutdown,
+    close) sobre una sesion de la pasarela. Cada sendall (un mensaje en texto, una o varias tramas en los
+    otros modos) se manda como una trama DATOS por la conexion compartida"""
+
+    def __init__(self, pasarela, sesion, nombre):
+        self.pasarela = pasarela
+        self.sesion = sesion
+        self.entrada = queue.SimpleQueue()
+        self.resto = b""
+        self.cerrada = False
+        """lo primero que lee manejarCliente es lo que mando la GUI en ABRIR, de ahi negocia el modo"""
+        self.entrada.put(nombre)
+
+    def alimentar(self, datos):
+        self.entrada.put(datos)
+
+    def recv(self, tamano):
+        """Bloquea hasta que llegue un mensaje de la sesion; b"" si la sesion se cerro"""
+        if not self.resto:
+            self.resto = self.entrada.get()
+            if not self.resto:
+                self.entrada.put(b"")
+                return b""
+        datos, self.resto = self.resto[:tamano], self.resto[tamano:]
+        return datos
+
+    def recv_into(self, buffer):
+        """Lo usa protocolo.LectorTramas en las sesiones que hablan en tramas"""
+        datos = self.recv(len(buffer))
+        buffer[:len(datos)] = datos
+        return len(datos)
+
+    def sendall(self, datos):
+        if self.cerrada:
+            raise OSError("sesion de pasarela cerrada")
+        if not self.pasarela.cola.encolar(trama(self.sesion, DATOS, datos)):
+            raise OSError("conexion de pasarela cerrada")
+
+    def shutdown(self, como=None):
+        self.entrada.put(b"")
+
+    def close(self):
+        if self.cerrada:
+            return
+        self.cerrada = True
+        self.entrada.put(b"")
+        self.pasarela.sesion_terminada(self.sesion, self)
+
+
+class PasarelaServidor:
+    """Atiende una conexion de pasarela en el servidor: lee las tramas y reparte cada una a su
+    sesion. manejador(conn, addr, control) es server_tcp.manejarCliente y se corre en un hilo por
+    sesion, igual que con las conexiones reales. control es el ControlAdmision que dejo entrar a
+    la pasarela; las sesiones entran y salen de ese mismo"""
+
+    def __init__(self, conn, addr, manejador, control, cola):
+        self.conn = conn
+        self.addr = addr
+        self.manejador = manejador
+        self.control = control
+        self.cola = cola
+        self.sesiones = {}
+        self.lock = threading.Lock()
+
+    def atender(self, lector):
+        try:
+            while True:
+                datos = lector.siguiente(self.conn)
+                if datos is None:
+                    break
+                sesion, tipo = CABECERA.unpack_from(datos)
+                contenido = datos[CABECERA.size:]
+                if tipo == ABRIR:
+                    self.abrir(sesion, contenido)
+                    continue
+                with self.lock:
+                    conexion = self.sesiones.get(sesion)
+                if conexion is None:
+                    continue
+                conexion.alimentar(contenido if tipo == DATOS else b"")
+        except (OSError, protocolo.ErrorTrama, struct.error):
+            pass
+        finally:
+            """se corto la pasarela: todas sus sesiones reciben fin de conexion"""
+            with self.lock:
+                conexiones = list(self.sesiones.values())
+            for conexion in conexiones:
+                conexion.alimentar(b"")
+
+    def abrir(self, sesion, nombre):
+        """Cada sesion cuenta como una conexion para el control de admision, manejarCliente
+        llama a control.salir() al terminar. Un ABRIR con el numero de una sesion que sigue
+        abierta se rechaza y la vieja se cierra: si no, su hilo quedaria atendiendo una sesion
+        que ya nadie puede cerrar"""
+        with self.lock:
+            vieja = self.sesiones.pop(sesion, None)
+        if vieja is not None:
+            vieja.alimentar(b"")
+            self.cola.encolar(trama(sesion, DATOS, b"ERROR: Sesion de pasarela repetida\n"))
+            return
+        if not self.control.entrar():
+            self.cola.encolar(trama(sesion, DATOS, f"ERROR: {self.control.mensaje_lleno()}\n".encode()))
+            self.cola.encolar(trama(sesion, CERRAR))
+            return
+        conexion = ConexionVirtual(self, sesion, nombre)
+        with self.lock:
+            self.sesiones[sesion] = conexion
+        threading.Thread(target=self.manejador, args=(conexion, (self.addr, sesion), self.control), daemon=True).start()
+
+    def sesion_terminada(self, sesion, conexion):
+        with self.lock:
+            if self.sesiones.get(sesion) is conexion:
+                del self.sesiones[sesion]
+        self.cola.encolar(trama(sesion, CERRAR))
+
+
+# --- LADO DE LA GUI ---
+
+"""Lo que recibe una sesion con reconectar=True cuando se corta la pasarela, como el aviso de
+ClienteTCP (ver cliente_tcp.AVISO_PERDIDA)"""
+AVISO_PERDIDA = "*** Se perdio la conexion con el servidor, reconectando... ***"
+
+
+class Pasarela:
+    """Conexion compartida del proceso de la GUI. abrir() crea una SesionPasarela por usuario;
+    un unico hilo lee del servidor y le entrega cada mensaje a su sesion"""
+
+    def __init__(self, host, port, compartida=None):
+        self.host = host
+        self.port = port
+        """la PasarelaCompartida que la creo, de donde las sesiones sacan otra si esta se corta"""
+        self.compartida = compartida
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        prompt = self.sock.recv(1024).decode()
+        if prompt.startswith("ERROR"):
+            self.sock.close()
+            raise ConnectionRefusedError(prompt.strip())
+        self.sock.sendall(MAGIA)
+        self.lector = protocolo.LectorTramas()
+        self.sesiones = {}
+        self.siguiente_id = 1
+        self.lock = threading.Lock()
+        self.lock_envio = threading.Lock()
+        self.activa = True
+        self.hilo = threading.Thread(target=self._leer, daemon=True)
+        self.hilo.start()
+
+    def abrir(self, entregar=None, binario=False, reconectar=False):
+        """Crea una sesion nueva (ver SesionPasarela). Si la conexion ya se corto (por ejemplo el
+        servidor no acepta pasarelas) lanza ConnectionResetError en lugar de dejar la sesion
+        esperando un prompt que no llega"""
+        sesion = SesionPasarela(self, 0, entregar, binario, reconectar)
+        self.adoptar(sesion)
+        return sesion
+
+    def adoptar(self, sesion):
+        """Le da a la sesion un numero en esta pasarela (al crearla o al reconectarse por otra)"""
+        with self.lock:
+            if not self.activa:
+                raise ConnectionResetError("Pasarela desconectada")
+            """al dar la vuelta se saltean los numeros que siguen en uso"""
+            while self.siguiente_id in self.sesiones or not self.siguiente_id:
+                self.siguiente_id = (self.siguiente_id + 1) & 0xFFFFFFFF
+            sesion.pasarela = self
+            sesion.id = self.siguiente_id
+            self.sesiones[sesion.id] = sesion
+            self.siguiente_id = (self.siguiente_id + 1) & 0xFFFFFFFF
+
+    def enviar(self, sesion, tipo, datos=b""):
+        with self.lock_envio:
+            self.sock.sendall(trama(sesion, tipo, datos))
+
+    def olvidar(self, sesion):
+        with self.lock:
+            self.sesiones.pop(sesion, None)
+
+    def _leer(self):
+        try:
+            while True:
+                datos = self.lector.siguiente(self.sock)
+                if datos is None:
+                    break
+                id_sesion, tipo = CABECERA.unpack_from(datos)
+                with self.lock:
+                    sesion = self.sesiones.get(id_sesion)
+                if sesion is None:
+                    continue
+                if tipo == CERRAR:
+                    self.olvidar(id_sesion)
+                    sesion.terminar()
+                else:
+                    sesion.recibir(datos[CABECERA.size:])
+        except (OSError, protocolo.ErrorTrama, struct.error):
+            pass
+        finally:
+            self.activa = False
+            with self.lock:
+                sesiones = list(self.sesiones.values())
+                self.sesiones.clear()
+            for sesion in sesiones:
+                sesion.terminar()
+
+    def cerrar(self):
+        self.activa = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class PasarelaCompartida:
+    """La pasarela de un proceso: actual() la devuelve y si se corto conecta otra. Es lo que
+    guarda la GUI y lo que usan las sesiones para reconectarse"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.pasarela = None
+
+    def actual(self):
+        with self.lock:
+            if self.pasarela is None or not self.pasarela.activa:
+                self.pasarela = Pasarela(self.host, self.port, self)
+            return self.pasarela
+
+
+class SesionPasarela:
+    """Un usuario dentro de la pasarela, con la misma interfaz que ClienteTCP (conectado,
+    conectar, enviar_mensaje, enviar_archivo, recibir_mensaje, cerrar).
+
+    entregar(mensaje) se llama desde el hilo lector con cada mensaje (None cuando la sesion
+    termina); si no se pasa, los mensajes se leen con recibir_mensaje(). En texto cada mensaje es
+    una linea. Con binario=True la sesion pide registros compactos como ClienteTCP en modo
+    binario (ver binario.py): cada mensaje es un binario.Registro y se guarda el token de la
+    sesion y el id del ultimo mensaje. Con reconectar=True (solo binario) un corte de la pasarela
+    o del servidor no termina la sesion: se entrega AVISO_PERDIDA y un hilo vuelve a abrirla, por
+    la pasarela actual, esperando cada vez mas entre intentos y pidiendo reanudar con el token
+    (ver reanudacion.py). Una sesion que nunca recibio token (el servidor no la registro) no se
+    reconecta"""
+    ESPERA_PROMPT = 5.0
+
+    def __init__(self, pasarela, id_sesion, entregar=None, binario=False, reconectar=False):
+        self.pasarela = pasarela
+        self.id = id_sesion
+        self.entregar = entregar
+        self.binario = binario
+        self.reconectar = reconectar and binario
+        self.recibidos = queue.SimpleQueue()
+        self.prompt = queue.SimpleQueue()
+        self.esperando_prompt = True
+        self.lector = None
+        self.conectado = False
+        self.nombre = None
+        self.token = None
+        self.ultimo_id = 0
+        self.caido = False
+        self.cerrado = threading.Event()
+
+    def recibir(self, datos):
+        """Lo llama el hilo lector de la pasarela. Una trama DATOS puede traer varios mensajes
+        (la repeticion del historial o un lote del nucleo salen en un solo envio): en texto se
+        entregan de a uno por linea y en binario de a una trama"""
+        if self.esperando_prompt:
+            """el primer mensaje es el prompt "Usuario: " (o un ERROR si el servidor esta lleno),
+            igual que en ClienteTCP lo consume conectar() y no se muestra"""
+            self.esperando_prompt = False
+            self.prompt.put(datos.decode())
+            return
+        if self.lector is None:
+            for linea in datos.decode().splitlines(keepends=True):
+                self._entregar(linea)
+            return
+        self.lector.alimentar(datos)
+        registro = self.lector.pendiente()
+        while registro is not None:
+            self._registro(registro)
+            registro = self.lector.pendiente()
+
+    def _registro(self, datos):
+        """El token de la sesion no se entrega, se guarda; de los demas registros se anota el id"""
+        registro = binario.leer(datos)
+        if registro.tipo == binario.SESION:
+            self.token = registro.contenido
+            return
+        self.ultimo_id = max(self.ultimo_id, registro.id)
+        self._entregar(registro)
+
+    def _entregar(self, mensaje):
+        if self.entregar is not None:
+            self.entregar(mensaje)
+        else:
+            self.recibidos.put(mensaje)
+
+    def terminar(self):
+        """La pasarela se corto o el servidor cerro la sesion"""
+        if self.esperando_prompt:
+            """la conexion (o reconexion) en curso se entera por el prompt"""
+            self.esperando_prompt = False
+            self.prompt.put(None)
+            return
+        if self.reconectar and self.token and not self.cerrado.is_set():
+            if not self.caido:
+                self.caido = True
+                self._entregar(binario.Registro(binario.AVISO, 0, contenido=AVISO_PERDIDA))
+                threading.Thread(target=self._reconectar, daemon=True).start()
+            return
+        self.conectado = False
+        self._entregar(None)
+
+    def conectar(self, nombre_usuario):
+        self.nombre = nombre_usuario
+        exito, info = self._abrir(nombre_usuario)
+        if not exito:
+            return False, info
+        self.conectado = True
+        return True, "Conectado exitosamente (pasarela)"
+
+    def _abrir(self, presentacion):
+        """Manda ABRIR con el nombre (o el pedido de reanudar) y espera el prompt. (exito, info)"""
+        self.prompt = queue.SimpleQueue()
+        self.esperando_prompt = True
+        contenido = presentacion.encode()
+        if self.binario:
+            self.lector = protocolo.LectorTramas()
+            contenido = binario.MAGIA + protocolo.enmarcar(contenido)
+        try:
+            self.pasarela.enviar(self.id, ABRIR, contenido)
+            prompt = self.prompt.get(timeout=self.ESPERA_PROMPT)
+        except (OSError, queue.Empty) as e:
+            self.esperando_prompt = False
+            self.pasarela.olvidar(self.id)
+            return False, f"Error de conexión: {e or 'sin respuesta'}"
+        if prompt is None or prompt.startswith("ERROR"):
+            self.pasarela.olvidar(self.id)
+            return False, (prompt or "ERROR: Pasarela desconectada").strip()
+        return True, ""
+
+    def _reconectar(self):
+        """Vuelve a abrir la sesion por la pasarela actual (o una nueva si la de antes se cayo)
+        hasta lograrlo o hasta que se cierre la sesion"""
+        anterior = self.pasarela
+        for espera in reanudacion.esperas():
+            if self.cerrado.wait(espera):
+                return
+            try:
+                if anterior.compartida is not None:
+                    anterior.compartida.actual().adoptar(self)
+                else:
+                    Pasarela(anterior.host, anterior.port).adoptar(self)
+            except OSError:
+                continue
+            pedido = reanudacion.pedido(self.nombre, self.token, self.ultimo_id)
+            """si el servidor la registra manda un token nuevo; si la rechaza se queda sin token y
+            el proximo corte la termina en lugar de reintentar para siempre"""
+            token, self.token = self.token, None
+            if self._abrir(pedido)[0]:
+                self.caido = False
+                return
+            self.token = token
+
+    def enviar_mensaje(self, mensaje):
+        if self.conectado and not self.caido:
+            try:
+                datos = protocolo.empaquetar(mensaje.encode(), "binario") if self.binario else mensaje.encode()
+                self.pasarela.enviar(self.id, DATOS, datos)
+            except Exception as e:
+                print(f"Error enviando: {e}")
+
+    def enviar_archivo(self, destino, archivo, nombre_archivo=None):
+        """Como ClienteTCP.enviar_archivo: el archivo va por una conexion directa al canal de
+        archivos (ver archivos.py) con el nombre y el token de la sesion, no por la pasarela, asi
+        no frena los mensajes de las demas sesiones. Solo las sesiones binarias tienen token"""
+        if not self.token:
+            return False, "Para mandar archivos hace falta una sesion binaria"
+        try:
+            archivos.subir_archivo(self.pasarela.host, self.pasarela.port, self.nombre, self.token,
+                                   destino, archivo, nombre_archivo)
+        except (OSError, archivos.ErrorTransferencia) as e:
+            return False, f"No se pudo mandar el archivo: {e}"
+        return True, f"Archivo enviado a {destino}"
+
+    def recibir_mensaje(self):
+        """Solo para sesiones sin entregar: bloquea hasta el proximo mensaje, None si se cerro"""
+        if not self.conectado and self.recibidos.empty():
+            return None
+        mensaje = self.recibidos.get()
+        return mensaje.texto() if isinstance(mensaje, binario.Registro) else mensaje
+
+    def cerrar(self):
+        self.cerrado.set()
+        if self.conectado:
+            self.conectado = False
+            try:
+                self.pasarela.enviar(self.id, CERRAR)
+            except OSError:
+                pass
+        self.pasarela.olvidar(self.id)
@@ -0,0 +1,96 @@
+"""Perfilador por muestreo para los servidores en marcha. Un hilo mira cada INTERVALO segundos
+en que linea esta cada hilo del proceso (sys._current_frames) y cuenta cuantas veces aparece
+cada pila. No instrumenta ninguna funcion, asi que apagado no cuesta nada y prendido cuesta una
+lectura de pilas por intervalo.
+
+Se prende y apaga en caliente desde el servidor de metricas (/perfil/activar y
+/perfil/desactivar, ver metricas.py) o al arrancar con CHAT_PERFILADOR=1. reporte() devuelve las
+pilas en formato "colapsado" (funciones separadas por ";" y la cantidad de muestras), que se
+puede pasar directo a flamegraph.pl o speedscope."""
+import collections
+import os
+import sys
+import threading
+import time
+
+INTERVALO = float(os.environ.get("CHAT_PERFILADOR_INTERVALO", "0.005"))
+
+"""Profundidad maxima de pila que se guarda por muestra"""
+PROFUNDIDAD = 40
+
+pilas = collections.Counter()
+muestras = 0
+_activo = threading.Event()
+_hilo = None
+_lock = threading.Lock()
+
+
+def _pila(frame):
+    partes = []
+    while frame is not None and len(partes) < PROFUNDIDAD:
+        codigo = frame.f_code
+        partes.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(partes))
+
+
+def _muestrear(intervalo):
+    global muestras
+    propio = threading.current_thread()
+    try:
+        """si se desactivo y se volvio a activar mientras dormia, sigue solo el hilo nuevo"""
+        while _activo.is_set() and _hilo is propio:
+            frames = sys._current_frames()
+            with _lock:
+                for ident, frame in frames.items():
+                    if ident != propio.ident:
+                        pilas[_pila(frame)] += 1
+                muestras += 1
+            del frames
+            time.sleep(intervalo)
+    finally:
+        """si el hilo muere por un error no queda marcado como activo, asi activar() lo puede
+        volver a arrancar"""
+        with _lock:
+            if _hilo is propio:
+                _activo.clear()
+
+
+def activar(intervalo=None):
+    """Empieza a tomar muestras (si ya estaba activo no hace nada). intervalo en segundos, tiene
+    que ser positivo (ValueError si no)"""
+    global _hilo
+    intervalo = INTERVALO if intervalo is None else intervalo
+    if not 0 < intervalo < float("inf"):
+        raise ValueError(f"Intervalo invalido: {intervalo}")
+    with _lock:
+        if _activo.is_set():
+            return
+        _activo.set()
+        _hilo = threading.Thread(target=_muestrear, args=(intervalo,), daemon=True)
+        _hilo.start()
+
+
+def desactivar():
+    """Deja de tomar muestras; lo acumulado queda para reporte()"""
+    _activo.clear()
+
+
+def activo():
+    return _activo.is_set()
+
+
+def reporte(limite=50, reiniciar=False):
+    """Las `limite` pilas con mas muestras en formato colapsado"""
+    global muestras
+    with _lock:
+        lineas = [f"# muestras={muestras} activo={activo()}"]
+        lineas.extend(f"{pila} {cuenta}" for pila, cuenta in pilas.most_common(limite))
+        if reiniciar:
+            pilas.clear()
+            muestras = 0
+    return "\n".join(lineas) + "\n"
+
+
+if os.environ.get("CHAT_PERFILADOR") == "1":
+    activar()
@@ -0,0 +1,71 @@
+"""Presencia de los usuarios UDP. En UDP no hay conexion que se corte, asi que un cliente que se
+cierra sin avisar (o se queda sin red) seguiria ocupando un lugar y recibiendo cada broadcast.
+
+Cada sesion guarda la ultima vez que se recibio algo de ella. Los vencimientos estan en un heap
+de (vence, sesion) con una sola entrada por sesion: recibir un datagrama solo actualiza el
+diccionario (O(1)) y recien cuando la entrada llega a la punta del heap se mira si la sesion
+siguio activa; si es asi se reprograma y si no se da por vencida. Revisar cuesta O(1) cuando no
+vence nada y O(log n) por cada entrada que se saca.
+
+Los clientes mandan PING cada INTERVALO_PING segundos si no enviaron otra cosa, y SALIR al
+cerrarse. Configuracion: CHAT_UDP_INACTIVIDAD (segundos sin datos para expulsar una sesion) y
+CHAT_UDP_PING (cada cuanto manda PING el cliente)."""
+import heapq
+import os
+import time
+
+INACTIVIDAD = float(os.environ.get("CHAT_UDP_INACTIVIDAD", "60"))
+INTERVALO_PING = float(os.environ.get("CHAT_UDP_PING", "20"))
+
+PING = "/ping"
+SALIR = "/salir"
+
+"""Respuesta a un PING de una direccion que no esta registrada (se la expulso o el servidor se
+reinicio); un cliente con reconectar=True la toma como aviso para volver a registrarse"""
+EXPIRADA = "[ERROR] Tu sesion expiro por inactividad, vuelve a conectarte"
+
+
+class Presencia:
+    """No tiene lock: la usa solo el hilo que recibe en server_udp"""
+
+    def __init__(self, inactividad=None):
+        self.inactividad = inactividad or INACTIVIDAD
+        self.ultimo = {}
+        self.vencimientos = []
+
+    def tocar(self, sesion):
+        """Registra actividad de una sesion (la agrega si es nueva)"""
+        ahora = time.monotonic()
+        if sesion not in self.ultimo:
+            heapq.heappush(self.vencimientos, (ahora + self.inactividad, sesion))
+        self.ultimo[sesion] = ahora
+
+    def olvidar(self, sesion):
+        """Deja de seguir una sesion; su entrada en el heap se descarta cuando llega a la punta"""
+        self.ultimo.pop(sesion, None)
+
+    def vencidas(self):
+        """Devuelve las sesiones que pasaron INACTIVIDAD segundos sin mandar nada y las olvida"""
+        ahora = time.monotonic()
+        vencidas = []
+        while self.vencimientos and self.vencimientos[0][0] <= ahora:
+            _, sesion = heapq.heappop(self.vencimientos)
+            ultimo = self.ultimo.get(sesion)
+            if ultimo is None:
+                continue
+            if ultimo + self.inactividad > ahora:
+                heapq.heappush(self.vencimientos, (ultimo + self.inactividad, sesion))
+                continue
+            del self.ultimo[sesion]
+            vencidas.append(sesion)
+        return vencidas
+
+    def proxima(self):
+        """Segundos hasta el proximo vencimiento a revisar (None si no hay sesiones), para que el
+        servidor duerma justo hasta ahi en vez de despertarse cada segundo"""
+        if not self.vencimientos:
+            return None
+        return max(0.0, self.vencimientos[0][0] - time.monotonic())
+
+    def __len__(self):
+        return len(self.ultimo)
@@ -0,0 +1,188 @@
+"""Capa de tramas para el chat TCP. TCP es un flujo de bytes: dos sendall pueden llegar juntos
+en un solo recv o un mensaje puede llegar partido (incluso a mitad de un caracter UTF-8). Para
+separar los mensajes cada uno viaja como una trama:
+
+    [largo: 4 bytes big endian][contenido: largo bytes]
+
+Los clientes nuevos avisan que usan tramas mandando MAGIA antes de la trama con su nombre.
+Los clientes viejos (la terminal de menu.py) mandan el nombre en texto plano y siguen en el
+modo "texto", donde cada recv se toma como un mensaje entero como antes.
+
+Los clientes que mandan binario.MAGIA quedan en el modo "binario": tramas igual que en el modo
+"tramas", pero lo que les manda el servidor son registros compactos (ver binario.py).
+
+Antes de cualquiera de las dos se puede mandar compresion.MAGIA para recibir los mensajes
+comprimidos (ver compresion.py)."""
+import collections
+import struct
+
+import binario
+import compresion
+
+MAGIA = b"\x00TRM1"
+CABECERA = struct.Struct("!I")
+TAMANO_MAXIMO = 1 << 20
+TAMANO_RECV_TEXTO = 1024
+
+MODOS = ("texto", "tramas", "binario")
+
+
+class ErrorTrama(ValueError):
+    """La trama recibida no es valida (por ejemplo anuncia un largo mayor a TAMANO_MAXIMO)"""
+
+
+def enmarcar(datos):
+    """Devuelve la trama lista para enviar con sendall"""
+    if len(datos) > TAMANO_MAXIMO:
+        raise ErrorTrama(f"Mensaje de {len(datos)} bytes supera el maximo de {TAMANO_MAXIMO}")
+    return CABECERA.pack(len(datos)) + datos
+
+
+def empaquetar(datos, modo):
+    """Prepara los bytes de un mensaje para un cliente segun su modo"""
+    return datos if modo == "texto" else enmarcar(datos)
+
+
+class LectorTexto:
+    """Modo heredado: cada bloque recibido es un mensaje. Se usa con los clientes que no
+    mandan MAGIA al conectarse"""
+    modo = "texto"
+    comprimir = False
+
+    def __init__(self, inicial=b"", tamano_recv=TAMANO_RECV_TEXTO):
+        self.tamano_recv = tamano_recv
+        self.listos = collections.deque()
+        if inicial:
+            self.listos.append(inicial)
+
+    def alimentar(self, datos):
+        if datos:
+            self.listos.append(bytes(datos))
+
+    def pendiente(self):
+        """Devuelve el siguiente mensaje ya recibido o None si hay que leer mas del socket"""
+        return self.listos.popleft() if self.listos else None
+
+    def siguiente(self, sock):
+        """Devuelve el siguiente mensaje (bytes) o None si el socket se cerro"""
+        if self.listos:
+            return self.listos.popleft()
+        datos = sock.recv(self.tamano_recv)
+        return datos or None
+
+
+class LectorTramas:
+    """Decodificador incremental de tramas. Los bytes se reciben directo dentro de un bytearray
+    reservado (recv_into sobre un memoryview), las cabeceras se leen en el lugar con
+    struct.unpack_from y solo se copia el contenido de cada trama completa. Lo que queda de una
+    trama partida se mueve al principio del buffer una sola vez cuando hace falta lugar."""
+    modo = "tramas"
+    comprimir = False
+
+    def __init__(self, inicial=b"", capacidad=64 * 1024):
+        self.buf = bytearray(capacidad)
+        self.inicio = 0
+        self.fin = 0
+        self.listos = collections.deque()
+        if inicial:
+            self.alimentar(inicial)
+
+    def _reservar(self, necesario):
+        """Asegura al menos `necesario` bytes libres al final del buffer"""
+        if len(self.buf) - self.fin >= necesario:
+            return
+        usados = self.fin - self.inicio
+        if self.inicio:
+            self.buf[:usados] = self.buf[self.inicio:self.fin]
+            self.inicio, self.fin = 0, usados
+        if len(self.buf) - self.fin < necesario:
+            self.buf.extend(bytes(max(necesario, len(self.buf))))
+
+    def _separar(self):
+        """Saca del buffer todas las tramas completas y las deja en self.listos"""
+        vista = memoryview(self.buf)
+        while self.fin - self.inicio >= CABECERA.size:
+            (largo,) = CABECERA.unpack_from(self.buf, self.inicio)
+            if largo > TAMANO_MAXIMO:
+                raise ErrorTrama(f"Trama de {largo} bytes supera el maximo de {TAMANO_MAXIMO}")
+            final = self.inicio + CABECERA.size + largo
+            if final > self.fin:
+                """trama incompleta: se reserva lugar para el resto y se espera al proximo recv"""
+                vista.release()
+                self._reservar(final - self.fin)
+                return
+            self.listos.append(bytes(vista[self.inicio + CABECERA.size:final]))
+            self.inicio = final
+        vista.release()
+        if self.inicio == self.fin:
+            self.inicio = self.fin = 0
+
+    def alimentar(self, datos):
+        """Agrega bytes leidos por otro medio (por ejemplo un StreamReader de asyncio)"""
+        self._reservar(len(datos))
+        self.buf[self.fin:self.fin + len(datos)] = datos
+        self.fin += len(datos)
+        self._separar()
+
+    def recibir_de(self, sock):
+        """Hace un recv_into del socket directo en el buffer. Devuelve la cantidad de bytes
+        leidos (0 si el socket se cerro)"""
+        self._reservar(4096)
+        with memoryview(self.buf) as vista:
+            leidos = sock.recv_into(vista[self.fin:])
+        self.fin += leidos
+        self._separar()
+        return leidos
+
+    def pendiente(self):
+        return self.listos.popleft() if self.listos else None
+
+    def siguiente(self, sock):
+        """Devuelve el contenido de la siguiente trama (bytes) o None si el socket se cerro"""
+        while not self.listos:
+            if not self.recibir_de(sock):
+                return None
+        return self.listos.popleft()
+
+
+"""Todo lo que un cliente puede mandar antes de su primera trama. Los clientes de texto plano
+nunca empiezan con el byte 0 de las MAGIA"""
+PREFIJOS = (MAGIA, binario.MAGIA, compresion.MAGIA + MAGIA, compresion.MAGIA + binario.MAGIA)
+
+
+def incompleto(datos, prefijos=PREFIJOS):
+    """True si datos puede ser el principio de alguno de los prefijos pero todavia no llego
+    entero: hay que leer mas antes de decidir como habla el cliente"""
+    return any(len(datos) < len(prefijo) and prefijo.startswith(datos) for prefijo in prefijos)
+
+
+def leer_inicio(sock, otros=(), tamano=TAMANO_RECV_TEXTO):
+    """Primer bloque de un cliente para negociar(): si el prefijo (de PREFIJOS o de otros, como
+    pasarela.MAGIA) llega partido en varios recv se sigue leyendo hasta tenerlo entero, hasta
+    ver un byte que no coincide o hasta que se cierre la conexion"""
+    datos = sock.recv(tamano)
+    while datos and incompleto(datos, PREFIJOS + tuple(otros)):
+        bloque = sock.recv(tamano)
+        if not bloque:
+            break
+        datos += bloque
+    return datos
+
+
+def negociar(primero):
+    """Recibe el primer bloque que manda un cliente (ver leer_inicio) y devuelve el lector
+    adecuado: si empieza con MAGIA el cliente habla en tramas, con binario.MAGIA en tramas y
+    recibe registros compactos, si no es un cliente de texto plano. lector.modo es el modo de su sesion y
+    lector.comprimir si pidio compresion.MAGIA antes (en texto plano no se usa)"""
+    comprimir = primero.startswith(compresion.MAGIA)
+    if comprimir:
+        primero = primero[len(compresion.MAGIA):]
+    if primero.startswith(MAGIA):
+        lector = LectorTramas(primero[len(MAGIA):])
+    elif primero.startswith(binario.MAGIA):
+        lector = LectorTramas(primero[len(binario.MAGIA):])
+        lector.modo = "binario"
+    else:
+        return LectorTexto(primero)
+    lector.comprimir = comprimir
+    return lector
@@ -0,0 +1,100 @@
+"""Reconexion de los clientes y reanudacion de sesiones.
+
+Del lado del cliente (cliente_tcp.py y cliente_udp.py con reconectar=True): si se corta la
+conexion se vuelve a conectar esperando entre intentos segun esperas(), que crece en forma
+exponencial hasta ESPERA_MAXIMA y elige un valor al azar dentro de ese tope. Asi, cuando el
+servidor se reinicia, los clientes que se cayeron juntos no vuelven todos en el mismo instante.
+
+Del lado del servidor: al registrarse, una sesion binaria (ver binario.py) recibe un registro
+SESION con un token firmado con HMAC para su nombre. Los registros que salen del historial traen
+su id, y el cliente recuerda el ultimo que vio. Al reconectarse manda, en lugar del nombre:
+
+    /reanudar <token> <ultimo id visto> <nombre>
+
+Si el token es valido para ese nombre y no vencio, el nucleo:
+- reemplaza la sesion vieja si el servidor todavia no noto que se cayo
+- lo vuelve a unir a las salas donde estaba
+- le repite solo lo que se perdio (lo que vino despues de ese id), en lugar de repetir el
+  historial entero
+Si el token no sirve, entra como un usuario nuevo con ese nombre.
+
+La clave del HMAC se guarda en el directorio del historial, asi los tokens siguen valiendo
+despues de reiniciar el servidor (los ids del historial tambien se conservan). Con varios workers
+(servidor_multiproceso.py) cada uno tiene su historial y su clave: un token solo vale en el
+worker que lo dio, en otro se entra como usuario nuevo.
+
+Configuracion por variables de entorno: CHAT_REANUDAR_HORAS (validez del token),
+CHAT_RECONEXION_BASE y CHAT_RECONEXION_MAXIMA (segundos de espera entre intentos)."""
+import hashlib
+import hmac
+import os
+import random
+import time
+
+DURACION = float(os.environ.get("CHAT_REANUDAR_HORAS", "24")) * 3600
+ESPERA_BASE = float(os.environ.get("CHAT_RECONEXION_BASE", "0.5"))
+ESPERA_MAXIMA = float(os.environ.get("CHAT_RECONEXION_MAXIMA", "30"))
+
+COMANDO = "/reanudar"
+ARCHIVO_CLAVE = "reanudar.clave"
+
+
+def esperas(base=None, maxima=None):
+    """Segundos a esperar antes de cada intento de reconexion, sin fin: el tope se duplica en
+    cada intento hasta maxima y la espera es un valor al azar entre 0 y el tope"""
+    base = base or ESPERA_BASE
+    maxima = maxima or ESPERA_MAXIMA
+    tope = base
+    while True:
+        yield random.uniform(0, tope)
+        tope = min(maxima, tope * 2)
+
+
+def pedido(nombre, token, ultimo):
+    """Lo que manda el cliente en lugar de su nombre para retomar la sesion"""
+    return f"{COMANDO} {token} {ultimo} {nombre}"
+
+
+def leer_pedido(texto):
+    """Primer mensaje de un cliente: (nombre, None) si es un nombre comun o (nombre, (token,
+    ultimo id)) si pide reanudar. Un pedido mal formado se toma como nombre, como antes"""
+    if not texto.startswith(COMANDO + " "):
+        return texto, None
+    partes = texto.split(" ", 3)
+    if len(partes) < 4 or not partes[2].isdigit() or not partes[3].strip():
+        return texto, None
+    return partes[3].strip(), (partes[1], int(partes[2]))
+
+
+class Reanudacion:
+    """Da y verifica los tokens. token = "<vencimiento>.<HMAC de vencimiento y nombre>", asi el
+    servidor no tiene que guardar nada por usuario"""
+
+    def __init__(self, directorio):
+        self.clave = self._cargar_clave(os.path.join(directorio, ARCHIVO_CLAVE))
+
+    @staticmethod
+    def _cargar_clave(ruta):
+        try:
+            with open(ruta, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        clave = os.urandom(32)
+        descriptor = os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(clave)
+        return clave
+
+    def _firma(self, vence, nombre):
+        return hmac.new(self.clave, f"{vence}:{nombre}".encode(), hashlib.sha256).hexdigest()[:32]
+
+    def token(self, nombre):
+        vence = int(time.time() + DURACION)
+        return f"{vence}.{self._firma(vence, nombre)}"
+
+    def valido(self, nombre, token):
+        vence, _, firma = token.partition(".")
+        if not vence.isdigit() or int(vence) < time.time():
+            return False
+        return hmac.compare_digest(firma, self._firma(int(vence), nombre))
@@ -0,0 +1,139 @@
+"""Salas de chat con un indice de membresia en los dos sentidos:
+- sala -> conjunto de miembros, para que un mensaje cueste en proporcion al tamano de su sala
+- miembro -> conjunto de salas, para sacar a alguien de todas sus salas al desconectarse
+
+Un miembro es cualquier objeto hasheable que identifique la conexion (la ColaEnvio en TCP, la
+direccion (IP, puerto) en UDP). Todos empiezan en SALA_GENERAL y sus mensajes van a su sala
+activa, que es la ultima a la que entraron con /join."""
+import threading
+
+SALA_GENERAL = "general"
+LARGO_MAXIMO = 32
+
+AYUDA = "Comandos de salas: /join sala, /leave [sala], /rooms"
+
+
+class ErrorSala(ValueError):
+    """Comando de sala invalido, el texto se le manda tal cual al usuario"""
+
+
+def validar_nombre(sala):
+    if not sala or len(sala) > LARGO_MAXIMO or not sala.isprintable() or " " in sala:
+        raise ErrorSala(f"Nombre de sala invalido (sin espacios, maximo {LARGO_MAXIMO} caracteres)")
+    return sala
+
+
+class IndiceSalas:
+    """Indice de membresia protegido por un lock propio. miembros() devuelve una copia para
+    que el envio se haga fuera del lock"""
+
+    def __init__(self):
+        self.por_sala = {}
+        self.por_miembro = {}
+        self.activa = {}
+        self.lock = threading.Lock()
+
+    def unir(self, miembro, sala):
+        """Agrega el miembro a la sala y la deja como activa. Devuelve False si ya estaba"""
+        with self.lock:
+            self.activa[miembro] = sala
+            salas = self.por_miembro.setdefault(miembro, set())
+            if sala in salas:
+                return False
+            salas.add(sala)
+            self.por_sala.setdefault(sala, set()).add(miembro)
+            return True
+
+    def salir(self, miembro, sala):
+        """Saca al miembro de una sala. Si era su sala activa vuelve a SALA_GENERAL"""
+        with self.lock:
+            salas = self.por_miembro.get(miembro)
+            if not salas or sala not in salas:
+                return False
+            salas.discard(sala)
+            self._quitar_de_sala(miembro, sala)
+            if self.activa.get(miembro) == sala:
+                self.activa[miembro] = SALA_GENERAL
+            return True
+
+    def quitar(self, miembro):
+        """Saca al miembro de todas sus salas, devuelve las salas en las que estaba"""
+        with self.lock:
+            salas = self.por_miembro.pop(miembro, set())
+            self.activa.pop(miembro, None)
+            for sala in salas:
+                self._quitar_de_sala(miembro, sala)
+            return salas
+
+    def _quitar_de_sala(self, miembro, sala):
+        miembros = self.por_sala.get(sala)
+        if miembros is not None:
+            miembros.discard(miembro)
+            if not miembros:
+                del self.por_sala[sala]
+
+    def miembros(self, sala):
+        with self.lock:
+            return tuple(self.por_sala.get(sala, ()))
+
+    def sala_activa(self, miembro):
+        return self.activa.get(miembro, SALA_GENERAL)
+
+    def salas_de(self, miembro):
+        with self.lock:
+            return set(self.por_miembro.get(miembro, ()))
+
+    def listar(self):
+        """[(sala, cantidad de miembros)] ordenado por nombre"""
+        with self.lock:
+            return sorted((sala, len(miembros)) for sala, miembros in self.por_sala.items())
+
+    def describir(self, miembro):
+        """Texto para responder a /rooms: todas las salas con su cantidad de usuarios, marcando
+        con * la sala activa del miembro y con + las demas salas donde esta"""
+        activa = self.sala_activa(miembro)
+        propias = self.salas_de(miembro)
+        partes = []
+        for sala, cantidad in self.listar():
+            marca = "*" if sala == activa else ("+" if sala in propias else "")
+            partes.append(f"{marca}{sala}({cantidad})")
+        return "Salas: " + ", ".join(partes)
+
+
+def etiqueta(sala):
+    """Prefijo que se agrega a los mensajes grupales fuera de la sala general, asi los mensajes
+    de la sala general quedan con el mismo formato de siempre"""
+    return "" if sala == SALA_GENERAL else f"[#{sala}] "
+
+
+def ejecutar(indice, miembro, nombre, texto):
+    """Aplica un comando /join, /leave o /rooms. Devuelve (respuesta, avisos): la respuesta es
+    para quien mando el comando y avisos es una lista de (sala, texto) para los demas miembros
+    de esa sala. Lanza ErrorSala si el comando no es valido"""
+    comando, _, argumento = texto.partition(" ")
+    argumento = argumento.strip()
+
+    if comando == "/rooms":
+        return indice.describir(miembro) + "\n", []
+
+    if comando == "/join":
+        sala = validar_nombre(argumento)
+        if not indice.unir(miembro, sala):
+            return f"*** Ahora escribes en la sala {sala} ***\n", []
+        return (f"*** Entraste a la sala {sala} ***\n",
+                [(sala, f"*** {nombre} entro a la sala {sala} ***\n")])
+
+    if comando == "/leave":
+        sala = validar_nombre(argumento) if argumento else indice.sala_activa(miembro)
+        if sala == SALA_GENERAL:
+            raise ErrorSala("No se puede salir de la sala general")
+        if not indice.salir(miembro, sala):
+            raise ErrorSala(f"No estas en la sala {sala}")
+        return (f"*** Saliste de la sala {sala}, ahora escribes en {indice.sala_activa(miembro)} ***\n",
+                [(sala, f"*** {nombre} salio de la sala {sala} ***\n")])
+
+    raise ErrorSala(AYUDA)
+
+
+def es_comando(texto):
+    return texto.split(" ", 1)[0] in ("/join", "/leave", "/rooms")
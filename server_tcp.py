@@ -1,130 +1,302 @@
 """Servidor TCP para chat multiusuario con mensajes privados y grupales,
 se importa la libreria socket para crear el servidor y manejar las conexiones de red
 y threading para atender a los clientes de manera simultanea"""
-import datetime
+import argparse
+import os
+import selectors
 import socket
 import threading
+import time
+
+import admision
+import archivos
+import colas_envio
+import metricas
+import nucleo
+import pasarela
+import protocolo
+import reanudacion
+import supervisor
+from colas_envio import ColaEnvio
 
 HOST = "127.0.0.1"
 PORT = 5000
 
-"""se usa UN diccionario para almacenar los clientes conectados, donde la clave es el nombre de usuario
-y el valor es el objeto de conexion del socket al que corresponde ese usuario PERMITIENDO enviar mensajes
-a cualquier cliente usando solo su nombre.
-threading.lock() funciona como un semaforo evitando problemas cuando varios hilos intentan acceder o modificar
-el diccionario al mismo tiempo"""
-clientes = {}          
-lock = threading.Lock()
+"""Motor con el que arranca el servidor: "hilos" (un hilo por cliente, el original) o "asyncio"
+(todas las conexiones en un event loop, ver server_tcp_async). Se puede cambiar con la variable
+de entorno CHAT_MOTOR_TCP o con el argumento --motor al ejecutar este archivo"""
+MOTORES = ("hilos", "asyncio")
+MOTOR = os.environ.get("CHAT_MOTOR_TCP", "hilos")
 
+"""El registro de usuarios, las salas, el historial y el ruteo de mensajes estan en nucleo.py y
+son compartidos con server_udp cuando los dos corren en el mismo proceso. Aca solo queda lo
+propio de TCP: aceptar conexiones, negociar texto o tramas y la ColaEnvio de cada socket, que
+es la sesion del usuario en el nucleo"""
 
-def broadcast(mensaje, remitente=None):
-    """Envia un mensaje a todos los clientes conectados, excepto al remitente si se especifica, 
-    de forma que itera sobre el diccionario de clientes y envia el mensaje a cada uno
-    se usa un bloque try-catch por si falla un envio, continua con el siguiente cliente"""
+"""Limites de conexiones y ritmo de aceptacion (ver admision.py), main() lo vuelve a crear con
+la configuracion final. Cada conexion recibe el que la dejo entrar y lo libera ahi, asi las que
+sobreviven a un reinicio del supervisor no descuentan del nuevo. El limite de usuarios
+registrados lo aplica el nucleo"""
+control = admision.ControlAdmision()
 
-    for nombre, conn in clientes.items():
-        if nombre != remitente:
-            try:
-                conn.sendall(mensaje.encode())
-            except:
-                pass
+"""Colas de envio abiertas (de usuarios y de pasarelas), para vaciarlas al cerrar el servidor"""
+colas = set()
+pasarelas = set()
+
+"""detener() marca la parada y escribe en el despertador, un socketpair que el selector del bucle
+de aceptacion vigila junto al socket del servidor; asi el bucle bloquea sin timeout y se
+despierta en cuanto hay una conexion o un pedido de cierre"""
+parada = threading.Event()
+despertador = None
+motor_activo = None
+
+
+def atender_pasarela(conn, addr, inicial, control_admision):
+    """Conexion compartida de la GUI (ver pasarela.py): cada usuario que lleva es una
+    ConexionVirtual que se atiende con manejarCliente en su propio hilo, como un cliente mas"""
+    print(f"[TCP] Pasarela conectada desde {addr}")
+    cola = ColaEnvio(conn, tamano=pasarela.TAMANO_COLA)
+    pasarelas.add(cola)
+    try:
+        pasarela.PasarelaServidor(conn, addr, manejarCliente, control_admision, cola).atender(protocolo.LectorTramas(inicial))
+    finally:
+        pasarelas.discard(cola)
+        cola.cerrar()
+        print(f"[TCP] Pasarela desconectada ({addr})")
 
 
-def manejarCliente(conn, addr):
+def atender_archivo(conn, addr, inicial):
+    """Canal de archivos (ver archivos.py): la subida o bajada corre en el hilo de esta conexion
+    y del nucleo solo se usa la validacion y el aviso al destinatario, asi el chat no la espera"""
+    almacen = nucleo.almacen
+    op = "desconocida"
+    try:
+        pedido, resto = archivos.leer_cabecera(conn, inicial)
+        op = str(pedido.get("op"))
+        almacen.ocupar()
+    except archivos.ErrorTransferencia as e:
+        conn.sendall(archivos.cabecera({"error": str(e)}))
+        archivos.transferencias.inc(1, (op, "error"))
+        return
+    try:
+        if op == "subir":
+            nombre, destino, archivo, tamano = nucleo.validar_subida(pedido)
+            conn.sendall(archivos.cabecera({"ok": True}))
+            id_archivo = almacen.recibir(conn, tamano, resto)
+            nucleo.avisar_archivo(nombre, destino, id_archivo, tamano, archivo)
+            conn.sendall(archivos.cabecera({"ok": True, "id": id_archivo}))
+            print(f"[TCP] {nombre} subio {archivo} ({tamano} bytes) para {destino}")
+        elif op == "bajar":
+            with open(almacen.ruta(str(pedido.get("id"))), "rb") as f:
+                tamano = os.fstat(f.fileno()).st_size
+                conn.sendall(archivos.cabecera({"ok": True, "tamano": tamano}))
+                conn.sendfile(f)
+        else:
+            raise archivos.ErrorTransferencia("Operacion desconocida")
+        archivos.transferencias.inc(1, (op, "ok"))
+        archivos.bytes_archivos.inc(tamano, (op,))
+    except archivos.ErrorTransferencia as e:
+        archivos.transferencias.inc(1, (op, "error"))
+        conn.sendall(archivos.cabecera({"error": str(e)}))
+    finally:
+        almacen.liberar()
+
+
+def manejarCliente(conn, addr, control_admision):
     """Maneja la comunicacion con un cliente conectado, registra el nombre de usuario,
     recibe mensajes y los procesa para mensajes privados o grupales, si el cliente se desconecta 
-    elimina al cliente de la lista y avisa a los demas. Conn es el socket del cliente y addr es su direccion"""
+    elimina al cliente de la lista y avisa a los demas. Conn es el socket del cliente y addr es su direccion.
+    control_admision es el ControlAdmision que lo dejo entrar, al terminar se libera su lugar en
+    ese mismo (si el supervisor reinicio el servidor, main() ya creo otro).
+    Con el primer bloque que manda el cliente se decide si habla en tramas o en texto plano (protocolo.py)"""
     nombre = None
+    cola = None
     try:
         conn.sendall(b"Usuario: ")
-        nombre = conn.recv(1024).decode().strip()
-
-        with lock:
-            """with lock bloquea el acceso para evitar conflictos entre los hilos, despues se verifica
-            si el nombre ingresado ya existe, si es asi se envia un error y se cierra la conexion,
-            si no, se agrega el cliente al diccionario guardando su conexion"""
-
-            if len(clientes) >= 5:
-                conn.sendall(b"ERROR: Servidor lleno. Maximo 5 usuarios.\n")
-                conn.close()
-                return
-            
-            if nombre in clientes:
-                conn.sendall(b"ERROR: Usuario ya existe\n")
-                conn.close()
-                return
-            clientes[nombre] = conn
-
-        """Muestra el servidor de quien se conecto y avisa a todos los cliengtes que alguien nuevo entro"""
+        primero = protocolo.leer_inicio(conn, (pasarela.MAGIA, archivos.MAGIA))
+        if primero.startswith(pasarela.MAGIA):
+            atender_pasarela(conn, addr, primero[len(pasarela.MAGIA):], control_admision)
+            return
+        if primero.startswith(archivos.MAGIA):
+            atender_archivo(conn, addr, primero[len(archivos.MAGIA):])
+            return
+        lector = protocolo.negociar(primero)
+        nombre, reanudar = reanudacion.leer_pedido((lector.siguiente(conn) or b"").decode().strip())
+
+        """el nucleo verifica el limite de usuarios y que el nombre no exista (en cualquier
+        transporte); si lo rechaza se le manda el error y se cierra la conexion. Un cliente que
+        se reconecta puede mandar su token en lugar del nombre (ver reanudacion.py)"""
+        cola = ColaEnvio(conn, modo=lector.modo, comprimir=lector.comprimir)
+        colas.add(cola)
+        rechazo = nucleo.registrar(nombre, cola, reanudar)
+        if rechazo is not None:
+            nucleo.enviar(cola, rechazo)
+            return
+
+        """Muestra el servidor de quien se conecto"""
         print(f"[TCP] {nombre} conectado desde {addr}")
-        broadcast(f"*** {nombre} se unio al chat ***\n")
+
+        """ritmo de mensajes de este usuario y de su IP (ver admision.py); las sesiones de la
+        pasarela comparten la IP de la conexion de la pasarela, asi abrir muchas sesiones por una
+        pasarela no esquiva el limite por IP"""
+        ip = conn.pasarela.addr[0] if isinstance(conn, pasarela.ConexionVirtual) else addr[0]
+        limite = control_admision.limite_mensajes(ip)
 
         while True:
             """Bucle principal para recibir mensajes del cliente, espera mensajes del cliengte y si
             el mensaje esta vacio significa que se desconecto, si hay algun error al recibir, se sale del ciclo"""
-            msg = conn.recv(1024).decode()
-            if not msg:
+            datos = lector.siguiente(conn)
+            if datos is None:
                 break
-
-            msg = msg.strip()
-
-            """identifica cel comando del mensaje que es privado, despues separa el destinario y el mensaje
-            y por ultimo reconstruye el mensaje completo. Se verifica si el destino existe, envia el mensaje, 
-            envia la confirmacion al remitenete y despues salta al sig mensaje con continue"""
-            
-            fecha = datetime.datetime.now().strftime("%d/%m/%Y %I:%M:%S %p")
-            if msg.startswith("/priv"):
-                _, destino, *contenido = msg.split()
-                contenido = " ".join(contenido)
-
-                if destino in clientes:
-                    """envia el mensaje privado al destinario y la confirmacion al remitente con la fecha/hora"""
-                    clientes[destino].sendall(f"[{fecha}] [PRIVADO de {nombre}] {contenido}\n".encode())
-                    conn.sendall(f"[PRIVADO para {destino}] [Fecha:{fecha}] {contenido}\n".encode())
-                else:
-                    conn.sendall(b"ERROR: Usuario no encontrado\n")
+            recibido = time.perf_counter()
+            metricas.mensajes_recibidos.inc(1, ("tcp",))
+            metricas.bytes_entrada.inc(len(datos), ("tcp",))
+            if nucleo.limitar(cola, limite, "tcp"):
                 continue
+            nucleo.procesar(cola, nombre, datos.decode().strip(), recibido)
 
-            """envia mensajes grupales a todos los clientes conectados con la fecha/hora actual"""    
-            broadcast(f"[{nombre}] [Fecha:{fecha}] {msg}\n", remitente=nombre)
-
-    except:
+    except OSError:
+        """el cliente corto la conexion o se la corto su cola de envio"""
         pass
+    except Exception as e:
+        metricas.errores.inc(1, (type(e).__name__,))
    
     finally:
-        """Bloquea para eliminar al cliente de forma segura, despues se quita al cliente de la lista
-        y broadcast() avisa al grupo que el usuario se salio. por ultimo se cierra la conexion"""
-        with lock:
-            if nombre in clientes:
-                del clientes[nombre]
-        broadcast(f"*** {nombre} salio del chat ***\n")
-        print(f"[TCP] {nombre} desconectado")
+        """el nucleo quita al usuario (si llego a registrarse) y avisa al grupo que se salio,
+        despues se cierra la cola y la conexion"""
+        if cola is not None:
+            colas.discard(cola)
+            if nucleo.salir(cola, nombre):
+                print(f"[TCP] {nombre} desconectado")
+            cola.cerrar()
         conn.close()
+        control_admision.salir()
 
 
-def main():
+def main(motor=None, server=None):
     """Configutra e inicia el servidor creando un socket TCO, despues lo asocia al puerto y 
-    pone al servidor en modo escucha"""
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((HOST, PORT))
-    server.listen()
-    
-    server.settimeout(1)
+    pone al servidor en modo escucha. Si el motor elegido es asyncio se delega en server_tcp_async.
+    server permite pasar un socket que ya esta escuchando (lo usan los workers multiproceso).
+    Vuelve despues de que detener() cierre el servidor"""
+    global control, despertador, motor_activo
+    motor = motor or MOTOR
+    if motor not in MOTORES:
+        raise ValueError(f"Motor TCP desconocido: {motor} (opciones: {', '.join(MOTORES)})")
+    control = admision.ControlAdmision()
+    nucleo.iniciar("tcp")
+    metricas.servir()
+    parada.clear()
+    motor_activo = motor
+    if motor == "asyncio":
+        import server_tcp_async
+        server_tcp_async.main(HOST, PORT, control)
+        return
+
+    if server is None:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        """al reiniciarse despues de una caida el puerto puede tener conexiones en TIME_WAIT"""
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((HOST, PORT))
+        server.listen()
+    server.setblocking(False)
+    despertador, lectura = socket.socketpair()
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    selector.register(lectura, selectors.EVENT_READ)
 
     print(f"[TCP] Servidor escuchando en {HOST}:{PORT}")
 
     try:
-        while True:
-            try:
-                conn, addr = server.accept()
-                threading.Thread(target=manejarCliente, args=(conn, addr), daemon=True).start()
-            except socket.timeout:
-                pass  
-    except KeyboardInterrupt:
-        print("\nCerrando servidor...")
+        while not parada.is_set():
+            """si se supero el ritmo de aceptacion se espera antes de aceptar, los clientes
+            quedan en la cola de listen(). El token se gasta recien cuando accept() devuelve una
+            conexion, no se pierde si el selector despierta por el despertador o si otro se
+            llevo la conexion. Si ya hay demasiadas conexiones abiertas se contesta que el
+            servidor esta lleno antes de pedir el usuario"""
+            espera = control.espera_aceptacion(gastar=False)
+            if espera:
+                parada.wait(espera)
+                continue
+            for clave, _ in selector.select():
+                if clave.fileobj is lectura:
+                    lectura.recv(64)
+                    continue
+                try:
+                    conn, addr = server.accept()
+                except BlockingIOError:
+                    continue
+                control.espera_aceptacion()
+                conn.setblocking(True)
+                if not control.entrar():
+                    conn.sendall(f"ERROR: {control.mensaje_lleno()}\n".encode())
+                    conn.close()
+                    continue
+                # los mensajes de chat son chicos, sin Nagle no esperan al ACK retrasado (~40 ms)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=manejarCliente, args=(conn, addr, control), daemon=True).start()
     finally:
+        selector.close()
         server.close()
+        lectura.close()
+        despertador.close()
+        despertador = None
+        if parada.is_set():
+            drenar()
+
+
+def detener():
+    """Pide el cierre del servidor (lo llama el supervisor o el manejador de senales de un worker)"""
+    parada.set()
+    if motor_activo == "asyncio":
+        import server_tcp_async
+        server_tcp_async.detener()
+        return
+    try:
+        despertador.send(b"x")
+    except (AttributeError, OSError):
+        pass
+
+
+def drenar():
+    """Cierre ordenado: el socket de escucha ya esta cerrado; se avisa a los usuarios, se espera
+    hasta supervisor.ESPERA_CIERRE segundos a que las colas manden lo pendiente (primero las de
+    los usuarios, que pueden estar llenando las de las pasarelas) y se cortan las conexiones"""
+    nucleo.avisar_cierre()
+    fin = time.monotonic() + supervisor.ESPERA_CIERRE
+    sin_enviar = 0
+    for grupo in (colas, pasarelas):
+        pendientes = list(grupo)
+        for cola in pendientes:
+            cola.cerrar(timeout=max(0.0, fin - time.monotonic()))
+        for cola in pendientes:
+            sin_enviar += cola.profundidad()
+            try:
+                cola.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    print(f"[TCP] Servidor cerrado ({sin_enviar} mensajes sin enviar)")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Servidor TCP del chat")
+    parser.add_argument("--motor", choices=MOTORES, default=MOTOR)
+    parser.add_argument("--puerto", type=int, default=PORT)
+    parser.add_argument("--tamano-cola", type=int, default=colas_envio.TAMANO_COLA)
+    parser.add_argument("--politica-cola", choices=colas_envio.POLITICAS, default=colas_envio.POLITICA)
+    parser.add_argument("--max-usuarios", type=int, default=admision.MAX_USUARIOS)
+    parser.add_argument("--max-conexiones", type=int, default=admision.MAX_CONEXIONES)
+    parser.add_argument("--aceptaciones-por-segundo", type=float, default=admision.ACEPTACIONES_POR_SEGUNDO)
+    parser.add_argument("--mensajes-por-segundo", type=float, default=admision.MENSAJES_POR_SEGUNDO)
+    parser.add_argument("--mensajes-por-segundo-ip", type=float, default=admision.MENSAJES_POR_SEGUNDO_IP)
+    parser.add_argument("--metricas-puerto", type=int, default=metricas.PUERTO)
+    args = parser.parse_args()
+    metricas.PUERTO = args.metricas_puerto
+    admision.MAX_USUARIOS = args.max_usuarios
+    admision.MAX_CONEXIONES = args.max_conexiones
+    admision.ACEPTACIONES_POR_SEGUNDO = args.aceptaciones_por_segundo
+    admision.MENSAJES_POR_SEGUNDO = args.mensajes_por_segundo
+    admision.MENSAJES_POR_SEGUNDO_IP = args.mensajes_por_segundo_ip
+    PORT = args.puerto
+    colas_envio.TAMANO_COLA = args.tamano_cola
+    colas_envio.POLITICA = args.politica_cola
+    supervisor.Supervisor([supervisor.Servicio("tcp", lambda: main(args.motor), detener)]).ejecutar()
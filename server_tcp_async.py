@@ -0,0 +1,253 @@
+"""Motor asyncio del servidor TCP. Atiende a todos los clientes en un solo hilo con
+asyncio.start_server y streams, en lugar de crear un hilo por cada conexion como hace
+server_tcp.main. Mantiene el mismo protocolo: pide el usuario, acepta /priv y los comandos de
+salas y reenvia los mensajes grupales a la sala activa, avisando a todos cuando alguien entra o sale del chat"""
+import asyncio
+import os
+import time
+
+import admision
+import archivos
+import metricas
+import nucleo
+import pasarela
+import protocolo
+import reanudacion
+import supervisor
+from colas_envio import ColaEnvioAsync
+
+HOST = "127.0.0.1"
+PORT = 5000
+
+"""El registro de usuarios, las salas y el historial son los de nucleo.py. Cada cliente es una
+ColaEnvioAsync (su StreamWriter queda en cola.writer); el nucleo encola sin esperar y la tarea
+escritora de cada cliente es la que escribe en el socket"""
+control = admision.ControlAdmision()
+
+"""Colas abiertas, para vaciarlas al cerrar, y {tarea: writer} de todas las conexiones (tambien
+las que todavia no mandaron el nombre) para cortarlas y esperar a que terminen. loop y parada
+los crea servir(); detener() marca la parada desde otro hilo con call_soon_threadsafe"""
+colas = set()
+conexiones = {}
+loop = None
+parada = None
+
+
+async def siguiente(reader, lector):
+    """Devuelve el siguiente mensaje del cliente (bytes) o None si se desconecto. El lector
+    (texto o tramas) separa los mensajes, aca solo se le pasan los bytes que llegan"""
+    while True:
+        datos = lector.pendiente()
+        if datos is not None:
+            return datos
+        bloque = await reader.read(protocolo.TAMANO_RECV_TEXTO if lector.modo == "texto" else 65536)
+        if not bloque:
+            return None
+        lector.alimentar(bloque)
+
+
+async def atender_archivo(reader, writer, inicial):
+    """Canal de archivos (ver archivos.py) con el motor asyncio: la subida lee de a TROZO bytes y
+    escribe en el disco desde el executor, la bajada usa loop.sendfile. El StreamReader deja de
+    leer del socket mientras su buffer esta lleno, asi el que sube no llena la memoria"""
+    bucle = asyncio.get_running_loop()
+    almacen = nucleo.almacen
+    op = "desconocida"
+    try:
+        datos = inicial
+        pedido, resto = archivos.separar_cabecera(datos)
+        while pedido is None:
+            bloque = await reader.read(archivos.LARGO_CABECERA)
+            if not bloque:
+                return
+            datos += bloque
+            pedido, resto = archivos.separar_cabecera(datos)
+        op = str(pedido.get("op"))
+        almacen.ocupar()
+    except archivos.ErrorTransferencia as e:
+        writer.write(archivos.cabecera({"error": str(e)}))
+        archivos.transferencias.inc(1, (op, "error"))
+        return
+    try:
+        if op == "subir":
+            nombre, destino, archivo, tamano = nucleo.validar_subida(pedido)
+            writer.write(archivos.cabecera({"ok": True}))
+            id_archivo, parcial, ruta = almacen.nuevo()
+            f = await bucle.run_in_executor(None, open, parcial, "wb")
+            try:
+                resto = resto[:tamano]
+                await bucle.run_in_executor(None, f.write, resto)
+                faltan = tamano - len(resto)
+                while faltan > 0:
+                    bloque = await reader.read(min(archivos.TROZO, faltan))
+                    if not bloque:
+                        raise archivos.ErrorTransferencia("Se corto la conexion")
+                    await bucle.run_in_executor(None, f.write, bloque)
+                    faltan -= len(bloque)
+                f.close()
+            except BaseException:
+                f.close()
+                os.remove(parcial)
+                raise
+            os.replace(parcial, ruta)
+            nucleo.avisar_archivo(nombre, destino, id_archivo, tamano, archivo)
+            writer.write(archivos.cabecera({"ok": True, "id": id_archivo}))
+            print(f"[TCP] {nombre} subio {archivo} ({tamano} bytes) para {destino}")
+        elif op == "bajar":
+            with open(almacen.ruta(str(pedido.get("id"))), "rb") as f:
+                tamano = os.fstat(f.fileno()).st_size
+                writer.write(archivos.cabecera({"ok": True, "tamano": tamano}))
+                await writer.drain()
+                await bucle.sendfile(writer.transport, f)
+        else:
+            raise archivos.ErrorTransferencia("Operacion desconocida")
+        archivos.transferencias.inc(1, (op, "ok"))
+        archivos.bytes_archivos.inc(tamano, (op,))
+    except archivos.ErrorTransferencia as e:
+        archivos.transferencias.inc(1, (op, "error"))
+        writer.write(archivos.cabecera({"error": str(e)}))
+    finally:
+        almacen.liberar()
+    await writer.drain()
+
+
+async def manejarCliente(reader, writer):
+    """Corrutina equivalente a server_tcp.manejarCliente: registra el nombre en el nucleo y le
+    pasa cada mensaje. Al desconectarse el cliente el nucleo lo quita y avisa a los demas"""
+    addr = writer.get_extra_info("peername")
+    nombre = None
+    cola = None
+    if not control.entrar():
+        writer.write(f"ERROR: {control.mensaje_lleno()}\n".encode())
+        writer.close()
+        return
+    tarea = asyncio.current_task()
+    conexiones[tarea] = writer
+    try:
+        """si se supero el ritmo de aceptacion la conexion espera antes de recibir el prompt,
+        hasta que le toque un token (otras conexiones que esperan pueden ganarselo antes)"""
+        espera = control.espera_aceptacion()
+        while espera:
+            await asyncio.sleep(espera)
+            espera = control.espera_aceptacion()
+        writer.write(b"Usuario: ")
+        await writer.drain()
+        primero = await reader.read(1024)
+        otros = protocolo.PREFIJOS + (pasarela.MAGIA, archivos.MAGIA)
+        while primero and protocolo.incompleto(primero, otros):
+            """el prefijo llego partido, ver protocolo.leer_inicio"""
+            bloque = await reader.read(1024)
+            if not bloque:
+                break
+            primero += bloque
+        if primero.startswith(pasarela.MAGIA):
+            """la pasarela de la GUI (pasarela.py) solo la atiende el motor con hilos: se corta la
+            conexion y la GUI ve la pasarela desconectada"""
+            print("[TCP] Pasarela rechazada: no esta disponible con el motor asyncio")
+            return
+        if primero.startswith(archivos.MAGIA):
+            await atender_archivo(reader, writer, primero[len(archivos.MAGIA):])
+            return
+        lector = protocolo.negociar(primero)
+        nombre, reanudar = reanudacion.leer_pedido((await siguiente(reader, lector) or b"").decode().strip())
+
+        cola = ColaEnvioAsync(writer, modo=lector.modo, comprimir=lector.comprimir)
+        colas.add(cola)
+        rechazo = nucleo.registrar(nombre, cola, reanudar)
+        if rechazo is not None:
+            nucleo.enviar(cola, rechazo)
+            return
+
+        print(f"[TCP] {nombre} conectado desde {addr}")
+
+        bucle = asyncio.get_running_loop()
+        limite = control.limite_mensajes(addr[0])
+        while True:
+            datos = await siguiente(reader, lector)
+            if datos is None:
+                break
+            recibido = time.perf_counter()
+            metricas.mensajes_recibidos.inc(1, ("tcp",))
+            metricas.bytes_entrada.inc(len(datos), ("tcp",))
+            if nucleo.limitar(cola, limite, "tcp"):
+                continue
+            msg = datos.decode().strip()
+            if msg.split(" ", 1)[0] == "/history":
+                """la pagina puede requerir leer el disco, se hace fuera del event loop"""
+                await bucle.run_in_executor(None, nucleo.procesar, cola, nombre, msg, recibido)
+            else:
+                nucleo.procesar(cola, nombre, msg, recibido)
+
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    except Exception as e:
+        metricas.errores.inc(1, (type(e).__name__,))
+
+    finally:
+        """Solo se avisa la salida de usuarios que llegaron a registrarse, asi un nombre repetido
+        rechazado no borra al usuario original"""
+        if cola is not None:
+            colas.discard(cola)
+            if nucleo.salir(cola, nombre):
+                print(f"[TCP] {nombre} desconectado")
+            await cola.cerrar()
+        writer.close()
+        conexiones.pop(tarea, None)
+        control.salir()
+
+
+async def servir(host, port):
+    """Crea el servidor asyncio y atiende conexiones hasta que detener() marque la parada;
+    despues hace el cierre ordenado"""
+    global loop, parada
+    loop = asyncio.get_running_loop()
+    parada = asyncio.Event()
+    server = await asyncio.start_server(manejarCliente, host, port, reuse_address=True)
+    print(f"[TCP] Servidor (asyncio) escuchando en {host}:{port}")
+    async with server:
+        await parada.wait()
+        server.close()
+        await drenar()
+
+
+async def drenar():
+    """Avisa a los usuarios y espera hasta supervisor.ESPERA_CIERRE segundos a que las tareas
+    escritoras manden lo pendiente; despues corta las conexiones"""
+    nucleo.avisar_cierre()
+    pendientes = list(colas)
+    if pendientes:
+        await asyncio.wait([asyncio.ensure_future(c.cerrar(supervisor.ESPERA_CIERRE)) for c in pendientes])
+    sin_enviar = sum(c.profundidad() for c in pendientes)
+    """al cerrar el writer el lector de cada conexion recibe fin de datos y su manejarCliente
+    termina normalmente (si no, asyncio.run las cancelaria a la mitad)"""
+    for writer in list(conexiones.values()):
+        writer.close()
+    if conexiones:
+        await asyncio.wait(list(conexiones), timeout=1)
+    print(f"[TCP] Servidor (asyncio) cerrado ({sin_enviar} mensajes sin enviar)")
+
+
+def detener():
+    """Se puede llamar desde cualquier hilo"""
+    if loop is not None and parada is not None:
+        try:
+            loop.call_soon_threadsafe(parada.set)
+        except RuntimeError:
+            pass
+
+
+def main(host=HOST, port=PORT, control_admision=None):
+    """Arranca el event loop del motor asyncio. No necesita settimeout(1) para detectar Ctrl+C
+    porque asyncio.run ya lo atiende, y el supervisor lo cierra con detener()"""
+    global control
+    control = control_admision or admision.ControlAdmision()
+    nucleo.iniciar("tcp")
+    metricas.servir()
+    try:
+        asyncio.run(servir(host, port))
+    except KeyboardInterrupt:
+        print("\nCerrando servidor...")
+
+
+if __name__ == "__main__":
+    main()
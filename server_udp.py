@@ -1,92 +1,409 @@
 """Servidor de chat UDP que maneja multiples clientes y permite mensajes privados. El servidorUDP
 procesa un mensaje donde: recibe, procesa y envia respuesta """
+import argparse
+import os
+import queue
+import select
+import selectors
 import socket
-import datetime
+import threading
+import time
+
+import admision
+import binario
+import compresion
+import metricas
+import nucleo
+import presencia
+import reanudacion
+import supervisor
+import udp_confiable
 
 HOST = "127.0.0.1"
 PORT = 6000
 
-"""Se usan diccionarios para almacenar los usuarios conectados. 
-usuarios: clave es la direccion del cliente (IP, puerto) y valor es el nombre de usuario, permite identificar al cliente por su direccion
-usuariosPorNombre: clave es el nombre de usuario y valor es la direccion del cliente, permite enviar mensajes privados facilmente buscando
-la direccion del destinatario por su nombre.
-"""
-usuarios = {}         
-usuariosPorNombre = {}
+"""Motor del servidor: "simple" (un solo hilo que recibe y envia, el original) o "lotes" (socket
+no bloqueante con selectors que drena varios datagramas por despertar, y un hilo aparte que hace
+los envios, asi recibir nunca espera a que termine un broadcast). Se elige con la variable de
+entorno CHAT_MOTOR_UDP o con --motor"""
+MOTORES = ("simple", "lotes")
+MOTOR = os.environ.get("CHAT_MOTOR_UDP", "simple")
+
+"""Maximo de datagramas que el motor por lotes lee en cada despertar antes de volver al selector"""
+LOTE_RECEPCION = 64
+
+"""El registro de usuarios, las salas, el historial y el ruteo de mensajes estan en nucleo.py y
+son compartidos con server_tcp cuando los dos corren en el mismo proceso (servidores.py), asi un
+usuario UDP puede hablar con uno TCP. Aca queda lo propio de UDP: presencia, entrega confiable y
+el envio de datagramas. A que sesion corresponde cada direccion (IP, puerto) lo sabe el registro
+del nucleo con su indice inverso: cada SesionUDP se registra con su direccion y se busca con
+nucleo.usuarios.en(addr) (ver padron.py)"""
+
+"""Ritmo de registros nuevos (ver admision.py). El limite de usuarios lo aplica el nucleo"""
+control = admision.ControlAdmision()
+
+"""Entrega confiable opcional (ver udp_confiable.py): canal la implementa sobre el mismo socket
+y confiables son las direcciones de los clientes que la pidieron"""
+canal = None
+confiables = set()
+
+"""Ultima actividad de cada direccion registrada, para expulsar a los que dejan de mandar datos
+(ver presencia.py). main() la crea al arrancar"""
+presentes = presencia.Presencia()
+
+"""Cola del hilo que envia en el motor por lotes, cada elemento es (datos, direcciones). None con
+el motor simple, que envia desde el mismo hilo que recibe"""
+salida = None
+
+"""/history puede esperar al disco (ver historial.Historial.pagina): esos pedidos, como
+(sesion, texto, recibido), los atiende hilo_consultas y no el bucle que recibe, asi una pagina
+vieja no frena los datagramas de los demas. main() arranca el hilo la primera vez"""
+consultas = queue.SimpleQueue()
+consultor = None
+
+"""Pedido de cierre: detener() marca la parada y escribe en el despertador (un socketpair que el
+selector vigila junto al socket del servidor), asi el bucle no necesita despertarse cada segundo"""
+parada = threading.Event()
+despertador = None
+
+
+class SesionUDP:
+    """Sesion de un usuario UDP para el nucleo: los mensajes le llegan ya preparados como
+    datagramas (sin el salto de linea final, o registros compactos si se registro con
+    binario.MAGIA; comprimidos de a uno si ademas mando compresion.MAGIA) y se mandan con
+    enviar(), que con el motor por lotes solo los encola para el hilo de envio. El nucleo puede
+    llamar a encolar() desde los hilos de TCP"""
+
+    def __init__(self, server, addr, nombre, modo=nucleo.MODO_DATAGRAMA, comprimir=False):
+        self.server = server
+        self.addr = addr
+        self.nombre = nombre
+        self.modo = modo
+        self.comprimir = comprimir
+        self.limite = control.limite_mensajes(addr[0])
+
+    def encolar(self, datos):
+        enviar(self.server, datos, self.addr)
+        return True
+
+    @staticmethod
+    def encolar_lote(datos, sesiones):
+        """Broadcast del nucleo a varias sesiones UDP: un solo elemento en la cola de envio con
+        todas las direcciones, y los mismos bytes para todas"""
+        difundir(sesiones[0].server, datos, [sesion.addr for sesion in sesiones])
+
+    def profundidad(self):
+        """mensajes sin confirmar en la capa confiable; sin ella UDP no tiene cola propia"""
+        return canal.pendientes(self.addr) if self.addr in confiables else 0
+
+
+def enviar(server, datos, addr):
+    """Envia un datagrama a un cliente"""
+    difundir(server, datos, (addr,))
+
+
+def difundir(server, datos, destinos):
+    """Envia los mismos bytes (ya codificados una vez) a varias direcciones. Con el motor por
+    lotes solo se encola y el hilo de envio hace los sendto"""
+    if salida is not None:
+        salida.put((datos, destinos))
+        return
+    despachar(server, datos, destinos)
+
+
+def despachar(server, datos, destinos):
+    fallidos = 0
+    for addr in destinos:
+        if addr in confiables:
+            canal.enviar(datos, addr)
+            continue
+        try:
+            server.sendto(datos, addr)
+        except BlockingIOError:
+            """buffer del socket lleno: se espera a que se pueda escribir y se reintenta una vez"""
+            select.select([], [server], [], 1)
+            try:
+                server.sendto(datos, addr)
+            except OSError:
+                fallidos += 1
+        except OSError:
+            fallidos += 1
+    """las metricas se suman una vez por lote de destinos, no por datagrama"""
+    if fallidos:
+        metricas.descartados.inc(fallidos, ("error_envio",))
+    metricas.bytes_salida.inc(len(datos) * (len(destinos) - fallidos), ("udp",))
+
+
+def perdido(addr):
+    """La capa confiable dejo de reintentar con un cliente que no confirma"""
+    metricas.descartados.inc(1, ("sin_ack",))
+
+
+def hilo_envio(server):
+    """Motor por lotes: saca de la cola todo lo que haya y lo envia sin volver a bloquearse
+    entre mensajes"""
+    while True:
+        lote = [salida.get()]
+        while len(lote) < LOTE_RECEPCION:
+            try:
+                lote.append(salida.get_nowait())
+            except queue.Empty:
+                break
+        for elemento in lote:
+            if elemento is None:
+                """fin del cierre ordenado, ya se mando todo lo que habia antes en la cola"""
+                return
+            despachar(server, *elemento)
+
 
+def recibir(server, data, addr):
+    """Atiende un datagrama recibido. Los de clientes confiables pasan por la capa de
+    udp_confiable, que puede devolver varios mensajes juntos (o ninguno si era un ACK o un
+    fragmento)"""
+    recibido = time.perf_counter()
+    metricas.bytes_entrada.inc(len(data), ("udp",))
+    if nucleo.usuarios.en(addr) is not None:
+        """cualquier datagrama (tambien un ACK o un PING) cuenta como actividad"""
+        presentes.tocar(addr)
+    mensajes = canal.procesar(data, addr)
+    if mensajes is None:
+        mensajes = [data]
+    else:
+        confiables.add(addr)
+    for datos in mensajes:
+        metricas.mensajes_recibidos.inc(1, ("udp",))
+        if limitado(addr):
+            continue
+        """el cliente que quiere registros compactos manda binario.MAGIA antes de su nombre, y
+        antes de todo compresion.MAGIA si quiere los mensajes comprimidos"""
+        comprimir = datos.startswith(compresion.MAGIA)
+        if comprimir:
+            datos = datos[len(compresion.MAGIA):]
+        modo = nucleo.MODO_DATAGRAMA
+        if datos.startswith(binario.MAGIA):
+            datos, modo = datos[len(binario.MAGIA):], nucleo.MODO_DATAGRAMA_BINARIO
+        atender(server, datos.decode().strip(), addr, recibido, modo, comprimir)
 
-def main():
+
+def limitado(addr):
+    """Limite de ritmo antes de decodificar el mensaje (ver admision.py). Una direccion registrada
+    tiene el suyo y recibe un aviso; las demas solo tienen el de su IP y no se les contesta, para
+    no mandarle datagramas a una direccion que puede ser falsa"""
+    sesion = nucleo.usuarios.en(addr)
+    if sesion is not None:
+        return nucleo.limitar(sesion, sesion.limite, "udp")
+    if control.por_ip.tomar(addr[0]):
+        return False
+    metricas.limitados.inc(1, ("udp", "ip"))
+    return True
+
+
+def atender(server, texto, addr, recibido=None, modo=nucleo.MODO_DATAGRAMA, comprimir=False):
+    """Procesa un mensaje de un cliente: si la direccion no esta registrada el texto es el nombre
+    del usuario nuevo (y modo y comprimir los de su sesion); si no, PING y SALIR se atienden aca y el resto lo
+    procesa el nucleo"""
+    sesion = nucleo.usuarios.en(addr)
+    if sesion is None:
+
+        """un PING de una direccion que no esta registrada es de una sesion que ya se expulso por
+        inactividad; un SALIR de alguien que ya no esta se ignora"""
+        if texto == presencia.PING:
+            enviar(server, presencia.EXPIRADA.encode(), addr)
+            return
+        if texto == presencia.SALIR:
+            return
+
+        if not control.cubeta.tomar():
+            enviar(server, b"[ERROR] Servidor ocupado, intenta registrarte de nuevo en unos segundos", addr)
+            return
+
+        """el nucleo verifica el limite de usuarios y que el nombre no exista en ningun transporte.
+        Un cliente que se reconecta puede mandar su token en lugar del nombre (ver reanudacion.py)"""
+        nombre, reanudar = reanudacion.leer_pedido(texto)
+        sesion = SesionUDP(server, addr, nombre, modo, comprimir)
+        rechazo = nucleo.registrar(nombre, sesion, reanudar, direccion=addr)
+        if rechazo is not None:
+            nucleo.enviar(sesion, rechazo)
+            return
+        presentes.tocar(addr)
+        print(f"[UDP] {nombre} conectado desde {addr}")
+        return
+
+    """PING solo mantiene viva la sesion (ya se actualizo en recibir), SALIR la cierra"""
+    if texto == presencia.PING:
+        metricas.comandos.inc(1, ("ping",))
+        return
+    if texto == presencia.SALIR:
+        metricas.comandos.inc(1, ("salir",))
+        quitar(addr, "se desconecto")
+        return
+    if texto.startswith(reanudacion.COMANDO + " "):
+        """un pedido de reanudar repetido (el cliente no vio la respuesta al primero), no es un
+        mensaje para la sala"""
+        return
+    if texto.split(" ", 1)[0] == "/history":
+        consultas.put((sesion, texto, recibido))
+        return
+
+    nucleo.procesar(sesion, sesion.nombre, texto, recibido)
+
+
+def hilo_consultas():
+    """Atiende los /history de a uno, fuera del bucle de recepcion"""
+    while True:
+        sesion, texto, recibido = consultas.get()
+        try:
+            nucleo.procesar(sesion, sesion.nombre, texto, recibido)
+        except Exception as e:
+            metricas.errores.inc(1, (type(e).__name__,))
+
+
+def quitar(addr, motivo):
+    """Borra a un usuario del nucleo (que avisa a todos) y de las estructuras de UDP: presencia y
+    capa confiable"""
+    sesion = nucleo.usuarios.en(addr)
+    if sesion is not None:
+        nucleo.salir(sesion, sesion.nombre)
+    presentes.olvidar(addr)
+    confiables.discard(addr)
+    canal.olvidar(addr)
+    print(f"[UDP] {sesion.nombre if sesion else None} {addr} {motivo}")
+
+
+def expulsar_inactivos():
+    for addr in presentes.vencidas():
+        quitar(addr, "expulsado por inactividad")
+
+
+def main(motor=None):
     """Crea el socket UDP donde AF_INET es para IPv4 y SOCK_DGRAM para UDP,
-    luego lo enlaza el socket a la direccion y puerto. En un ciclo infinito,
+    luego lo enlaza el socket a la direccion y puerto. En un ciclo,
     espera mensajes de los clientes, procesa mensajes privados o grupales, (siempre esta escuhando
-    mensajes)"""
+    mensajes) hasta que detener() cierre el servidor"""
+    global control, canal, presentes, salida, despertador, consultor
+    motor = motor or MOTOR
+    if motor not in MOTORES:
+        raise ValueError(f"Motor UDP desconocido: {motor} (opciones: {', '.join(MOTORES)})")
+    control = admision.ControlAdmision()
+    nucleo.iniciar("udp")
+    metricas.servir()
+    parada.clear()
+    if consultor is None:
+        consultor = threading.Thread(target=hilo_consultas, daemon=True)
+        consultor.start()
+    """si el supervisor lo reinicia despues de una caida, las sesiones del socket anterior ya no
+    sirven: se sacan del nucleo y los clientes se vuelven a registrar con su proximo mensaje"""
+    for addr in nucleo.usuarios.direcciones():
+        quitar(addr, "perdio la sesion por un reinicio del servidor")
     server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     server.bind((HOST, PORT))
-    
-    server.settimeout(1)
+    server.setblocking(False)
+    canal = udp_confiable.CanalConfiable(server, al_perder=perdido)
+    presentes = presencia.Presencia()
+    salida = None
+    despertador, lectura = socket.socketpair()
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    selector.register(lectura, selectors.EVENT_READ)
 
-    print(f"[UDP] Servidor escuchando en {HOST}:{PORT}")
+    print(f"[UDP] Servidor escuchando en {HOST}:{PORT} (motor {motor})")
 
     try:
-        while True:
-            """Bucle principal que espera mensajes de los clientes y los procesa"""
-            try:
-                data, addr = server.recvfrom(4096)
-            except socket.timeout:
-                continue
-            texto = data.decode().strip()
-
-            """Si la direccion del cliente no esta en el diccionario de usuarios, se asume que es un nuevo usuario
-            y se agrega al diccionario con su nombre."""
-            if addr not in usuarios:
-                
-                if len(usuarios) >= 5:
-                    server.sendto(b"[ERROR] Servidor lleno. Maximo 5 usuarios.", addr)
-                    continue
-                
-                usuarios[addr] = texto
-                usuariosPorNombre[texto] = addr
-                print(f"[UDP] {texto} conectado desde {addr}")
-                continue
+        if motor == "lotes":
+            envio = bucle_lotes(server, selector, lectura)
+        else:
+            envio = bucle(server, selector, lectura, 1)
+        if parada.is_set():
+            drenar(server, selector, envio)
+    finally:
+        selector.close()
+        lectura.close()
+        despertador.close()
+        despertador = None
+        canal.cerrar()
+        server.close()
 
-            #para obtener el nombre del usuario que envio el mensaje
-            nombre = usuarios[addr]
 
-        
-            
-            """Obtiene la fecha y hora actual en formato dia/mes/año horas:minutos:segundos AM/PM"""
-            fecha = datetime.datetime.now().strftime("%d/%m/%Y %I:%M:%S %p")
-            
-            """para mensajes privados se verifica si el mensaje empieza con /priv, despues se separa el destinatario y el contenido
-            se verifica si el destinatario existe, si no existe se envia un mensaje de error al remitente"""
-            if texto.startswith("/priv"):
-                _, destino, *contenido = texto.split()
-                contenido = " ".join(contenido)
+def bucle(server, selector, lectura, lote):
+    """Bucle principal: el selector espera datagramas, el pedido de cierre (lectura) o el
+    proximo vencimiento de presencia, lo que llegue primero; sin sesiones bloquea sin timeout.
+    En cada despertar se leen hasta `lote` datagramas sin volver a bloquearse.
+    Un datagrama que no se puede atender (por ejemplo texto que no es UTF-8) se cuenta en
+    metricas.errores y se descarta, como hace server_tcp con su cliente: si saliera de aca el
+    supervisor reiniciaria el servidor y todas las sesiones se perderian"""
+    while not parada.is_set():
+        expulsar_inactivos()
+        for clave, _ in selector.select(timeout=presentes.proxima()):
+            if clave.fileobj is lectura:
+                lectura.recv(64)
+                continue
+            for _ in range(lote):
+                try:
+                    data, addr = server.recvfrom(4096)
+                except BlockingIOError:
+                    break
+                try:
+                    recibir(server, data, addr)
+                except Exception as e:
+                    metricas.errores.inc(1, (type(e).__name__,))
 
-                if destino not in usuariosPorNombre:
-                    server.sendto(f"[ERROR] Usuario '{destino}' no existe".encode(), addr)
-                    continue
 
-                addr_destino = usuariosPorNombre[destino]
+def bucle_lotes(server, selector, lectura):
+    """Como el motor simple pero leyendo hasta LOTE_RECEPCION datagramas por despertar; los
+    envios quedan en la cola salida para el hilo de envio. Devuelve ese hilo"""
+    global salida
+    salida = queue.SimpleQueue()
+    envio = threading.Thread(target=hilo_envio, args=(server,), daemon=True)
+    envio.start()
+    bucle(server, selector, lectura, LOTE_RECEPCION)
+    return envio
 
-                #enviar al destinatario
-                server.sendto(f"[PRIVADO de {nombre}] [Fecha:{fecha}] {contenido}".encode(), addr_destino)
-                #confirmar al remitente
-                server.sendto(f"[PRIVADO para {destino}] [Fecha:{fecha}] {contenido}".encode(), addr)
 
-                continue
+def detener():
+    """Pide el cierre del servidor desde otro hilo (lo llama el supervisor)"""
+    parada.set()
+    try:
+        despertador.send(b"x")
+    except (AttributeError, OSError):
+        pass
 
-            """Si no es priavdo significa que es un mensaje grupal"""
-            mensajeFinal = f"[{nombre}] [Fecha:{fecha}] {texto}"
 
-            """envia el mensaje a todos los clientes conectados excepto al remitente"""
-            for cliente in usuarios:
-                if cliente != addr:
-                    server.sendto(mensajeFinal.encode(), cliente)
-    except KeyboardInterrupt:
-        print("\nCerrando servidor UDP...")
-    finally:
-        server.close()
+def drenar(server, selector, envio):
+    """Cierre ordenado: se avisa a los usuarios, el hilo de envio (motor por lotes) termina de
+    mandar lo que tenia en la cola y se siguen leyendo ACKs hasta que los clientes confiables
+    confirmen todo, con un limite de supervisor.ESPERA_CIERRE segundos"""
+    nucleo.avisar_cierre()
+    fin = time.monotonic() + supervisor.ESPERA_CIERRE
+    if envio is not None:
+        salida.put(None)
+        envio.join(max(0.0, fin - time.monotonic()))
+    while canal.pendientes() and time.monotonic() < fin:
+        if not selector.select(timeout=0.05):
+            continue
+        try:
+            data, addr = server.recvfrom(4096)
+        except BlockingIOError:
+            continue
+        canal.procesar(data, addr)
+    print(f"[UDP] Servidor cerrado ({canal.pendientes()} mensajes sin confirmar)")
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Servidor UDP del chat")
+    parser.add_argument("--motor", choices=MOTORES, default=MOTOR)
+    parser.add_argument("--puerto", type=int, default=PORT)
+    parser.add_argument("--max-usuarios", type=int, default=admision.MAX_USUARIOS)
+    parser.add_argument("--registros-por-segundo", type=float, default=admision.ACEPTACIONES_POR_SEGUNDO)
+    parser.add_argument("--mensajes-por-segundo", type=float, default=admision.MENSAJES_POR_SEGUNDO)
+    parser.add_argument("--mensajes-por-segundo-ip", type=float, default=admision.MENSAJES_POR_SEGUNDO_IP)
+    parser.add_argument("--inactividad", type=float, default=presencia.INACTIVIDAD)
+    parser.add_argument("--metricas-puerto", type=int, default=metricas.PUERTO)
+    args = parser.parse_args()
+    metricas.PUERTO = args.metricas_puerto
+    PORT = args.puerto
+    admision.MAX_USUARIOS = args.max_usuarios
+    admision.ACEPTACIONES_POR_SEGUNDO = args.registros_por_segundo
+    admision.MENSAJES_POR_SEGUNDO = args.mensajes_por_segundo
+    admision.MENSAJES_POR_SEGUNDO_IP = args.mensajes_por_segundo_ip
+    presencia.INACTIVIDAD = args.inactividad
+    supervisor.Supervisor([supervisor.Servicio("udp", lambda: main(args.motor), detener)]).ejecutar()
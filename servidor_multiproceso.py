@@ -0,0 +1,201 @@
+"""Servidor TCP repartido en varios procesos. servidores.py corre todo en un solo proceso y el
+GIL lo limita a un nucleo; aca se arrancan N workers que comparten el puerto:
+- en Linux cada worker abre su propio socket con SO_REUSEPORT y el kernel reparte las conexiones
+- donde no existe SO_REUSEPORT el proceso principal abre el socket y se lo pasa a los workers
+
+Cada worker corre el motor con hilos de server_tcp y se comunica con los demas por un bus de
+multiprocessing.Queue (ver bus.py), asi los mensajes grupales, de sala, /priv y la presencia
+llegan a usuarios conectados en otros workers. /rooms y /colas muestran solo datos del worker
+propio. Dos usuarios con el mismo nombre que se conectan al mismo tiempo a workers distintos
+pueden quedar los dos registrados, porque el bus avisa la entrada despues de registrarla.
+
+Uso: python servidor_multiproceso.py --workers 4 [--puerto 5000]"""
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import threading
+import time
+
+import admision
+import archivos
+import bus
+import buzon
+import colas_envio
+import historial
+import metricas
+import nucleo
+import server_tcp
+import supervisor
+
+"""Cantidad de workers, 0 usa un worker por nucleo"""
+WORKERS = int(os.environ.get("CHAT_WORKERS_TCP", "0"))
+
+
+def crear_socket(host, port, reuseport):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((host, port))
+    server.listen()
+    return server
+
+
+def configuracion(workers):
+    """Copia la configuracion del proceso principal para los workers (con el metodo spawn los
+    modulos se vuelven a importar y perderian lo que se cambio por argumentos). El ritmo de
+    aceptacion y el de mensajes por IP se reparten entre los workers (las conexiones de una IP
+    caen en cualquiera); el de cada usuario no, porque esta en un solo worker. El maximo de
+    usuarios es global porque cada worker suma los usuarios remotos que conoce por el bus"""
+    return {
+        "max_usuarios": admision.MAX_USUARIOS,
+        "max_conexiones": admision.MAX_CONEXIONES,
+        "aceptaciones_por_segundo": admision.ACEPTACIONES_POR_SEGUNDO / workers,
+        "mensajes_por_segundo": admision.MENSAJES_POR_SEGUNDO,
+        "mensajes_por_segundo_ip": admision.MENSAJES_POR_SEGUNDO_IP / workers,
+        "tamano_cola": colas_envio.TAMANO_COLA,
+        "politica_cola": colas_envio.POLITICA,
+        "historial": historial.DIRECTORIO,
+        "buzon": buzon.DIRECTORIO,
+        "archivos": archivos.DIRECTORIO,
+        "metricas": metricas.PUERTO,
+    }
+
+
+def worker(id_worker, colas, server, host, port, config):
+    """Punto de entrada de cada proceso worker"""
+    admision.MAX_USUARIOS = config["max_usuarios"]
+    admision.MAX_CONEXIONES = config["max_conexiones"]
+    admision.ACEPTACIONES_POR_SEGUNDO = config["aceptaciones_por_segundo"]
+    admision.MENSAJES_POR_SEGUNDO = config["mensajes_por_segundo"]
+    admision.MENSAJES_POR_SEGUNDO_IP = config["mensajes_por_segundo_ip"]
+    colas_envio.TAMANO_COLA = config["tamano_cola"]
+    colas_envio.POLITICA = config["politica_cola"]
+    """cada worker guarda su propio historial (con los mensajes de todas las salas, tambien los
+    que llegan por el bus) para no escribir todos en los mismos segmentos"""
+    historial.DIRECTORIO = os.path.join(config["historial"], f"worker-{id_worker}")
+    """el buzon de los usuarios desconectados y los archivos subidos son comunes: un buzon se vacia
+    en el worker donde se vuelve a conectar su usuario y un archivo se baja desde cualquier worker"""
+    buzon.DIRECTORIO = config["buzon"]
+    archivos.DIRECTORIO = config["archivos"]
+    """cada worker expone sus metricas en el puerto siguiente al configurado (worker 0 en +1)"""
+    metricas.PUERTO = config["metricas"] + 1 + id_worker if config["metricas"] else 0
+
+    if server is None:
+        server = crear_socket(host, port, reuseport=True)
+    server_tcp.HOST, server_tcp.PORT = host, port
+    nucleo.bus = bus.BusProcesos(id_worker, colas)
+    nucleo.bus.escuchar(nucleo.recibir_evento)
+    """el proceso principal cierra los workers con SIGTERM, y Ctrl+C en la terminal le llega a
+    todo el grupo: en los dos casos el worker hace el cierre ordenado de server_tcp"""
+    signal.signal(signal.SIGTERM, lambda *_: server_tcp.detener())
+    signal.signal(signal.SIGINT, lambda *_: server_tcp.detener())
+    print(f"[TCP] Worker {id_worker} (pid {os.getpid()}) listo")
+    server_tcp.main("hilos", server)
+
+
+"""Estado de los workers para el reporte de salud: pid, reinicios y si esta vivo"""
+procesos = []
+reinicios = []
+
+"""detener() marca la parada y despierta a main(), que espera en los sentinel de los procesos"""
+parada = threading.Event()
+despertador = None
+
+
+def main(workers=None, host=None, port=None):
+    """Arranca los workers y los supervisa: si uno termina sin que se haya pedido el cierre se
+    avisa a los demas por el bus (para que olviden a sus usuarios) y se lo vuelve a arrancar.
+    Vuelve despues de que detener() cierre todos los workers"""
+    global despertador
+    workers = workers or WORKERS or os.cpu_count()
+    host = host or server_tcp.HOST
+    port = port or server_tcp.PORT
+    reuseport = hasattr(socket, "SO_REUSEPORT")
+    compartido = None if reuseport else crear_socket(host, port, reuseport=False)
+
+    colas = [multiprocessing.Queue() for _ in range(workers)]
+    config = configuracion(workers)
+
+    def lanzar(i):
+        proceso = multiprocessing.Process(target=worker, args=(i, colas, compartido, host, port, config), daemon=True)
+        proceso.start()
+        return proceso
+
+    parada.clear()
+    metricas.servir()
+    despertador, lectura = socket.socketpair()
+    procesos[:] = [lanzar(i) for i in range(workers)]
+    reinicios[:] = [0] * workers
+    arranques = [time.monotonic()] * workers
+    esperas = [supervisor.REINICIO_MINIMO] * workers
+    modo = "SO_REUSEPORT" if reuseport else "socket compartido"
+    print(f"[TCP] {workers} workers escuchando en {host}:{port} ({modo})")
+
+    try:
+        while not parada.is_set():
+            listos = multiprocessing.connection.wait([p.sentinel for p in procesos] + [lectura])
+            for i, proceso in enumerate(procesos):
+                if parada.is_set() or proceso.sentinel not in listos:
+                    continue
+                proceso.join()
+                print(f"[TCP] Worker {i} (pid {proceso.pid}) termino con codigo {proceso.exitcode}, se reinicia")
+                for j, cola in enumerate(colas):
+                    if j != i:
+                        cola.put(("caido", i))
+                """si se cae enseguida de arrancar se espera cada vez mas antes de reintentar"""
+                if time.monotonic() - arranques[i] < supervisor.ESTABLE:
+                    if parada.wait(esperas[i]):
+                        break
+                    esperas[i] = min(esperas[i] * 2, supervisor.REINICIO_MAXIMO)
+                else:
+                    esperas[i] = supervisor.REINICIO_MINIMO
+                procesos[i] = lanzar(i)
+                arranques[i] = time.monotonic()
+                reinicios[i] += 1
+    finally:
+        """SIGTERM a todos juntos (cada uno hace su cierre ordenado) y se espera hasta que terminen"""
+        for proceso in procesos:
+            if proceso.is_alive():
+                proceso.terminate()
+        fin = time.monotonic() + supervisor.ESPERA_CIERRE + 1
+        for proceso in procesos:
+            proceso.join(max(0.0, fin - time.monotonic()))
+            if proceso.is_alive():
+                proceso.kill()
+        lectura.close()
+        despertador.close()
+        despertador = None
+
+
+def detener():
+    parada.set()
+    try:
+        despertador.send(b"x")
+    except (AttributeError, OSError):
+        pass
+
+
+def salud():
+    return [{"worker": i, "pid": p.pid, "vivo": p.is_alive(), "reinicios": reinicios[i]}
+            for i, p in enumerate(procesos)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor TCP del chat con varios procesos")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--puerto", type=int, default=server_tcp.PORT)
+    parser.add_argument("--max-usuarios", type=int, default=admision.MAX_USUARIOS)
+    parser.add_argument("--max-conexiones", type=int, default=admision.MAX_CONEXIONES)
+    parser.add_argument("--mensajes-por-segundo", type=float, default=admision.MENSAJES_POR_SEGUNDO)
+    parser.add_argument("--mensajes-por-segundo-ip", type=float, default=admision.MENSAJES_POR_SEGUNDO_IP)
+    args = parser.parse_args()
+    admision.MAX_USUARIOS = args.max_usuarios
+    admision.MAX_CONEXIONES = args.max_conexiones
+    admision.MENSAJES_POR_SEGUNDO = args.mensajes_por_segundo
+    admision.MENSAJES_POR_SEGUNDO_IP = args.mensajes_por_segundo_ip
+    supervisor.Supervisor([supervisor.Servicio("tcp", lambda: main(args.workers, port=args.puerto),
+                                               detener, salud)]).ejecutar()
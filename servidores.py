@@ -1,25 +1,40 @@
-import threading
+import argparse
+import metricas
+import nucleo
 import server_tcp
 import server_udp
+import servidor_multiproceso
+import supervisor
 
 def main():
-    # Hilo para servidor TCP
-    hilo_tcp = threading.Thread(target=server_tcp.main, daemon=True)
-    
-    # Hilo para servidor UDP
-    hilo_udp = threading.Thread(target=server_udp.main, daemon=True)
+    # TCP y UDP comparten el registro de usuarios, las salas y el historial (ver nucleo.py); se
+    # inicia aca para que el historial comun no dependa de cual de los dos hilos arranca primero
+    nucleo.iniciar("chat")
+    # Metricas de los dos servidores en http://127.0.0.1:<CHAT_METRICAS_PUERTO>/metrics y su
+    # estado en /salud (ver metricas.py y supervisor.py)
+    metricas.servir()
 
-    hilo_tcp.start()
-    hilo_udp.start()
+    # Servidor TCP. Con CHAT_WORKERS_TCP > 1 el TCP se reparte en varios procesos
+    # (ver servidor_multiproceso.py) y este servicio solo los supervisa
+    if servidor_multiproceso.WORKERS > 1:
+        tcp = supervisor.Servicio("tcp", servidor_multiproceso.main, servidor_multiproceso.detener,
+                                  servidor_multiproceso.salud)
+    else:
+        tcp = supervisor.Servicio("tcp", server_tcp.main, server_tcp.detener)
+
+    # Servidor UDP
+    udp = supervisor.Servicio("udp", server_udp.main, server_udp.detener)
 
     print("Servidores TCP y UDP corriendo simultáneamente...\nPresiona CTRL+C para detener.")
 
-    try:
-        # Mantener el programa principal vivo
-        while True:
-            pass
-    except KeyboardInterrupt:
-        print("\nCerrando servidores...")
+    # El supervisor corre cada servidor en su hilo, los reinicia si se caen y deja el hilo
+    # principal bloqueado esperando Ctrl+C o SIGTERM (sin gastar CPU); al cerrar cada servidor
+    # avisa a los usuarios y manda lo pendiente antes de terminar
+    supervisor.Supervisor([tcp, udp]).ejecutar()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidores TCP y UDP del chat")
+    parser.add_argument("--metricas-puerto", type=int, default=metricas.PUERTO)
+    args = parser.parse_args()
+    metricas.PUERTO = args.metricas_puerto
     main()
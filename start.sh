@@ -5,5 +5,10 @@ python servidores.py &
 # 2. Esperamos unos segundos para asegurar que arranquen
 sleep 3
 
-# 3. Arrancamos la interfaz web
+# 3. Arrancamos la interfaz web. Con el motor TCP de hilos las sesiones TCP de la GUI comparten
+#    una sola conexion con el servidor (pasarela.py) en lugar de abrir un socket y un hilo por
+#    pestana; el motor asyncio no atiende pasarelas. CHAT_GUI_PASARELA=0 o 1 lo fuerza
+if [ "${CHAT_MOTOR_TCP:-hilos}" = "hilos" ]; then
+    export CHAT_GUI_PASARELA=${CHAT_GUI_PASARELA:-1}
+fi
 streamlit run app_gui.py --server.port $PORT --server.address 0.0.0.0
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""Supervisor de los servidores del chat. Corre cada servidor en su hilo y el hilo principal queda
+bloqueado esperando una senal (Ctrl+C o SIGTERM), sin gastar CPU.
+
+- Si el main() de un servidor termina o lanza una excepcion sin que se haya pedido el cierre,
+  se lo vuelve a arrancar despues de una espera que se duplica con cada caida seguida (de
+  REINICIO_MINIMO hasta REINICIO_MAXIMO segundos; vuelve al minimo si estuvo ESTABLE segundos
+  funcionando)
+- Al cerrar se llama al detener() de cada servidor, que deja de aceptar, avisa a los usuarios y
+  espera hasta ESPERA_CIERRE segundos a que se manden los mensajes pendientes
+- El estado de cada servidor (activo, reiniciando, detenido), sus reinicios y el ultimo error se
+  ven en /salud del servidor de metricas (ver metricas.py) y en chat_servidor_activo"""
+import json
+import os
+import signal
+import threading
+import time
+import traceback
+
+import metricas
+
+ESPERA_CIERRE = float(os.environ.get("CHAT_ESPERA_CIERRE", "5"))
+REINICIO_MINIMO = 1.0
+REINICIO_MAXIMO = 30.0
+ESTABLE = 60.0
+
+
+class Servicio:
+    """Un servidor supervisado. arrancar() bloquea mientras el servidor corre y vuelve cuando se
+    cerro; detener() le pide que se cierre (lo llama el hilo del supervisor). detalle() es
+    opcional y agrega informacion propia del servidor al reporte de salud"""
+
+    def __init__(self, nombre, arrancar, detener, detalle=None):
+        self.nombre = nombre
+        self.arrancar = arrancar
+        self.detener = detener
+        self.detalle = detalle
+        self.estado = "iniciando"
+        self.reinicios = 0
+        self.ultimo_error = None
+        self.desde = time.monotonic()
+        self.hilo = None
+
+    def salud(self):
+        datos = {
+            "estado": self.estado, "reinicios": self.reinicios, "ultimo_error": self.ultimo_error,
+            "segundos_en_estado": round(time.monotonic() - self.desde, 1),
+        }
+        if self.detalle is not None:
+            datos["detalle"] = self.detalle()
+        return datos
+
+    def _cambiar(self, estado):
+        self.estado = estado
+        self.desde = time.monotonic()
+
+
+class Supervisor:
+    def __init__(self, servicios):
+        self.servicios = servicios
+        self.parada = threading.Event()
+        metricas.rutas["/salud"] = (self.reporte, "application/json")
+        metricas.Medidor("chat_servidor_activo", "1 si el servidor esta funcionando",
+                         lambda: {(s.nombre,): int(s.estado == "activo") for s in self.servicios}, ("servidor",))
+        metricas.Medidor("chat_servidor_reinicios", "Veces que se reinicio el servidor despues de una caida",
+                         lambda: {(s.nombre,): s.reinicios for s in self.servicios}, ("servidor",))
+
+    def reporte(self):
+        return json.dumps({s.nombre: s.salud() for s in self.servicios}, indent=2) + "\n"
+
+    def _vigilar(self, servicio):
+        """Hilo de cada servicio: lo arranca y lo vuelve a arrancar mientras no se pida el cierre"""
+        espera = REINICIO_MINIMO
+        while not self.parada.is_set():
+            servicio._cambiar("activo")
+            inicio = time.monotonic()
+            try:
+                servicio.arrancar()
+                if self.parada.is_set():
+                    break
+                servicio.ultimo_error = "termino sin que se pidiera el cierre"
+            except Exception as e:
+                servicio.ultimo_error = f"{type(e).__name__}: {e}"
+                traceback.print_exc()
+            if time.monotonic() - inicio >= ESTABLE:
+                espera = REINICIO_MINIMO
+            servicio._cambiar("reiniciando")
+            servicio.reinicios += 1
+            print(f"[SUPERVISOR] {servicio.nombre} se cayo ({servicio.ultimo_error}), reinicio en {espera:.0f}s")
+            if self.parada.wait(espera):
+                break
+            espera = min(espera * 2, REINICIO_MAXIMO)
+        servicio._cambiar("detenido")
+
+    def detener(self, *_):
+        """Manejador de SIGINT/SIGTERM: solo despierta al hilo principal"""
+        self.parada.set()
+
+    def ejecutar(self):
+        """Arranca los servicios y bloquea hasta que llegue una senal de cierre; despues los
+        cierra ordenadamente. Tiene que llamarse desde el hilo principal (por las senales)"""
+        signal.signal(signal.SIGINT, self.detener)
+        signal.signal(signal.SIGTERM, self.detener)
+        for servicio in self.servicios:
+            servicio.hilo = threading.Thread(target=self._vigilar, args=(servicio,), daemon=True)
+            servicio.hilo.start()
+
+        """Event.wait sin timeout no consume CPU y las senales lo interrumpen para correr el
+        manejador, que marca la parada"""
+        self.parada.wait()
+        print("\nCerrando servidores...")
+        for servicio in self.servicios:
+            servicio._cambiar("cerrando")
+            try:
+                servicio.detener()
+            except Exception:
+                traceback.print_exc()
+        fin = time.monotonic() + ESPERA_CIERRE + 1
+        for servicio in self.servicios:
+            servicio.hilo.join(max(0.0, fin - time.monotonic()))
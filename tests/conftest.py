@@ -0,0 +1,100 @@
+"""Configuracion comun de las pruebas: los modulos se importan desde la raiz del repositorio y
+el historial, los buzones y los archivos van a un directorio temporal, asi las pruebas no tocan
+los del servidor"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+DATOS = tempfile.mkdtemp(prefix="chat-pruebas-")
+os.environ["CHAT_HISTORIAL_DIR"] = DATOS
+os.environ["CHAT_BUZON_DIR"] = os.path.join(DATOS, "buzon")
+os.environ["CHAT_ARCHIVOS_DIR"] = os.path.join(DATOS, "archivos")
+os.environ["CHAT_METRICAS_PUERTO"] = "0"
+os.environ.setdefault("CHAT_MAX_USUARIOS", "50")
+
+import admision  # noqa: E402
+import nucleo  # noqa: E402
+import padron  # noqa: E402
+import salas  # noqa: E402
+import server_tcp  # noqa: E402
+
+HOST = "127.0.0.1"
+
+
+def puerto_libre(tipo=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, tipo) as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def esperar_puerto(port, timeout=5):
+    """Espera a que el servidor escuche en port. Se prueba ocupar el puerto (con SO_REUSEADDR,
+    que solo falla si ya hay alguien escuchando) en lugar de conectarse, asi no se le abre una
+    conexion que despues tendria que atender"""
+    fin = time.monotonic() + timeout
+    while time.monotonic() < fin:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                s.bind((HOST, port))
+            except OSError:
+                return
+        time.sleep(0.02)
+    raise TimeoutError(f"el servidor no abrio el puerto {port}")
+
+
+@pytest.fixture(params=server_tcp.MOTORES)
+def servidor_tcp(request, monkeypatch):
+    """Levanta server_tcp con cada motor en un puerto libre y devuelve el puerto. Cada prueba
+    empieza con el registro de usuarios y las salas vacios"""
+    yield from levantar_tcp(request.param, monkeypatch)
+
+
+@pytest.fixture(params=server_tcp.MOTORES)
+def servidor_tcp_ritmo(request, monkeypatch):
+    """Como servidor_tcp pero aceptando 10 conexiones por segundo"""
+    monkeypatch.setattr(admision, "ACEPTACIONES_POR_SEGUNDO", 10.0)
+    yield from levantar_tcp(request.param, monkeypatch)
+
+
+def levantar_tcp(motor, monkeypatch):
+    """Arranca server_tcp.main en un hilo, da el puerto y lo detiene al terminar la prueba"""
+    import cliente_tcp
+
+    port = puerto_libre()
+    monkeypatch.setattr(server_tcp, "PORT", port)
+    monkeypatch.setattr(cliente_tcp, "SERVER_PORT", port)
+    nucleo.usuarios = padron.Padron()
+    nucleo.indice_salas = salas.IndiceSalas()
+    hilo = threading.Thread(target=server_tcp.main, args=(motor,), daemon=True)
+    hilo.start()
+    esperar_puerto(port)
+    yield port
+    server_tcp.detener()
+    hilo.join(10)
+
+
+@pytest.fixture
+def servidor_udp(monkeypatch):
+    """Levanta server_udp (motor simple) en un puerto libre y devuelve el puerto"""
+    import server_udp
+
+    port = puerto_libre(socket.SOCK_DGRAM)
+    monkeypatch.setattr(server_udp, "PORT", port)
+    nucleo.usuarios = padron.Padron()
+    nucleo.indice_salas = salas.IndiceSalas()
+    hilo = threading.Thread(target=server_udp.main, args=("simple",), daemon=True)
+    hilo.start()
+    while server_udp.despertador is None:
+        time.sleep(0.01)
+    yield port
+    server_udp.detener()
+    hilo.join(10)
@@ -0,0 +1,94 @@
+"""Control de admision (admision.py): cubetas de tokens, limites por IP y cupo de conexiones"""
+import pytest
+
+import admision
+
+
+def test_mirar_la_espera_no_gasta_el_token():
+    cubeta = admision.CubetaTokens(1.0)
+    assert cubeta.espera(gastar=False) == 0.0
+    assert cubeta.espera(gastar=False) == 0.0
+    assert cubeta.espera() == 0.0
+    assert cubeta.espera(gastar=False) > 0
+
+
+class Reloj:
+    """Reemplaza time.monotonic en admision para mover el tiempo a mano"""
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(admision.time, "monotonic", reloj)
+    return reloj
+
+
+def test_cubeta_gasta_la_rafaga_y_se_rellena_a_su_tasa(reloj):
+    cubeta = admision.CubetaTokens(2.0, capacidad=3)
+    assert all(cubeta.tomar() for _ in range(3))
+    assert not cubeta.tomar()
+    assert cubeta.espera(gastar=False) == pytest.approx(0.5)
+    reloj.ahora += 0.5
+    assert cubeta.tomar()
+    assert not cubeta.tomar()
+    """un rato largo sin usarla no junta mas que la capacidad"""
+    reloj.ahora += 60
+    assert all(cubeta.tomar() for _ in range(3))
+    assert not cubeta.tomar()
+
+
+def test_tasa_cero_no_limita():
+    cubeta = admision.CubetaTokens(0)
+    assert all(cubeta.tomar() for _ in range(1000))
+    assert cubeta.espera() == 0.0
+
+
+def test_cubetas_por_clave_son_independientes_y_se_limpian_las_llenas(reloj, monkeypatch):
+    monkeypatch.setattr(admision, "LIMPIEZA_CUBETAS", 2)
+    por_ip = admision.CubetasPorClave(1.0, 1)
+    assert por_ip.tomar("10.0.0.2")
+    reloj.ahora += 1
+    assert por_ip.tomar("10.0.0.1")
+    assert not por_ip.tomar("10.0.0.1")
+    """con dos cubetas la tercera IP dispara la limpieza: solo se borra la que ya se relleno"""
+    assert por_ip.tomar("10.0.0.3")
+    assert set(por_ip.cubetas) == {"10.0.0.1", "10.0.0.3"}
+
+
+def test_limite_de_mensajes_por_usuario_y_por_ip(reloj, monkeypatch):
+    monkeypatch.setattr(admision, "MENSAJES_POR_SEGUNDO", 1.0)
+    monkeypatch.setattr(admision, "RAFAGA_MENSAJES", 2.0)
+    monkeypatch.setattr(admision, "MENSAJES_POR_SEGUNDO_IP", 1.0)
+    monkeypatch.setattr(admision, "RAFAGA_MENSAJES_IP", 3.0)
+    control = admision.ControlAdmision()
+    ana = control.limite_mensajes("10.0.0.1")
+    beto = control.limite_mensajes("10.0.0.1")
+    otro = control.limite_mensajes("10.0.0.2")
+    assert ana.tomar() is None and ana.tomar() is None
+    assert ana.tomar() == "usuario"
+    """beto tiene su propia cubeta pero comparte la de la IP con ana"""
+    assert beto.tomar() is None
+    assert beto.tomar() == "ip"
+    assert otro.tomar() is None
+    """sin IP (por ejemplo UDP detras del mismo puerto) solo cuenta el limite de usuario"""
+    sin_ip = control.limite_mensajes(None)
+    assert sin_ip.tomar() is None and sin_ip.tomar() is None
+    assert sin_ip.tomar() == "usuario"
+
+
+def test_cupo_de_conexiones_y_de_usuarios():
+    control = admision.ControlAdmision(max_usuarios=2, max_conexiones=2)
+    assert control.entrar() and control.entrar()
+    assert not control.entrar()
+    control.salir()
+    assert control.entrar()
+    assert not control.lleno(1)
+    assert control.lleno(2)
+    assert control.rechazadas == 2
+    assert control.mensaje_lleno() == "Servidor lleno. Maximo 2 usuarios."
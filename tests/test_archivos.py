@@ -0,0 +1,81 @@
+"""Canal de archivos (archivos.py) con los dos motores de server_tcp"""
+import io
+import os
+
+import archivos
+import cliente_tcp
+from conftest import HOST
+
+
+def esperar_token(cliente):
+    while cliente.token is None:
+        assert cliente.recibir_registro() is not None
+
+
+def test_subida_avisa_al_destinatario(servidor_tcp):
+    ana = cliente_tcp.ClienteTCP(modo="binario")
+    beto = cliente_tcp.ClienteTCP(modo="binario")
+    try:
+        assert ana.conectar("ana")[0]
+        assert beto.conectar("beto")[0]
+        esperar_token(ana)
+        esperar_token(beto)
+
+        contenido = os.urandom(200 * 1024)
+        exito, info = ana.enviar_archivo("beto", io.BytesIO(contenido), "datos.bin")
+        assert exito, info
+
+        beto.sock.settimeout(5)
+        registro = beto.recibir_registro()
+        while registro is not None and archivos.leer_aviso(registro.contenido) is None:
+            registro = beto.recibir_registro()
+        assert registro is not None, "no llego el aviso del archivo"
+        assert registro.remitente == "ana"
+        id_archivo, tamano, nombre = archivos.leer_aviso(registro.contenido)
+        assert (tamano, nombre) == (len(contenido), "datos.bin")
+
+        bajado = io.BytesIO()
+        archivos.bajar(HOST, servidor_tcp, id_archivo, bajado)
+        assert bajado.getvalue() == contenido
+    finally:
+        ana.cerrar()
+        beto.cerrar()
+
+
+def test_sesion_de_pasarela_sube_con_su_token(monkeypatch):
+    """la sesion binaria de la pasarela sube por una conexion directa con su propio token"""
+    import pasarela
+    from conftest import levantar_tcp
+
+    servidor = levantar_tcp("hilos", monkeypatch)
+    port = next(servidor)
+    compartida = pasarela.PasarelaCompartida(HOST, port)
+    dario = cliente_tcp.ClienteTCP(modo="binario")
+    sesion = None
+    try:
+        sin_token = compartida.actual().abrir()
+        assert sin_token.conectar("texto")[0]
+        assert not sin_token.enviar_archivo("dario", io.BytesIO(b"x"), "x.txt")[0]
+        sin_token.cerrar()
+
+        sesion = compartida.actual().abrir(binario=True)
+        assert sesion.conectar("carla")[0]
+        assert dario.conectar("dario")[0]
+        while sesion.token is None:
+            assert sesion.recibir_mensaje() is not None
+        esperar_token(dario)
+        exito, info = sesion.enviar_archivo("dario", io.BytesIO(b"hola"), "hola.txt")
+        assert exito, info
+
+        dario.sock.settimeout(5)
+        registro = dario.recibir_registro()
+        while registro is not None and archivos.leer_aviso(registro.contenido) is None:
+            registro = dario.recibir_registro()
+        assert registro is not None and registro.remitente == "carla"
+        assert archivos.leer_aviso(registro.contenido)[1:] == (4, "hola.txt")
+    finally:
+        dario.cerrar()
+        if sesion is not None:
+            sesion.cerrar()
+        compartida.actual().cerrar()
+        next(servidor, None)
@@ -0,0 +1,43 @@
+"""Registros del formato compacto (binario.py)"""
+import pytest
+
+import binario
+
+
+@pytest.mark.parametrize("registro", [
+    binario.Registro(binario.GRUPAL, 1700000000, "ana", "", "hola", id=12),
+    binario.Registro(binario.GRUPAL, 1700000000, "ñandú", "café", "acentos y emoji 🎉", id=2 ** 32 - 1),
+    binario.Registro(binario.PRIVADO, 1700000000, "beto", contenido=""),
+    binario.Registro(binario.SESION, 0, contenido="123.abcdef"),
+])
+def test_ida_y_vuelta(registro):
+    leido = binario.decodificar(registro.codificar())
+    assert (leido.tipo, leido.fecha, leido.remitente, leido.sala, leido.contenido, leido.id) == \
+           (registro.tipo, registro.fecha, registro.remitente, registro.sala, registro.contenido, registro.id)
+    assert leido.texto() == registro.texto()
+
+
+def test_remitente_largo_se_corta_entre_caracteres():
+    """"ñ" ocupa dos bytes: 128 son 256 bytes y cortar en 255 partiria el ultimo"""
+    registro = binario.Registro(binario.GRUPAL, 0, "ñ" * 128, "é" * 200, "sigue")
+    datos = registro.codificar()
+    leido = binario.decodificar(datos)
+    assert leido.remitente == "ñ" * 127
+    assert leido.sala == "é" * 127
+    assert leido.contenido == "sigue"
+    assert "�" not in leido.remitente + leido.sala
+
+
+def test_texto_suelto_no_es_registro():
+    with pytest.raises(binario.ErrorRegistro):
+        binario.decodificar(b"[ERROR] Usuario ya existe\n")
+    leido = binario.leer(b"[ERROR] Usuario ya existe\n")
+    assert (leido.tipo, leido.contenido) == (binario.ERROR, "Usuario ya existe")
+
+
+def test_desde_texto_reconoce_grupales_y_privados():
+    registro = binario.Registro(binario.GRUPAL, 1700000000, "ana", "juegos", "hola")
+    assert binario.desde_texto(registro.texto()).sala == "juegos"
+    privado = binario.Registro(binario.PRIVADO, 1700000000, "beto", contenido="secreto")
+    leido = binario.desde_texto(privado.texto())
+    assert (leido.tipo, leido.remitente, leido.contenido, leido.fecha) == (binario.PRIVADO, "beto", "secreto", 1700000000)
@@ -0,0 +1,28 @@
+"""Buzon de mensajes diferidos (buzon.py) con errores de disco"""
+import os
+import queue
+
+import buzon
+import metricas
+
+
+def recibir(buzon_, nombre):
+    llegada = queue.SimpleQueue()
+    buzon_.entregar(nombre, llegada.put)
+    return llegada.get(timeout=5)
+
+
+def test_error_de_disco_no_corta_el_hilo(tmp_path):
+    b = buzon.Buzon(str(tmp_path))
+    errores = metricas.errores.valor(("IsADirectoryError",))
+    """el archivo del buzon de roto es un directorio: ni se puede escribir ni leer"""
+    os.mkdir(b._ruta("roto"))
+    b.guardar("roto", "perdido\n")
+    b.guardar("ana", "primero\n")
+    assert recibir(b, "ana") == ["primero\n"]
+
+    b.entregar("roto", lambda textos: None)
+    b.guardar("ana", "segundo\n")
+    assert recibir(b, "ana") == ["segundo\n"]
+    assert b.hilo.is_alive()
+    assert metricas.errores.valor(("IsADirectoryError",)) >= errores + 2
@@ -0,0 +1,65 @@
+"""Compresion negociada por conexion (compresion.py)"""
+import os
+import zlib
+
+import pytest
+
+import compresion
+
+LARGO = "[ana] [Fecha:18/10/2026 04:53:06 PM] un mensaje que se repite bastante\n".encode() * 5
+
+
+def test_suelto_ida_y_vuelta():
+    comprimido = compresion.comprimir(LARGO)
+    assert comprimido[0] == compresion.SUELTO
+    assert len(comprimido) < len(LARGO)
+    """se abre sin estado: cualquier descompresor, en cualquier orden"""
+    assert compresion.Descompresor().abrir(comprimido) == LARGO
+    assert compresion.Descompresor().abrir(comprimido) == LARGO
+
+
+def test_chico_o_que_no_se_achica_va_sin_comprimir():
+    assert compresion.comprimir(b"hola") is None
+    assert compresion.comprimir(os.urandom(512)) is None
+    assert compresion.Descompresor().abrir(b"[ana] hola\n") is None
+    assert compresion.Descompresor().abrir(b"") is None
+
+
+def test_flujo_ida_y_vuelta_con_contexto_compartido():
+    flujo = compresion.Flujo()
+    descompresor = compresion.Descompresor()
+    mensajes = [f"[beto] [Fecha:18/10/2026 04:53:0{i} PM] mensaje {i}\n".encode() for i in range(10)]
+    comprimidos = [flujo.comprimir(m) for m in mensajes]
+    assert all(c[0] == compresion.FLUJO for c in comprimidos)
+    """los siguientes aprovechan lo que ya paso por el contexto"""
+    assert len(comprimidos[-1]) < len(comprimidos[0])
+    assert [descompresor.abrir(c) for c in comprimidos] == mensajes
+    assert flujo.comprimir(b"corto") is None
+
+
+def test_flujo_y_sueltos_mezclados():
+    flujo = compresion.Flujo()
+    descompresor = compresion.Descompresor()
+    assert descompresor.abrir(flujo.comprimir(LARGO)) == LARGO
+    assert descompresor.abrir(compresion.comprimir(LARGO)) == LARGO
+    assert descompresor.abrir(flujo.comprimir(LARGO[::-1])) == LARGO[::-1]
+
+
+def test_datos_alterados_no_se_abren():
+    comprimido = bytearray(compresion.comprimir(LARGO))
+    comprimido[len(comprimido) // 2] ^= 0xFF
+    """si el cambio cae en un literal deflate puede abrirlo, pero nunca da lo original"""
+    try:
+        abierto = compresion.Descompresor().abrir(bytes(comprimido))
+    except zlib.error:
+        return
+    assert abierto != LARGO
+
+
+def test_flujo_sin_el_mensaje_anterior_no_se_abre():
+    flujo = compresion.Flujo()
+    flujo.comprimir(LARGO)
+    segundo = flujo.comprimir(LARGO)
+    """el segundo apunta a lo que dejo el primero en el contexto"""
+    with pytest.raises(zlib.error):
+        compresion.Descompresor().abrir(segundo)
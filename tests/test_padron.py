@@ -0,0 +1,36 @@
+"""Padron de usuarios (padron.py): altas, bajas, reemplazos y la foto de los broadcast"""
+import pytest
+
+import padron
+
+
+def test_alta_baja_y_foto():
+    p = padron.Padron()
+    ana, beto = object(), object()
+    p.agregar("ana", ana)
+    p.agregar("beto", beto, ("10.0.0.1", 5))
+    with pytest.raises(padron.NombreOcupado):
+        p.agregar("ana", object())
+    foto = p.sesiones()
+    assert set(foto) == {ana, beto}
+    assert p.sesiones() is foto
+    assert p.en(("10.0.0.1", 5)) is beto
+
+    assert not p.quitar("ana", beto)
+    assert p.quitar("beto", beto)
+    assert not p.quitar("beto", beto)
+    assert p.en(("10.0.0.1", 5)) is None
+    assert dict(p.foto()) == {"ana": ana}
+
+
+def test_la_baja_de_la_sesion_reemplazada_no_saca_a_la_nueva():
+    p = padron.Padron()
+    vieja, nueva = object(), object()
+    p.agregar("ana", vieja, ("10.0.0.1", 1))
+    assert p.agregar("ana", nueva, ("10.0.0.1", 2), reemplazar=True) is vieja
+    assert not p.quitar("ana", vieja)
+    assert p.sesion("ana") is nueva
+    assert p.en(("10.0.0.1", 1)) is None
+    assert p.en(("10.0.0.1", 2)) is nueva
+    assert p.sesiones() == (nueva,)
+    assert p.agregar("beto", object(), reemplazar=True) is None
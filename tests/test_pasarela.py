@@ -0,0 +1,156 @@
+"""Pasarela de la GUI (pasarela.py) contra los dos motores de server_tcp"""
+import queue
+import time
+
+import binario
+import pasarela
+import reanudacion
+from conftest import HOST
+
+
+def test_pasarela_o_rechazo_rapido(servidor_tcp):
+    """con hilos la sesion entra por la pasarela; con asyncio el servidor la corta y la GUI se
+    entera enseguida (pasarela inactiva), para conectarse directo"""
+    import server_tcp
+
+    compartida = pasarela.Pasarela(HOST, servidor_tcp)
+    recibidos = queue.SimpleQueue()
+    inicio = time.monotonic()
+    try:
+        sesion = compartida.abrir(recibidos.put)
+        exito, info = sesion.conectar("ana")
+    except ConnectionResetError:
+        exito = False
+    try:
+        if server_tcp.motor_activo == "hilos":
+            assert exito, info
+            """antes del aviso de entrada puede venir el historial"""
+            while "ana se unio" not in recibidos.get(timeout=5):
+                pass
+        else:
+            assert not exito
+            assert not compartida.activa
+            assert time.monotonic() - inicio < pasarela.SesionPasarela.ESPERA_PROMPT
+    finally:
+        compartida.cerrar()
+
+
+def test_sesiones_de_la_pasarela_comparten_el_limite_por_ip(monkeypatch):
+    """varias sesiones por una misma pasarela gastan la cubeta de la IP de la pasarela"""
+    import admision
+    import metricas
+    from conftest import levantar_tcp
+
+    monkeypatch.setattr(admision, "MENSAJES_POR_SEGUNDO_IP", 1.0)
+    monkeypatch.setattr(admision, "RAFAGA_MENSAJES_IP", 5.0)
+    servidor = levantar_tcp("hilos", monkeypatch)
+    port = next(servidor)
+    compartida = pasarela.Pasarela(HOST, port)
+    try:
+        antes = metricas.limitados.valor(("tcp", "ip"))
+        recibidos = [queue.SimpleQueue() for _ in range(3)]
+        sesiones = [compartida.abrir(cola.put) for cola in recibidos]
+        for i, sesion in enumerate(sesiones):
+            assert sesion.conectar(f"flood{i}")[0]
+        for sesion in sesiones:
+            for j in range(10):
+                sesion.enviar_mensaje(f"mensaje {j}")
+        """el aviso de limite le llega a cada sesion limitada"""
+        for cola in recibidos:
+            while "demasiado rapido" not in cola.get(timeout=5):
+                pass
+        assert metricas.limitados.valor(("tcp", "ip")) - antes >= 20
+    finally:
+        compartida.cerrar()
+        next(servidor, None)
+
+
+class ColaFalsa:
+    def __init__(self):
+        self.tramas = []
+
+    def encolar(self, datos):
+        self.tramas.append(datos)
+        return True
+
+
+class ControlFalso:
+    def entrar(self):
+        return True
+
+
+def test_abrir_con_una_sesion_viva_la_cierra_y_rechaza():
+    cola = ColaFalsa()
+    atendidas = []
+    servidor = pasarela.PasarelaServidor(None, ("127.0.0.1", 1), lambda conn, addr, control: atendidas.append(conn),
+                                         ControlFalso(), cola)
+    servidor.abrir(7, b"ana")
+    vieja = servidor.sesiones[7]
+    servidor.abrir(7, b"beto")
+    assert 7 not in servidor.sesiones
+    assert vieja.recv(1024) == b"ana"
+    assert vieja.recv(1024) == b""
+    assert b"ERROR" in cola.tramas[-1]
+    """al cerrarse la vieja no se lleva a otra sesion que haya tomado su numero"""
+    servidor.abrir(7, b"carla")
+    nueva = servidor.sesiones[7]
+    vieja.close()
+    assert servidor.sesiones[7] is nueva
+
+
+def test_un_envio_con_varias_lineas_llega_como_varios_mensajes():
+    recibidos = []
+    sesion = pasarela.SesionPasarela(None, 1, recibidos.append)
+    sesion.recibir(b"Usuario: ")
+    sesion.recibir(b"[ana] hola\n[beto] chau\n")
+    assert recibidos == ["[ana] hola\n", "[beto] chau\n"]
+
+
+def esperar(condicion, timeout=5):
+    fin = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < fin
+        time.sleep(0.01)
+
+
+def test_sesion_binaria_se_reconecta_por_otra_pasarela(monkeypatch):
+    """con reconectar=True un corte de la pasarela no termina la sesion: se abre otra pasarela y
+    la sesion se retoma con su token"""
+    import cliente_tcp
+    from conftest import levantar_tcp
+
+    monkeypatch.setattr(reanudacion, "ESPERA_BASE", 0.05)
+    servidor = levantar_tcp("hilos", monkeypatch)
+    port = next(servidor)
+    compartida = pasarela.PasarelaCompartida(HOST, port)
+    recibidos = queue.SimpleQueue()
+    observador = cliente_tcp.ClienteTCP()
+    try:
+        sesion = compartida.actual().abrir(recibidos.put, binario=True, reconectar=True)
+        assert sesion.conectar("vuelve")[0]
+        esperar(lambda: sesion.token)
+        primera = compartida.pasarela
+        primera.cerrar()
+        while True:
+            registro = recibidos.get(timeout=5)
+            assert registro is not None
+            if registro.contenido == pasarela.AVISO_PERDIDA:
+                break
+        esperar(lambda: not sesion.caido and sesion.token)
+        assert compartida.pasarela is not primera and sesion.conectado
+
+        assert observador.conectar("mira")[0]
+        sesion.enviar_mensaje("de vuelta")
+        while "de vuelta" not in observador.recibir_mensaje():
+            pass
+        """un registro de la sesion retomada tambien le llega a ella"""
+        observador.enviar_mensaje("hola")
+        while True:
+            registro = recibidos.get(timeout=5)
+            if registro.tipo == binario.GRUPAL and registro.contenido == "hola":
+                break
+    finally:
+        observador.cerrar()
+        sesion.cerrar()
+        compartida.actual().cerrar()
+        next(servidor, None)
@@ -0,0 +1,34 @@
+"""Perfilador por muestreo (perfilador.py): intervalos invalidos y el hilo que se cae"""
+import time
+
+import pytest
+
+import perfilador
+
+
+def test_intervalo_invalido():
+    for intervalo in (0, -1, float("nan"), float("inf")):
+        with pytest.raises(ValueError):
+            perfilador.activar(intervalo)
+    assert not perfilador.activo()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_si_el_hilo_se_cae_se_puede_volver_a_activar(monkeypatch):
+    def romper(frame):
+        raise RuntimeError("pila rota")
+
+    monkeypatch.setattr(perfilador, "_pila", romper)
+    perfilador.activar(0.001)
+    perfilador._hilo.join(5)
+    assert not perfilador.activo()
+
+    monkeypatch.undo()
+    perfilador.activar(0.001)
+    try:
+        fin = time.monotonic() + 5
+        while perfilador.muestras == 0:
+            assert time.monotonic() < fin
+            time.sleep(0.01)
+    finally:
+        perfilador.desactivar()
@@ -0,0 +1,61 @@
+"""Presencia de los usuarios UDP (presencia.py): vencimientos perezosos en el heap"""
+import pytest
+
+import presencia
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(presencia.time, "monotonic", reloj)
+    return reloj
+
+
+def test_vence_solo_la_que_no_mando_nada(reloj):
+    p = presencia.Presencia(inactividad=10)
+    ana, beto = ("10.0.0.1", 1), ("10.0.0.2", 2)
+    p.tocar(ana)
+    p.tocar(beto)
+    assert p.proxima() == 10
+    reloj.ahora += 6
+    p.tocar(ana)
+    assert p.vencidas() == []
+
+    reloj.ahora += 4
+    assert p.vencidas() == [beto]
+    assert len(p) == 1
+    """la entrada de ana se reprogramo al llegar a la punta del heap"""
+    assert p.proxima() == 6
+    reloj.ahora += 6
+    assert p.vencidas() == [ana]
+    assert len(p) == 0
+    assert p.proxima() is None
+
+
+def test_olvidar_y_volver(reloj):
+    p = presencia.Presencia(inactividad=10)
+    ana, beto = ("10.0.0.1", 1), ("10.0.0.2", 2)
+    p.tocar(beto)
+    p.olvidar(beto)
+    assert len(p) == 0
+    reloj.ahora += 10
+    assert p.vencidas() == []
+
+    """si vuelve a registrarse, su entrada vieja del heap no la expulsa antes de tiempo"""
+    p.tocar(ana)
+    p.olvidar(ana)
+    reloj.ahora += 5
+    p.tocar(ana)
+    reloj.ahora += 5
+    assert p.vencidas() == []
+    assert len(p) == 1
+    reloj.ahora += 5
+    assert p.vencidas() == [ana]
@@ -0,0 +1,96 @@
+"""Tramas (protocolo.py) con flujos partidos y juntados como los puede entregar TCP"""
+import socket
+
+import pytest
+
+import binario
+import compresion
+import pasarela
+import protocolo
+
+MENSAJES = [b"hola", "ñandú y acentos".encode(), b"", b"x" * 5000]
+FLUJO = b"".join(protocolo.enmarcar(m) for m in MENSAJES)
+
+
+def leer_todo(lector):
+    mensajes = []
+    mensaje = lector.pendiente()
+    while mensaje is not None:
+        mensajes.append(mensaje)
+        mensaje = lector.pendiente()
+    return mensajes
+
+
+@pytest.mark.parametrize("corte", range(1, len(protocolo.enmarcar(MENSAJES[1]))))
+def test_trama_partida_en_cualquier_byte(corte):
+    trama = protocolo.enmarcar(MENSAJES[1])
+    lector = protocolo.LectorTramas(capacidad=8)
+    lector.alimentar(trama[:corte])
+    assert lector.pendiente() is None
+    lector.alimentar(trama[corte:])
+    assert leer_todo(lector) == [MENSAJES[1]]
+
+
+def test_flujo_partido_en_todos_los_bytes():
+    lector = protocolo.LectorTramas(capacidad=16)
+    recibidos = []
+    for i in range(len(FLUJO)):
+        lector.alimentar(FLUJO[i:i + 1])
+        recibidos.extend(leer_todo(lector))
+    assert recibidos == MENSAJES
+
+
+def test_varias_tramas_en_un_recv():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(FLUJO)
+        lector = protocolo.LectorTramas()
+        assert [lector.siguiente(b) for _ in MENSAJES] == MENSAJES
+
+
+def test_largo_mayor_al_maximo():
+    lector = protocolo.LectorTramas()
+    with pytest.raises(protocolo.ErrorTrama):
+        lector.alimentar(protocolo.CABECERA.pack(protocolo.TAMANO_MAXIMO + 1) + b"x")
+    with pytest.raises(protocolo.ErrorTrama):
+        protocolo.enmarcar(b"x" * (protocolo.TAMANO_MAXIMO + 1))
+
+
+def test_fin_de_datos_a_mitad_de_trama():
+    a, b = socket.socketpair()
+    with b:
+        with a:
+            a.sendall(protocolo.enmarcar(b"completo") + protocolo.enmarcar(b"cortado")[:-3])
+        lector = protocolo.LectorTramas()
+        assert lector.siguiente(b) == b"completo"
+        assert lector.siguiente(b) is None
+
+
+@pytest.mark.parametrize("prefijo, modo, comprimir", [
+    (protocolo.MAGIA, "tramas", False),
+    (binario.MAGIA, "binario", False),
+    (compresion.MAGIA + binario.MAGIA, "binario", True),
+])
+def test_negociacion_con_el_prefijo_partido(prefijo, modo, comprimir):
+    """el prefijo y la trama con el nombre llegan de a un byte"""
+    datos = prefijo + protocolo.enmarcar(b"ana")
+    a, b = socket.socketpair()
+    with a, b:
+        for i in range(len(datos)):
+            a.sendall(datos[i:i + 1])
+        primero = protocolo.leer_inicio(b, (pasarela.MAGIA,), tamano=1)
+        lector = protocolo.negociar(primero)
+        assert (lector.modo, lector.comprimir) == (modo, comprimir)
+        assert lector.siguiente(b) == b"ana"
+
+
+def test_inicio_de_otros_prefijos_y_texto():
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(pasarela.MAGIA[:2])
+        a.sendall(pasarela.MAGIA[2:] + b"resto")
+        assert protocolo.leer_inicio(b, (pasarela.MAGIA,)).startswith(pasarela.MAGIA)
+        """un cliente de texto plano no espera a nada mas"""
+        a.sendall(b"ana")
+        assert protocolo.leer_inicio(b, (pasarela.MAGIA,)) == b"ana"
+    assert not protocolo.incompleto(b"\x00XX")
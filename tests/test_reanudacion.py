@@ -0,0 +1,76 @@
+"""Tokens para reanudar sesiones (reanudacion.py) y lo que se repite al volver (Historial.desde)"""
+import historial
+import reanudacion
+
+
+def test_token_valido_solo_para_su_nombre(tmp_path):
+    r = reanudacion.Reanudacion(str(tmp_path))
+    token = r.token("ana")
+    assert r.valido("ana", token)
+    assert not r.valido("beto", token)
+    """la clave queda en disco: otra instancia (el servidor reiniciado) acepta el mismo token"""
+    assert reanudacion.Reanudacion(str(tmp_path)).valido("ana", token)
+    otra = tmp_path / "otro"
+    otra.mkdir()
+    assert not reanudacion.Reanudacion(str(otra)).valido("ana", token)
+
+
+def test_token_alterado_o_vencido(tmp_path, monkeypatch):
+    r = reanudacion.Reanudacion(str(tmp_path))
+    vence, _, firma = r.token("ana").partition(".")
+    otra = "0" if firma[0] != "0" else "1"
+    assert not r.valido("ana", f"{vence}.{otra}{firma[1:]}")
+    """estirar el vencimiento cambia lo firmado"""
+    assert not r.valido("ana", f"{int(vence) + 3600}.{firma}")
+    assert not r.valido("ana", "basura")
+    assert not r.valido("ana", "")
+    monkeypatch.setattr(reanudacion, "DURACION", -1)
+    assert not r.valido("ana", r.token("ana"))
+
+
+def test_pedido_ida_y_vuelta():
+    assert reanudacion.leer_pedido(reanudacion.pedido("ana maria", "1.abc", 42)) == ("ana maria", ("1.abc", 42))
+    assert reanudacion.leer_pedido("ana") == ("ana", None)
+    """un pedido mal formado se toma como nombre"""
+    assert reanudacion.leer_pedido("/reanudar 1.abc x ana") == ("/reanudar 1.abc x ana", None)
+    assert reanudacion.leer_pedido("/reanudar 1.abc 3 ") == ("/reanudar 1.abc 3 ", None)
+
+
+def test_esperas_crecen_hasta_el_tope():
+    esperas = reanudacion.esperas(base=1, maxima=8)
+    valores = [next(esperas) for _ in range(50)]
+    assert all(0 <= v <= 8 for v in valores)
+    assert valores[0] <= 1
+
+
+def test_desde_repite_solo_lo_que_se_perdio(tmp_path):
+    h = historial.Historial(str(tmp_path), memoria=5)
+    h.guardar("[beto] viejo\n", sala="general", de="beto")
+    ultimo = h.guardar("[ana] visto\n", sala="general", de="ana")
+    h.guardar("[beto] nuevo\n", sala="general", de="beto")
+    h.guardar("[ana] propio\n", sala="general", de="ana")
+    h.guardar("[carla] otra sala\n", sala="juegos", de="carla")
+    h.guardar("[PRIVADO de beto] hola\n", de="beto", para="ana")
+    registros, completo = h.desde(ultimo, "ana", {"general"})
+    assert completo
+    """sin los grupales que mando ella misma ni los de salas donde no esta, en orden de id"""
+    assert [r["texto"] for r in registros] == ["[beto] nuevo\n", "[PRIVADO de beto] hola\n"]
+
+    """si el buffer ya descarto mensajes posteriores al ultimo visto, avisa que falta algo"""
+    for i in range(10):
+        h.guardar(f"[beto] {i}\n", sala="general", de="beto")
+    registros, completo = h.desde(ultimo, "ana", {"general"})
+    assert not completo
+    assert [r["texto"] for r in registros][-1] == "[beto] 9\n"
+    h.vaciar()
+
+
+def test_al_entrar_sin_token_no_repite_privados(tmp_path):
+    h = historial.Historial(str(tmp_path))
+    h.guardar("[beto] hola\n", sala="general", de="beto")
+    h.guardar("[PRIVADO de beto] secreto\n", de="beto", para="ana")
+    h.guardar("[carla] otra sala\n", sala="juegos", de="carla")
+    assert [r["texto"] for r in h.al_entrar("general")] == ["[beto] hola\n"]
+    """con el token valido (el nucleo pasa el nombre) vuelven tambien sus privados"""
+    assert [r["texto"] for r in h.al_entrar("general", "ana")] == ["[beto] hola\n", "[PRIVADO de beto] secreto\n"]
+    h.vaciar()
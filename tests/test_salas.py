@@ -0,0 +1,69 @@
+"""Salas (salas.py): el indice de membresia en los dos sentidos y los comandos /join, /leave y /rooms"""
+import pytest
+
+import salas
+
+
+def test_unir_salir_y_quitar_mantienen_los_dos_indices():
+    indice = salas.IndiceSalas()
+    ana, beto = object(), object()
+    assert indice.unir(ana, salas.SALA_GENERAL)
+    assert indice.unir(beto, salas.SALA_GENERAL)
+    assert indice.unir(ana, "juegos")
+    assert not indice.unir(ana, "juegos")
+    assert set(indice.miembros(salas.SALA_GENERAL)) == {ana, beto}
+    assert indice.miembros("juegos") == (ana,)
+    assert indice.sala_activa(ana) == "juegos"
+    assert indice.salas_de(ana) == {salas.SALA_GENERAL, "juegos"}
+
+    """al salir de la sala activa se vuelve a la general, y la sala vacia desaparece"""
+    assert indice.salir(ana, "juegos")
+    assert not indice.salir(ana, "juegos")
+    assert indice.sala_activa(ana) == salas.SALA_GENERAL
+    assert indice.listar() == [(salas.SALA_GENERAL, 2)]
+
+    indice.unir(beto, "musica")
+    assert indice.quitar(beto) == {salas.SALA_GENERAL, "musica"}
+    assert indice.miembros(salas.SALA_GENERAL) == (ana,)
+    assert indice.miembros("musica") == ()
+    assert indice.sala_activa(beto) == salas.SALA_GENERAL
+    assert indice.quitar(beto) == set()
+
+
+def test_comandos():
+    indice = salas.IndiceSalas()
+    ana, beto = "ana", "beto"
+    indice.unir(ana, salas.SALA_GENERAL)
+    indice.unir(beto, salas.SALA_GENERAL)
+
+    respuesta, avisos = salas.ejecutar(indice, ana, "ana", "/join juegos")
+    assert "Entraste a la sala juegos" in respuesta
+    assert avisos == [("juegos", "*** ana entro a la sala juegos ***\n")]
+    """volver a una sala en la que ya esta solo cambia la sala activa, sin avisar"""
+    salas.ejecutar(indice, ana, "ana", f"/join {salas.SALA_GENERAL}")
+    assert salas.ejecutar(indice, ana, "ana", "/join juegos")[1] == []
+    assert salas.ejecutar(indice, beto, "beto", "/rooms")[0] == "Salas: *general(2), juegos(1)\n"
+    assert salas.ejecutar(indice, ana, "ana", "/rooms")[0] == "Salas: +general(2), *juegos(1)\n"
+
+    respuesta, avisos = salas.ejecutar(indice, ana, "ana", "/leave")
+    assert "ahora escribes en general" in respuesta
+    assert avisos == [("juegos", "*** ana salio de la sala juegos ***\n")]
+
+
+@pytest.mark.parametrize("texto", ["/leave", "/leave general", "/leave juegos", "/join", "/join a b",
+                                   "/join " + "x" * (salas.LARGO_MAXIMO + 1), "/salas"])
+def test_comandos_invalidos(texto):
+    indice = salas.IndiceSalas()
+    indice.unir("ana", salas.SALA_GENERAL)
+    with pytest.raises(salas.ErrorSala):
+        salas.ejecutar(indice, "ana", "ana", texto)
+    assert indice.salas_de("ana") == {salas.SALA_GENERAL}
+
+
+def test_etiqueta_y_es_comando():
+    assert salas.etiqueta(salas.SALA_GENERAL) == ""
+    assert salas.etiqueta("juegos") == "[#juegos] "
+    assert salas.es_comando("/join juegos")
+    assert salas.es_comando("/rooms")
+    assert not salas.es_comando("/joinjuegos")
+    assert not salas.es_comando("hola /join")
@@ -0,0 +1,36 @@
+"""Negociacion del modo en los dos motores de server_tcp"""
+import socket
+import time
+
+import protocolo
+from conftest import HOST
+
+
+def test_magia_partida_en_varios_envios(servidor_tcp):
+    with socket.create_connection((HOST, servidor_tcp), timeout=5) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        assert sock.recv(1024) == b"Usuario: "
+        datos = protocolo.MAGIA + protocolo.enmarcar(b"ana")
+        for i in range(len(datos)):
+            sock.sendall(datos[i:i + 1])
+            time.sleep(0.01)
+        """si se negocio texto plano la respuesta no viene en tramas y el lector falla con
+        ErrorTrama; antes del aviso de entrada puede venir el historial"""
+        lector = protocolo.LectorTramas()
+        mensaje = lector.siguiente(sock)
+        while b"ana se unio" not in mensaje:
+            mensaje = lector.siguiente(sock)
+
+
+def test_ritmo_de_aceptacion_en_rafaga(servidor_tcp_ritmo):
+    """con 10 conexiones por segundo (y 10 de rafaga) 25 conexiones juntas tardan al menos ~1.5 s
+    en recibir el prompt, con cualquiera de los motores"""
+    inicio = time.monotonic()
+    conexiones = [socket.create_connection((HOST, servidor_tcp_ritmo), timeout=10) for _ in range(25)]
+    try:
+        for sock in conexiones:
+            assert sock.recv(1024) == b"Usuario: "
+        assert time.monotonic() - inicio >= 1.3
+    finally:
+        for sock in conexiones:
+            sock.close()
@@ -0,0 +1,73 @@
+"""Bucle de recepcion de server_udp"""
+import socket
+
+import metricas
+import nucleo
+from conftest import HOST
+
+
+def recibir_hasta(sock, texto):
+    while True:
+        datos, _ = sock.recvfrom(4096)
+        if texto in datos:
+            return datos
+
+
+def test_datagrama_invalido_no_corta_las_sesiones(servidor_udp):
+    ana = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    beto = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    intruso = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for sock in (ana, beto):
+        sock.settimeout(5)
+    try:
+        ana.sendto(b"ana", (HOST, servidor_udp))
+        recibir_hasta(ana, b"ana se unio")
+        beto.sendto(b"beto", (HOST, servidor_udp))
+        recibir_hasta(beto, b"beto se unio")
+
+        antes = metricas.errores.valor(("UnicodeDecodeError",))
+        intruso.sendto(b"\xff\xfe", (HOST, servidor_udp))
+        ana.sendto(b"hola despues del intruso", (HOST, servidor_udp))
+
+        assert b"[ana]" in recibir_hasta(beto, b"hola despues del intruso")
+        assert "ana" in nucleo.usuarios and "beto" in nucleo.usuarios
+        assert metricas.errores.valor(("UnicodeDecodeError",)) == antes + 1
+    finally:
+        for sock in (ana, beto, intruso):
+            sock.close()
+
+
+def test_history_no_frena_el_bucle(servidor_udp, monkeypatch):
+    """una pagina que tarda en leerse del disco no demora los mensajes de los demas"""
+    import threading
+    import time
+
+    leyendo = threading.Event()
+    seguir = threading.Event()
+
+    def pagina_lenta(sala, numero=1, tamano=None):
+        leyendo.set()
+        seguir.wait(5)
+        return []
+
+    monkeypatch.setattr(nucleo.historia, "pagina", pagina_lenta)
+    ana = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    beto = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for sock in (ana, beto):
+        sock.settimeout(5)
+    try:
+        ana.sendto(b"ana", (HOST, servidor_udp))
+        recibir_hasta(ana, b"ana se unio")
+        beto.sendto(b"beto", (HOST, servidor_udp))
+        recibir_hasta(beto, b"beto se unio")
+
+        ana.sendto(b"/history 2", (HOST, servidor_udp))
+        assert leyendo.wait(5)
+        inicio = time.monotonic()
+        beto.sendto(b"mientras tanto", (HOST, servidor_udp))
+        recibir_hasta(ana, b"mientras tanto")
+        assert time.monotonic() - inicio < 1
+    finally:
+        seguir.set()
+        for sock in (ana, beto):
+            sock.close()
@@ -0,0 +1,34 @@
+"""Capa confiable de UDP (udp_confiable.py)"""
+import socket
+
+import udp_confiable
+from udp_confiable import CABECERA_DATOS, DATOS, MAGIA, VENTANA
+
+DIRECCION = ("127.0.0.1", 9)
+
+
+def paquete(seq, contenido=b"x", sesion=7):
+    return CABECERA_DATOS.pack(MAGIA, DATOS, sesion, seq, 0, 1) + contenido
+
+
+def test_fuera_de_orden_acotado_a_la_ventana():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    canal = udp_confiable.CanalConfiable(sock)
+    try:
+        antes = udp_confiable.fuera_de_ventana.valor()
+        for seq in range(VENTANA, VENTANA + 1000):
+            assert canal.procesar(paquete(seq), DIRECCION) == []
+        assert udp_confiable.fuera_de_ventana.valor() - antes == 1000
+        par = canal.pares[DIRECCION]
+        assert not par.fuera_de_orden
+
+        """dentro de la ventana se guarda y se entrega en orden cuando llega el que falta"""
+        assert canal.procesar(paquete(VENTANA - 1, b"b"), DIRECCION) == []
+        assert len(par.fuera_de_orden) == 1
+        for seq in range(VENTANA - 2):
+            canal.procesar(paquete(seq), DIRECCION)
+        assert canal.procesar(paquete(VENTANA - 2, b"a"), DIRECCION) == [b"a", b"b"]
+        assert not par.fuera_de_orden
+    finally:
+        canal.cerrar()
+        sock.close()
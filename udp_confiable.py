@@ -0,0 +1,250 @@
+"""Capa de entrega confiable opcional sobre UDP. Un datagrama UDP se puede perder, duplicar o
+llegar desordenado y recvfrom(4096) corta lo que pase de 4096 bytes; esta capa agrega:
+
+- numeros de secuencia por par (direccion remota) y entrega en orden
+- ACK acumulativo + mapa de ACK selectivos de los 64 paquetes siguientes
+- retransmision con temporizador calculado a partir del RTT (estimador de Jacobson/Karels,
+  con backoff exponencial y el algoritmo de Karn para no medir paquetes retransmitidos)
+- descarte de duplicados, y de paquetes mas alla de la ventana (un emisor nunca tiene mas de
+  VENTANA en vuelo, asi un par no puede hacer crecer sin limite el buffer de fuera de orden)
+- fragmentacion de mensajes grandes en paquetes de TAMANO_FRAGMENTO y reensamblado
+
+Los paquetes confiables empiezan con MAGIA (un byte 0, que ningun mensaje de texto tiene al
+principio), asi el servidor atiende a la vez clientes confiables y clientes de texto plano.
+
+Formato:
+    DATOS: MAGIA tipo=1 sesion:u32 seq:u32 indice:u16 total:u16 contenido
+    ACK:   MAGIA tipo=2 sesion:u32 acumulado:u32 mapa:u64
+
+sesion es un numero al azar de quien envia los datos; si cambia (por ejemplo porque el otro
+extremo se reinicio) el receptor empieza de nuevo desde la secuencia 0."""
+import collections
+import random
+import struct
+import threading
+import time
+
+import metricas
+
+MAGIA = b"\x00R"
+DATOS = 1
+ACK = 2
+CABECERA_DATOS = struct.Struct("!2sBIIHH")
+CABECERA_ACK = struct.Struct("!2sBIIQ")
+
+TAMANO_FRAGMENTO = 1200
+VENTANA = 256
+RTO_INICIAL = 0.2
+RTO_MINIMO = 0.02
+RTO_MAXIMO = 3.0
+MAX_REINTENTOS = 12
+
+fuera_de_ventana = metricas.Contador("chat_udp_fuera_de_ventana_total",
+                                     "Paquetes confiables descartados por llegar mas alla de la ventana del receptor")
+
+
+def es_confiable(datos):
+    return datos[:len(MAGIA)] == MAGIA
+
+
+class _Par:
+    """Estado de la comunicacion con una direccion remota"""
+
+    def __init__(self):
+        # lado emisor
+        self.sesion = random.getrandbits(32)
+        self.siguiente_seq = 0
+        self.en_vuelo = {}
+        self.por_enviar = collections.deque()
+        self.srtt = None
+        self.rttvar = None
+        self.rto = RTO_INICIAL
+        # lado receptor
+        self.sesion_remota = None
+        self.esperado = 0
+        self.fuera_de_orden = {}
+        self.armando = []
+
+    def medir_rtt(self, muestra):
+        """Actualiza SRTT, RTTVAR y RTO como en el RFC 6298"""
+        if self.srtt is None:
+            self.srtt = muestra
+            self.rttvar = muestra / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - muestra)
+            self.srtt = 0.875 * self.srtt + 0.125 * muestra
+        self.rto = min(RTO_MAXIMO, max(RTO_MINIMO, self.srtt + 4 * self.rttvar))
+
+
+class CanalConfiable:
+    """Envia y recibe mensajes confiables por un socket UDP ya creado. procesar() se llama con
+    cada datagrama recibido; un hilo propio retransmite lo que no se confirmo a tiempo.
+    al_perder(addr) se llama si un par deja de responder despues de MAX_REINTENTOS"""
+
+    def __init__(self, sock, al_perder=None):
+        self.sock = sock
+        self.al_perder = al_perder
+        self.pares = {}
+        self.lock = threading.Lock()
+        self.despertar = threading.Condition(self.lock)
+        self.activo = True
+        self.retransmitidos = 0
+        self.hilo = threading.Thread(target=self._retransmitir, daemon=True)
+        self.hilo.start()
+
+    def _par(self, addr):
+        par = self.pares.get(addr)
+        if par is None:
+            par = self.pares[addr] = _Par()
+        return par
+
+    def enviar(self, datos, addr):
+        """Parte el mensaje en fragmentos y los envia (o los deja esperando si la ventana esta llena)"""
+        fragmentos = [datos[i:i + TAMANO_FRAGMENTO] for i in range(0, len(datos), TAMANO_FRAGMENTO)] or [b""]
+        total = len(fragmentos)
+        with self.lock:
+            par = self._par(addr)
+            for indice, fragmento in enumerate(fragmentos):
+                paquete = CABECERA_DATOS.pack(MAGIA, DATOS, par.sesion, par.siguiente_seq, indice, total) + fragmento
+                par.siguiente_seq = (par.siguiente_seq + 1) & 0xFFFFFFFF
+                par.por_enviar.append(paquete)
+            self._llenar_ventana(par, addr)
+            self.despertar.notify()
+
+    def _llenar_ventana(self, par, addr):
+        ahora = time.monotonic()
+        while par.por_enviar and len(par.en_vuelo) < VENTANA:
+            paquete = par.por_enviar.popleft()
+            seq = CABECERA_DATOS.unpack_from(paquete)[3]
+            par.en_vuelo[seq] = [paquete, ahora, 0, ahora + par.rto]
+            self._sendto(paquete, addr)
+
+    def procesar(self, datos, addr):
+        """Procesa un datagrama recibido. Devuelve la lista de mensajes completos (bytes) listos
+        para entregar en orden, o None si el datagrama no es de esta capa"""
+        if not es_confiable(datos):
+            return None
+        tipo = datos[len(MAGIA)]
+        with self.lock:
+            if tipo == ACK and len(datos) >= CABECERA_ACK.size:
+                self._procesar_ack(datos, addr)
+                return []
+            if tipo == DATOS and len(datos) >= CABECERA_DATOS.size:
+                return self._procesar_datos(datos, addr)
+        return []
+
+    def _procesar_ack(self, datos, addr):
+        _, _, sesion, acumulado, mapa = CABECERA_ACK.unpack_from(datos)
+        par = self.pares.get(addr)
+        if par is None or sesion != par.sesion:
+            return
+        ahora = time.monotonic()
+        confirmados = [seq for seq in par.en_vuelo if _antes(seq, acumulado)]
+        base = acumulado
+        while mapa:
+            if mapa & 1 and base in par.en_vuelo:
+                confirmados.append(base)
+            mapa >>= 1
+            base = (base + 1) & 0xFFFFFFFF
+        for seq in confirmados:
+            _, enviado, reintentos, _ = par.en_vuelo.pop(seq)
+            if reintentos == 0:
+                par.medir_rtt(ahora - enviado)
+        self._llenar_ventana(par, addr)
+
+    def _procesar_datos(self, datos, addr):
+        _, _, sesion, seq, indice, total = CABECERA_DATOS.unpack_from(datos)
+        par = self._par(addr)
+        if par.sesion_remota != sesion:
+            """otro extremo nuevo o reiniciado: se empieza de cero"""
+            par.sesion_remota = sesion
+            par.esperado = 0
+            par.fuera_de_orden.clear()
+            par.armando = []
+
+        if _antes(seq, par.esperado) or seq in par.fuera_de_orden:
+            """duplicado: se descarta pero se vuelve a confirmar por si el ACK anterior se perdio"""
+            self._enviar_ack(par, addr)
+            return []
+        if (seq - par.esperado) & 0xFFFFFFFF >= VENTANA:
+            fuera_de_ventana.inc()
+            return []
+        par.fuera_de_orden[seq] = (indice, total, bytes(datos[CABECERA_DATOS.size:]))
+
+        listos = []
+        while par.esperado in par.fuera_de_orden:
+            indice, total, contenido = par.fuera_de_orden.pop(par.esperado)
+            par.esperado = (par.esperado + 1) & 0xFFFFFFFF
+            par.armando.append(contenido)
+            if indice == total - 1:
+                listos.append(b"".join(par.armando))
+                par.armando = []
+        self._enviar_ack(par, addr)
+        return listos
+
+    def _enviar_ack(self, par, addr):
+        mapa = 0
+        for i in range(63):
+            if ((par.esperado + 1 + i) & 0xFFFFFFFF) in par.fuera_de_orden:
+                mapa |= 1 << (i + 1)
+        self._sendto(CABECERA_ACK.pack(MAGIA, ACK, par.sesion_remota, par.esperado, mapa), addr)
+
+    def _sendto(self, paquete, addr):
+        """Si el socket no es bloqueante y su buffer esta lleno el paquete se cuenta como perdido:
+        los datos se retransmiten al vencer el temporizador y un ACK se repite con el proximo"""
+        try:
+            self.sock.sendto(paquete, addr)
+        except OSError:
+            pass
+
+    def _retransmitir(self):
+        """Hilo que reenvia los paquetes vencidos y duerme hasta el proximo vencimiento"""
+        with self.lock:
+            while self.activo:
+                ahora = time.monotonic()
+                proximo = ahora + 1.0
+                perdidos = []
+                for addr, par in list(self.pares.items()):
+                    for seq, entrada in list(par.en_vuelo.items()):
+                        paquete, _, reintentos, vence = entrada
+                        if vence <= ahora:
+                            if reintentos >= MAX_REINTENTOS:
+                                perdidos.append(addr)
+                                break
+                            entrada[1] = ahora
+                            entrada[2] = reintentos + 1
+                            entrada[3] = vence = ahora + min(RTO_MAXIMO, par.rto * (2 ** entrada[2]))
+                            self.retransmitidos += 1
+                            self._sendto(paquete, addr)
+                        proximo = min(proximo, vence)
+                for addr in perdidos:
+                    self.pares.pop(addr, None)
+                if perdidos and self.al_perder is not None:
+                    self.lock.release()
+                    try:
+                        for addr in perdidos:
+                            self.al_perder(addr)
+                    finally:
+                        self.lock.acquire()
+                self.despertar.wait(max(0.0, proximo - time.monotonic()))
+
+    def pendientes(self, addr=None):
+        """Paquetes sin confirmar (de un par o de todos)"""
+        with self.lock:
+            pares = [self.pares[addr]] if addr in self.pares else ([] if addr else self.pares.values())
+            return sum(len(p.en_vuelo) + len(p.por_enviar) for p in pares)
+
+    def olvidar(self, addr):
+        """Borra el estado de un par (por ejemplo cuando el usuario se va)"""
+        with self.lock:
+            self.pares.pop(addr, None)
+
+    def cerrar(self):
+        with self.lock:
+            self.activo = False
+            self.despertar.notify()
+
+
+def _antes(a, b):
+    """True si la secuencia a es anterior a b (comparacion con vuelta de 32 bits)"""
+    return a != b and ((b - a) & 0xFFFFFFFF) < 0x80000000